@@ -1,4 +1,4 @@
-from flask import Flask, request, redirect, url_for, render_template
+from flask import Flask, request, redirect, url_for, render_template, g
 import requests
 from urllib.parse import quote, unquote
 import sys
@@ -7,14 +7,38 @@ from feature_engineering import test_playlist_to_csv
 from analysis import playlist_analysis
 from recommendation import spotify_ml_model_eval_2
 import json
+from contextlib import ExitStack
 from concerts import concert_extraction
 
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
+from commons.resilience import Deadline, DeadlineExceeded, CircuitOpenError, REQUEST_DEADLINE
+from commons.call_metrics import metrics_scope
 
 # create the flask app
 app = Flask(__name__)
 
+# count the Spotify and Ticketmaster calls made while serving each request
+@app.before_request
+def start_call_metrics():
+
+    g.call_metrics_scope = ExitStack()
+    g.call_metrics = g.call_metrics_scope.enter_context(metrics_scope(f"{request.method} {request.path}", log=False))
+
+# log the calls of the request, if it made any
+@app.teardown_request
+def log_call_metrics(exception):
+
+    scope = g.pop('call_metrics_scope', None)
+
+    if scope is None:
+        return
+
+    scope.close()
+
+    if g.call_metrics.totals()['calls'] > 0:
+        print(g.call_metrics.summary())
+
 # application route for the home page
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -27,10 +51,10 @@ def index():
                     
                     # get the user input playlist and extract the details in a csv file
                     user_text = request.form['text']
-                    filename, status = test_playlist_to_csv.playlist_to_csv(user_text)
+                    filename, status = test_playlist_to_csv.playlist_to_csv(user_text, Deadline(REQUEST_DEADLINE))
 
-                    # if the user has entered an invalid playlist link
-                    if status == 400:
+                    # if the user has entered an invalid playlist link or Spotify did not answer in time
+                    if status != 200:
                             
                                 # redirect to the error page
                                 return redirect(url_for('error'))
@@ -50,18 +74,25 @@ def index():
                 # if the user has pressed the recomend button
                 elif request.form['action'] == 'recomend':
 
+                    # the whole request shares one deadline
+                    deadline = Deadline(REQUEST_DEADLINE)
+
                     # get the user input playlist and extract the details in a csv file
                     user_text = request.form['text']
-                    filename, status = test_playlist_to_csv.playlist_to_csv(user_text)
+                    filename, status = test_playlist_to_csv.playlist_to_csv(user_text, deadline)
 
-                    # if the user has entered an invalid playlist link
-                    if status == 400:
+                    # if the user has entered an invalid playlist link or Spotify did not answer in time
+                    if status != 200:
 
                             # redirect to the error page
                             return redirect(url_for('error'))
 
                     # get the predicted genre of the user
-                    user_genre = spotify_ml_model_eval_2.getGenre(filename=filename)
+                    try:
+                        user_genre = spotify_ml_model_eval_2.getGenre(filename=filename, deadline=deadline)
+
+                    except DeadlineExceeded:
+                        return redirect(url_for('error'))
 
                     # serialize the array as a string
                     user_genre_str = json.dumps(user_genre) 
@@ -173,7 +204,12 @@ def recomend():
 
             # generate the recommended events from ticketmaster
             genre_str = ', '.join(user_genre)
-            concert_extraction.get_events(city, start_date, end_date, genre_str)
+            try:
+                concert_extraction.get_events(city, start_date, end_date, genre_str, Deadline(REQUEST_DEADLINE))
+
+            # Ticketmaster did not answer in time or is unavailable
+            except (DeadlineExceeded, CircuitOpenError):
+                return redirect(url_for('error'))
 
             # redirect to the show recomendations page
             return redirect(url_for('showRecomendations'))
@@ -11,19 +11,31 @@
         python3 application/ticketmaster.py
 """
 
-from requests import get
 import json
 import os
+import sys
 import time
+from pathlib import Path
 from dotenv import load_dotenv
-
-
-# Set up the Ticket Master credentials
+from requests.exceptions import RequestException
+# Set up the Ticket Master credentials, before the commons modules read their settings
 dotenv_path = 'utils/.env'
 load_dotenv(dotenv_path ,verbose=False)
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from commons.endpoints import TICKETMASTER_BASE_URL
+from commons.http_transport import get
+from commons.rate_limit import ticketmaster_limiter, retry_after_delay
+from commons.resilience import deadline_scope, check_deadline
+from commons.priority import priority_scope, INTERACTIVE
+from commons.call_metrics import record_retry
+
 
 api_key = os.getenv("TICKET_MASTER_KEY")
 
+# Number of searches when Ticketmaster reports events that could not be read, and number of
+# attempts of a rate limited request
+MAX_ATTEMPTS = 3
+
 
 def api_endpoint():
     """
@@ -36,10 +48,42 @@ def api_endpoint():
             str: string containing endpoint URL
     """
     # Define the API endpoint URL
-    endpoint_url = "https://app.ticketmaster.com/discovery/v2/events.json"
+    endpoint_url = f"{TICKETMASTER_BASE_URL}/events.json"
 
     return endpoint_url
 
+def send_request(endpoint_url, params):
+    """
+        Create a function to send a request under the shared Ticketmaster budget. A rate limited
+        (429) request is retried once its Retry-After has passed, up to MAX_ATTEMPTS times
+
+        Args:
+            param1 (str): endpoint URL
+            param2 (dict): parameters for the api request
+
+        Returns:
+            Response: response of the last attempt
+    """
+
+    attempt = 0
+
+    while True:
+
+        ticketmaster_limiter.acquire()
+        response = get(endpoint_url, params=params)
+
+        attempt += 1
+
+        if response.status_code != 429 or attempt >= MAX_ATTEMPTS:
+            return response
+
+        retry_after = retry_after_delay(response, attempt - 1)
+        print(f"Ticketmaster rate limit exceeded. Retrying in {retry_after:.1f} seconds.")
+
+        # Every process sharing the budget holds off until Retry-After has passed
+        ticketmaster_limiter.block_for(retry_after)
+        record_retry("GET", endpoint_url)
+
 def api_request(location, start_date, end_date, genre):
     """
         Create a function to generate API request using inputs
@@ -65,39 +109,43 @@ def api_request(location, start_date, end_date, genre):
         "page" : 0
     }
 
-    # Send a GET request to the API endpoint
     endpoint_url = api_endpoint()
-    response = get(endpoint_url, params=params)
+    total_entries = 0
 
-    result = response.json()
-    total_pages = result["page"]["totalPages"]
-    total_entries = result["page"]["totalElements"]
+    try:
 
-    # Check the status code of the response
-    if response.status_code == 200:
+        # Send a GET request to the API endpoint
+        response = send_request(endpoint_url, params)
 
-        event_data = []
-        
-        try:
+        # Check the status code of the response
+        if response.status_code != 200:
 
-            for page in range(total_pages):
+            # Print an error message
+            print("Error: The API request failed with status code {}".format(response.status_code))
 
-                params["page"] = page
-                response = get(endpoint_url, params=params)
+            return [], 0
 
-                event_data += response.json()["_embedded"]["events"]
+        result = response.json()
+        total_pages = result["page"]["totalPages"]
+        total_entries = result["page"]["totalElements"]
 
-        except: 
+        # The first page was just fetched, only the following ones are requested
+        event_data = result.get("_embedded", {}).get("events", [])
 
-            event_data = []
+        for page in range(1, total_pages):
 
-    else:
+            params["page"] = page
+            response = send_request(endpoint_url, params)
 
-        event_data = []
+            event_data += response.json()["_embedded"]["events"]
+
+    # Dropped connection, timeout or unreadable page. Once the number of events is known, get_events searches again
+    except (KeyError, ValueError, RequestException) as error:
+
+        print("Error: The API request failed: {!r}".format(error))
+
+        return [], total_entries
 
-        # Print an error message
-        print("Error: The API request failed with status code {}".format(response.status_code))
-        
     return event_data, total_entries
 
 def get_event_features(event):
@@ -182,8 +230,6 @@ def get_event_features(event):
 
 def parse_events(location, start_date, end_date, genre):
 
-    time.sleep(2)
-
     events_dict = {
         "no_of_events" : None,
         "events" : []
@@ -211,7 +257,21 @@ def parse_events(location, start_date, end_date, genre):
     return events_dict
 
 # defining a function to get events
-def get_events(location, start_date, end_date, genre):
+def get_events(location, start_date, end_date, genre, deadline=None):
+    """
+        Create a function to get the events matching the inputs and save them to a json file
+
+        Args:
+            param1 (str): location where to search for events
+            param2 (str): start date of your search range
+            param3 (str): end date of your search range
+            param4 (str): str of comma separated genres you want to search for
+            param5 (Deadline): deadline of the web request, None for no deadline
+
+        Raises:
+            DeadlineExceeded: the deadline passed before Ticketmaster answered
+            CircuitOpenError: Ticketmaster is unavailable
+    """
 
     start_time = time.time()
 
@@ -223,20 +283,26 @@ def get_events(location, start_date, end_date, genre):
     end_date = end_date
     genre = genre
 
-    # calling the function to get events
-    events = parse_events(location, start_date, end_date, genre)
+    # a user is waiting, the calls go ahead of background work on the shared budget
+    with deadline_scope(deadline), priority_scope(INTERACTIVE):
 
-    # checking if there are any events
-    if events["no_of_events"] == 0:
-        print(404)
-    else:
+        # calling the function to get events
+        events = parse_events(location, start_date, end_date, genre)
+
+        attempt = 1
+
+        # Events exist but none could be read, retry a bounded number of times
+        while events["no_of_events"] != 0 and len(events["events"]) == 0 and attempt < MAX_ATTEMPTS:
+
+            check_deadline()
+            record_retry("GET", api_endpoint())
 
-        while len(events["events"]) == 0:
-            
             events = parse_events(location, start_date, end_date, genre)
+            attempt += 1
 
-            if len(events["events"]) == events["no_of_events"]:
-                break    
+    # checking if there are any events
+    if events["no_of_events"] == 0:
+        print(404)
     
     # saving the events to a json file
     with open("data/events_scraped.json", "w") as outfile:
@@ -3,88 +3,31 @@ This script gets the features of a song using the Spotify API.
 
 '''
 from dotenv import load_dotenv
-import os
-import base64
-from requests import post, get
-import json
-import time
-
-
+import sys
+import asyncio
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+# Load .env file, before the commons modules read their settings
 load_dotenv()
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from commons.endpoints import SPOTIFY_API_BASE_URL
+from commons.spotify_client import get_entities
+from commons.spotify_async import AsyncSpotifyClient, run_sync
+from commons.track_records import TrackRecord, join_track_features
+from commons.spotify_playlists import get_playlist_track_ids, iter_playlist_track_ids
+from commons.track_columns import build_playlist_frame
+from commons.resilience import submit_in_context
 
-# Load CLIENT_ID and CLIENT_SECRET for accessing the API
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
-
-
-# Get token using client credentials
-def get_token():
-
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-
-    # Base url to be used
-    url = "https://accounts.spotify.com/api/token"
-
-    # Declare headers
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type":"application/x-www-form-urlencoded"
-        }
-    
-    data = {"grant_type": "client_credentials"}
-
-    result = post(url, headers=headers, data=data)
-
-    json_result = json.loads(result.content)
-
-    token = json_result["access_token"]
-    return token
-
-
-# Set Authorization
-def get_auth_header(token):
-
-    return {"Authorization":"Bearer " + token}
-
-
-def api_request(url, headers, params=None, data=None):
-    """
-    Create a function to generate API request using custom url, parameters and data
-
-    Args:
-        param1 (str): url of the request
-        param2 (str): declared header
-        param3 (dict): parameters for the api request
-        param4 (dict): additional data to pass
-
-    Returns:
-        dict: return dict format of response. If response empty, return error
-    """
-
-    retry = True
 
-    while retry:
+TRACKS_URL = f"{SPOTIFY_API_BASE_URL}/tracks"
+ARTISTS_URL = f"{SPOTIFY_API_BASE_URL}/artists"
+AUDIO_FEATURES_URL = f"{SPOTIFY_API_BASE_URL}/audio-features"
 
-        response = get(url, headers=headers, params=params, data=data)
+# Number of playlist pages whose tracks and features are fetched at the same time
+PIPELINE_WORKERS = 4
 
-        # Status Code == 200 means successful request 
-        if response.status_code == 200:
-            return response
-        
-        # Time out error - API Request limit exceeded
-        elif response.status_code == 429:
-
-            retry_after = int(response.headers.get('Retry-After'))
-            print(f"Rate limit exceeded. Wait for {retry_after} seconds before trying again.")
-            return 'Try again'
-        
-        else:
-
-            print(f"Request failed with error {response.status_code}: {response.text}")
-            
-            return None
 
 def get_mul_artists_genres(token, artist_id_list):
     """
@@ -99,148 +42,53 @@ def get_mul_artists_genres(token, artist_id_list):
             corresponding index
     """
     
-    # Declare list to be returned 
-    genre_artist_list = []
-
-    url = f"https://api.spotify.com/v1/artists/?ids={artist_id_list}"
-
-    headers = get_auth_header(token)
-
-    playlist_result = api_request(url, headers=headers)
-
-    if playlist_result is None or playlist_result == 'Try again':
-
-        return ("Failed to retrieve playlist information.")
-
-    else:
-
-        json_result = json.loads(playlist_result.content)
-
-        # Get dictionary where genres are located
-        genres = json_result["artists"]
-
-        # for each entry in dictionary, get genre for each artist
-        for genre in genres:
-
-            genre_artist = genre["genres"]
+    # Artists are read through the on-disk cache, only unknown artists are requested
+    artist_data = get_entities(token, ARTISTS_URL, artist_id_list.split(','), 50, 'artists', 'artist')
 
-            genre_artist_list.append(genre_artist)
+    # for each artist, get its genres, empty if the artist could not be retrieved
+    genre_artist_list = [artist["genres"] if artist is not None else [] for artist in artist_data]
 
-        return genre_artist_list
+    return genre_artist_list
 
 
 def get_track_feature_info(track_features):
     """
-    This function parses a dictionary containing track features and returns 
+    This function parses a dictionary containing track features and returns
     the features needed from this dictionary
 
     Args:
-        param1 (dict): track_features containing all info 
+        param1 (dict): track_features containing all info
 
     Returns:
-        dict: Dictionary containing all the features needed for the track
+        TrackRecord: record holding the features of the track, None if they are missing
 
     """
-    
-    # Declare dictionary to be returned
-    track_feature_info = {
-        "id" : None, 
-        "danceability": None,
-        "energy": None,
-        "key": None,
-        "loudness": None,
-        "mode": None,
-        "speechiness": None,
-        "acousticness": None,
-        "instrumentalness": None,
-        "liveness": None,
-        "valence": None,
-        "tempo": None,
-        "duration_ms": None,
-        "time_signature": None
-        }
-    
-    try: 
-
-        # Parse all the necessary information
-        track_feature_info["id"] = track_features["id"]
-        track_feature_info["danceability"] = track_features["danceability"]
-        track_feature_info["energy"] = track_features["energy"]
-        track_feature_info["key"] = track_features["key"]
-        track_feature_info["loudness"] = track_features["loudness"]
-        track_feature_info["mode"] = track_features["mode"]
-        track_feature_info["speechiness"] = track_features["speechiness"]
-        track_feature_info["acousticness"] = track_features["acousticness"]
-        track_feature_info["instrumentalness"] = track_features["instrumentalness"]
-        track_feature_info["liveness"] = track_features["liveness"]
-        track_feature_info["valence"] = track_features["valence"]
-        track_feature_info["tempo"] = track_features["tempo"]
-        track_feature_info["duration_ms"] = track_features["duration_ms"]
-        track_feature_info["time_signature"] = track_features["time_signature"]
-
-        return track_feature_info
-    
-    except:
+
+    try:
+
+        return TrackRecord.from_features(track_features)
+
+    except (KeyError, TypeError):
 
         return None
 
-    
 
 
 def get_track_info(track):
     """
-    This function parses a dictionary containing track information and returns 
-    them needed from this dictionary
+    This function parses a dictionary containing track information and returns
+    the information needed from this dictionary
 
     Args:
-        param1 (dict): track_features containing all info 
+        param1 (dict): track containing all info
 
     Returns:
-        dict: Dictionary containing all the information needed for the track
+        TrackRecord: record holding the information of the track, genres are set by the caller
 
     """
-    
-    # Declare dictionary to be returned
-    tracks = {
-        "id" : None,
-        "name" : None, 
-        "artist id" : None,
-        "artists" : [],
-        "artist genre" : [],
-        "album type" : None,
-        "album id" : None,
-        "album name" : None,
-        "album release date" : None,
-        "duration_ms" : None,
-        "popularity" : None,
-    }
-
-    # Parse all the required track features
-    tracks["id"] = track["id"]
-    tracks["name"]= track["name"]
-    tracks["popularity"] = track["popularity"]
-    tracks["duration_ms"] = track["duration_ms"]
-    tracks["album type"] = track["album"]["album_type"]
-    tracks["album id"] = track["album"]["id"]
-    tracks["album name"] = track["album"]["name"]
-    tracks["album release date"] = track["album"]["release_date"]
 
-    # Get artist info separately
-    artists = track["artists"]
+    return TrackRecord.from_track(track)
 
-    artist_name_list = []
-    artist_id_list = []
-
-    # Extract artist info for name and id
-    for artist in artists:
-
-        artist_name_list.append(artist["name"])
-        artist_id_list.append(artist["id"])
-
-    tracks["artist id"] = artist_id_list
-    tracks["artists"] = artist_name_list
-
-    return tracks
 
 def get_songs_by_playlists(token, playlist_id):
     """
@@ -254,198 +102,203 @@ def get_songs_by_playlists(token, playlist_id):
     Returns:
         dict: Dictionary containing tracks for the playlist id
 
-    """
-    headers = get_auth_header(token)
+    Raises:
+        RuntimeError: the playlist or one of its pages could not be retrieved
 
+    """
     # Initialize dictionary to be returned
     playlist_info_dict = {
         'tracks' : None
         }
 
-    offset = 0
-    track_ids = []
+    # Pages are only walked when the playlist changed since it was last fetched
+    track_ids = get_playlist_track_ids(token, playlist_id)
 
-    # While loop to adjust for request limit and keep adding offset
-    while True:
-
-        url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?offset={offset}&limit=100"
-        headers = get_auth_header(token)
-
-        playlist_result = api_request(url, headers = headers)
+    playlist_info_dict['tracks'] = track_ids
+    
+    return playlist_info_dict     
 
-        if playlist_result is None or playlist_result == 'Try again':
+def get_track_genres(track, artist_genres):
+    """
+    This function looks up the genres of a track by artist ID. The genres of the
+    album's primary artist are used, falling back to the genres of the track's own
+    artists when the album artist has none (e.g. compilations by 'Various Artists')
 
-            print("Failed to retrieve playlist information.")
+    Args:
+        param1 (dict): track as returned by the API
+        param2 (dict): genres for each artist ID
 
-        else:
+    Returns:
+        list: genres of the track
+    """
 
-            playlist= json.loads(playlist_result.content)
+    genres = artist_genres.get(track["album"]["artists"][0]["id"], [])
 
-            # Get track info
-            playlist_tracks = playlist["items"]
+    if len(genres) > 0:
+        return genres
 
-            for item in playlist_tracks:
-                try:
-                    track_id = item['track']['id']
-                    track_ids.append(track_id)
-                except:
-                    pass
+    genres = []
 
-            # If more tracks exist, offset += 100
-            if playlist['next']:
+    for artist in track["artists"]:
 
-                offset += 100
+        for genre in artist_genres.get(artist["id"], []):
 
-                time.sleep(5)
+            if genre not in genres:
+                genres.append(genre)
 
-            else:
+    return genres
 
-                break
-            
-    playlist_info_dict['tracks'] = track_ids
-    
-    return playlist_info_dict     
 
-def get_mul_tracks(token, playlist_id, playlist_tracks):
+async def get_artists_genres_async(client, artist_ids, artist_genres=None):
     """
-    This function takes a playlist_id and a list of playlist
-    tracks and returns track information for each track from the playlist
-    in a dictionary
+    This function fetches the genres of every unique artist ID in full 50-id requests,
+    skipping artists whose genres are already known
 
     Args:
-        param1 (str): token
-        param2 (str): playlist id
-        param3 (dict): dictionary containing all track IDs as a value for the key: 'tracks'
+        param1 (AsyncSpotifyClient): client used to send the requests
+        param2 (list): artist IDs, duplicates allowed
+        param3 (dict): genres already known for each artist ID
 
     Returns:
-        dict: Dictionary two key-value pairs
-        {
-            'playlist id' : playlist id,
-            'tracks' : []
-         }
-
+        dict: genres for each artist ID
     """
-    track_id_list = playlist_tracks['tracks']
-    track_id_list = list(filter(lambda x: x is not None, track_id_list))
-    try:
-        if len(track_id_list) > 50:
-            params = {
-                'ids' : ','.join(track_id_list[:50]), # Get first 50 tracks
-                'market' : 'US'
-            }
-        else:
-            params = {
-                'ids' : ','.join(track_id_list[:len(track_id_list)]), # Get first 50 tracks
-                'market' : 'US'
-            }
-    
-    except:
 
-        print(track_id_list)
-
-
-    # Declare dictionary to be returned
-    playlist_track_info_dict = {
-        'playlist id' : playlist_id,
-        'tracks' : []
-    }
+    artist_genres = {} if artist_genres is None else artist_genres
 
-    tracks_list = []
-    artist_ids_list = []
+    missing_ids = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id not in artist_genres]
 
-    url = f"https://api.spotify.com/v1/tracks"
-    headers = get_auth_header(token)
+    artist_data = await client.get_entities(ARTISTS_URL, missing_ids, 50, 'artists', 'artist')
 
-    playlist_result = api_request(url, headers=headers, params=params)
+    for artist_id, artist in zip(missing_ids, artist_data):
 
-    if playlist_result is None or playlist_result == 'Try again':
+        if artist is not None:
+            artist_genres[artist_id] = artist["genres"]
 
-        print("Failed to retrieve playlist information.")
+    return artist_genres
 
-    else:
-        
-        tracks = json.loads(playlist_result.content)
 
-        track_data = tracks['tracks']
+async def get_tracks_genres_async(client, track_data, artist_genres):
+    """
+    This function fetches the genres needed by get_track_genres for a list of tracks:
+    the album artists first, then the track artists of albums without genres
 
-        track_id_length = len(track_id_list)
+    Args:
+        param1 (AsyncSpotifyClient): client used to send the requests
+        param2 (list): tracks as returned by the API, None where missing
+        param3 (dict): genres already known for each artist ID, updated in place
+    """
 
-        # Get all artist IDs and store it in artist id list
-        for track in track_data:
-            
-            artist_ids = track["album"]["artists"][0]["id"]
-            artist_ids_list.append(artist_ids)
+    found_tracks = [track for track in track_data if track is not None]
 
-        # get list into correct format to be sent in url request
-        artist_ids_list = ','.join(artist_ids_list)
+    album_artist_ids = [track["album"]["artists"][0]["id"] for track in found_tracks]
+    await get_artists_genres_async(client, album_artist_ids, artist_genres)
 
-        time.sleep(1)
+    fallback_artist_ids = [artist["id"] for track in found_tracks \
+                           if len(artist_genres.get(track["album"]["artists"][0]["id"], [])) == 0 \
+                           for artist in track["artists"]]
+    await get_artists_genres_async(client, fallback_artist_ids, artist_genres)
 
-        # extract genres for each artist
-        genre_ids = get_mul_artists_genres(token, artist_ids_list)
 
-        for index, track in enumerate(track_data):
+async def get_mul_tracks_async(client, playlist_id, playlist_tracks, artist_genres=None):
+    """
+    This function fetches every 50-track batch of a playlist concurrently and
+    returns track information for each track in a dictionary. Artists are
+    deduplicated across the whole playlist before their genres are fetched
 
-            track_info = get_track_info(track)
+    Args:
+        param1 (AsyncSpotifyClient): client used to send the requests
+        param2 (str): playlist id
+        param3 (dict): dictionary containing all track IDs as a value for the key: 'tracks'
+        param4 (dict): genres already known for each artist ID, updated in place
 
-            genre = genre_ids[index]
+    Returns:
+        dict: Dictionary two key-value pairs
+        {
+            'playlist id' : playlist id,
+            'tracks' : []
+         }
 
-            track_info["artist genre"] = genre
+    """
+    track_id_list = list(filter(lambda x: x is not None, playlist_tracks['tracks']))
 
-            tracks_list.append(track_info)
+    artist_genres = {} if artist_genres is None else artist_genres
 
-        # Set offset to adjust for limit rate
-        offset = 50
-        
-        # Use this section of code to get track info for more than 50 tracks in a playlist
-        while offset < track_id_length: 
+    # Tracks come back in the order of the playlist, None where they could not be retrieved
+    track_data = await client.get_entities(TRACKS_URL, track_id_list, 50, 'tracks', 'track', params={'market' : 'US'})
 
-            time.sleep(5)
+    await get_tracks_genres_async(client, track_data, artist_genres)
 
-            artist_ids_list = []
+    tracks_list = []
 
-            # Get track ids in correct format to be sent in url request
-            params['ids'] = ','.join(track_id_list[offset:offset+50])
+    for track in track_data:
 
-            playlist_result = api_request(url, headers=headers, params=params)
+        # Unknown tracks are left out, the features are joined by track ID
+        if track is None:
+            continue
 
-            if playlist_result is None or playlist_result == 'Try again':
+        track_info = get_track_info(track)
+        track_info.artist_genres = get_track_genres(track, artist_genres)
 
-                print("Failed to retrieve playlist information.")
+        tracks_list.append(track_info)
 
-            else:   
-                
-                tracks = json.loads(playlist_result.content)
+    return {
+        'playlist id' : playlist_id,
+        'tracks' : tracks_list
+    }
 
-                track_data = tracks['tracks']
 
-                for track in track_data:
+async def get_mul_tracks_features_async(client, playlist_id, playlist_tracks):
+    """
+    This function fetches every 100-track batch of audio features of a playlist
+    concurrently and returns track features for each track in a dictionary
 
-                    artist_ids = track["album"]["artists"][0]["id"]
-                    artist_ids_list.append(artist_ids)
+    Args:
+        param1 (AsyncSpotifyClient): client used to send the requests
+        param2 (str): playlist id
+        param3 (dict): dictionary containing all track IDs as a value for the key: 'tracks'
 
-                artist_ids_list = ','.join(artist_ids_list)
+    Returns:
+        dict: Dictionary two key-value pairs
+        {
+            'playlist id' : playlist id,
+            'tracks' : []
+         }
 
-                time.sleep(1)
+    """
+    track_id_list = list(filter(lambda x: x is not None, playlist_tracks['tracks']))
 
-                genre_ids = get_mul_artists_genres(token, artist_ids_list)
+    track_data = await client.get_entities(AUDIO_FEATURES_URL, track_id_list, 100, 'audio_features', 'audio_features')
 
-                for index, track in enumerate(track_data):
+    # Missing features are left out, they are joined to the track information by track ID
+    tracks_features_list = [features for features in map(get_track_feature_info, track_data) if features is not None]
 
-                    track_info = get_track_info(track)
+    return {
+        'playlist id' : playlist_id,
+        'tracks' : tracks_features_list
+    }
 
-                    genre = genre_ids[index]
 
-                    track_info["artist genre"] = genre
+def get_mul_tracks(token, playlist_id, playlist_tracks):
+    """
+    This function takes a playlist_id and a list of playlist
+    tracks and returns track information for each track from the playlist
+    in a dictionary
 
-                    tracks_list.append(track_info)
+    Args:
+        param1 (str): token
+        param2 (str): playlist id
+        param3 (dict): dictionary containing all track IDs as a value for the key: 'tracks'
 
-            offset += 50
+    Returns:
+        dict: Dictionary two key-value pairs
+        {
+            'playlist id' : playlist id,
+            'tracks' : []
+         }
 
-    playlist_track_info_dict['playlist id'] = playlist_id
-    playlist_track_info_dict['tracks'] = tracks_list
+    """
 
-    return playlist_track_info_dict
+    return run_sync(get_mul_tracks_async(AsyncSpotifyClient(token), playlist_id, playlist_tracks))
 
 
 def get_mul_tracks_features(token, playlist_id, playlist_tracks):
@@ -467,150 +320,148 @@ def get_mul_tracks_features(token, playlist_id, playlist_tracks):
          }
 
     """
-    # Initialize dictionary to be returned
-    playlist_track_feature_info_dict = {
-        'playlist id' : playlist_id,
-        'tracks' : []
-    }
 
-    track_id_list = playlist_tracks['tracks']
+    return run_sync(get_mul_tracks_features_async(AsyncSpotifyClient(token), playlist_id, playlist_tracks))
 
-    track_id_list = list(filter(lambda x: x is not None, track_id_list))
 
-    try: 
-        params = {
-            'ids' : ','.join(track_id_list[:100]), # Get first 100 tracks
-        }
+def concatenate_playlist_info(playlist_track_info, playlist_features_info):
+    """
+    This function takes two input dictionaries, each containing information of 
+    tracks from a playlist and containing features of tracks from the same playlist.
+    It joins the entries by track ID and returns a dictionary. Tracks missing from
+    either dictionary are left out and reported, the other tracks are kept
+
+    Args:
+        param1 (dict): dictionary containing information on all tracks from playlist id
+        param2 (dict): dictionary containing features on all tracks from playlist id
 
-    except:
-        params = {
-            'ids' : ','.join(track_id_list[:len(track_id_list)]), # Get first 100 tracks
+    Returns:
+        dict: Dictionary two key-value pairs
+        {
+            'playlist id' : playlist id,
+            'tracks' : []
         }
+    """
 
-    tracks_features_list = []
+    # Initialize dictionary to be returned
+    playlist_tracks_all_info_dict = {
+        "playlist id" : None,
+        "tracks" : []
+        }
     
+    track_info_id = playlist_track_info["playlist id"]
+    track_features_id = playlist_features_info["playlist id"]
 
-    url = f"https://api.spotify.com/v1/audio-features"
-    headers = get_auth_header(token)
+    # Check if concatenation is possible
+    if track_info_id != track_features_id:
 
-    playlist_result = api_request(url, headers=headers, params=params)
+        print(f"Cannot concatenate tracks of playlist {track_info_id} with features of playlist {track_features_id}.")
 
-    if playlist_result is None or playlist_result == 'Try again':
+        return playlist_tracks_all_info_dict
 
-        print("Failed to retrieve playlist information.")
+    playlist_tracks_all_info_dict["playlist id"] = track_info_id
 
-    else:
-        
-        tracks = json.loads(playlist_result.content)
+    # Tracks and features are matched by ID, so a missing entry on one side only loses that track
+    merged, without_features, without_info = join_track_features(playlist_track_info["tracks"], playlist_features_info["tracks"])
 
-        track_data = tracks['audio_features']
+    if len(without_features) > 0 or len(without_info) > 0:
+        print(f"Playlist {track_info_id}: {len(without_features)} tracks without features, "
+              f"{len(without_info)} features without track information: {', '.join(without_features + without_info)}")
 
-        track_id_length = len(track_id_list)
-        
-        for track in track_data:
-            
-            # Get track features 
-            track_info = get_track_feature_info(track)
+    playlist_tracks_all_info_dict["tracks"] = merged
 
-            tracks_features_list.append(track_info)
-        
-        # Use offset 100 to adjust for the limit
-        offset = 100
-        
-        # Use this section of code to adjust for more than 100 tracks
-        while offset < track_id_length:
+    return playlist_tracks_all_info_dict
 
-            time.sleep(5)
 
-            # Keep adjusting offset
-            params['ids'] = ','.join(track_id_list[offset:offset+100])
+def get_page_frame(token, playlist_id, page_track_ids, artist_genres):
+    """
+    This function fetches the tracks and the track features of one page of a playlist
+    and extracts them straight into the columns of the playlist frame, without
+    building a dictionary per track
 
-            playlist_result = api_request(url, headers=headers, params=params)
+    Args:
+        param1 (str): token
+        param2 (str): playlist id
+        param3 (list): track IDs of the page
+        param4 (dict): genres already known for each artist ID, shared by every page
 
-            if playlist_result is None or playlist_result == 'Try again':
+    Returns:
+        DataFrame: playlist data of the page, see build_playlist_frame
+    """
 
-                print("Failed to retrieve playlist information.")
+    async def gather_page():
 
-            else:   
-                
-                tracks = json.loads(playlist_result.content)
+        client = AsyncSpotifyClient(token)
 
-                
-                track_data = tracks['audio_features']
+        track_data, features_data = await asyncio.gather(
+            client.get_entities(TRACKS_URL, page_track_ids, 50, 'tracks', 'track', params={'market' : 'US'}),
+            client.get_entities(AUDIO_FEATURES_URL, page_track_ids, 100, 'audio_features', 'audio_features'))
 
-                for track in track_data:
-                    
-                    # Get track features 
-                    try : 
-                        track_info = get_track_feature_info(track)
+        await get_tracks_genres_async(client, track_data, artist_genres)
 
-                        if track_info == None:
-                            pass
-                        
-                        else:
+        return track_data, features_data
 
-                            tracks_features_list.append(track_info)
-                    
-                    except:
-                        pass
-                
-            offset += 100
+    track_data, features_data = run_sync(gather_page())
 
-    playlist_track_feature_info_dict['playlist id'] = playlist_id
-    playlist_track_feature_info_dict['tracks'] = tracks_features_list
+    track_genres = [get_track_genres(track, artist_genres) if track is not None else [] for track in track_data]
 
-    return playlist_track_feature_info_dict
+    return build_playlist_frame(track_data, features_data, track_genres)
 
 
-def concatenate_playlist_info(playlist_track_info, playlist_features_info):
+def iter_playlist_pages(token, playlist_id, page_function, max_workers=PIPELINE_WORKERS):
     """
-    This function takes two input dictionaries, each containing information of 
-    tracks from a playlist and containing features of tracks from the same playlist.
-    It concatenates the entries for each index and returns a dictionary
+    This function hands each page of track IDs of a playlist to page_function as soon
+    as it arrives, while the following pages are still loading, and yields the
+    result of each page in the order of the playlist
 
     Args:
         param1 (str): token
-        param2 (dict): dictionary containing information on all tracks from playlist id
-        param3 (dict): dictionary containing features on all tracks from playlist id
-
-    Returns:
-        dict: Dictionary two key-value pairs
-        {
-            'playlist id' : playlist id,
-            'tracks' : []
-         }
+        param2 (str): playlist id
+        param3 (function): called with token, playlist id, track IDs of the page and the
+            genres known for each artist ID
+        param4 (int): number of pages processed at the same time
 
+    Yields:
+        Result of page_function for each page, in playlist order
     """
 
-    # Initialize dictionary to be returned
-    playlist_tracks_all_info_dict = {
-        "playlist id" : None,
-        "tracks" : []
-        }
-    
-    track_info_id = playlist_track_info["playlist id"]
-    playlist_tracks_list = playlist_track_info["tracks"]
+    # Artists shared between pages are only fetched once
+    artist_genres = {}
 
-    track_features_id = playlist_features_info["playlist id"]    
-    playlist_tracks_features_list = playlist_features_info["tracks"]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
 
-    # Check if concatenation is possible
-    if (track_info_id == track_features_id) and len(playlist_tracks_features_list) == len(playlist_tracks_list):
+        pending = deque()
 
-        playlist_tracks_all_info_dict["playlist id"] = track_info_id
+        for offset, page_track_ids in iter_playlist_track_ids(token, playlist_id):
 
-        playlist_tracks_list = playlist_track_info["tracks"]
-        playlist_tracks_features_list = playlist_features_info["tracks"]
+            pending.append(pool.submit(*submit_in_context(page_function, token, playlist_id, page_track_ids, artist_genres)))
 
-        for i in range(len(playlist_tracks_list)):
+            # Hand out the leading pages already processed while the next page loads
+            while len(pending) > 0 and pending[0].done():
+                yield pending.popleft().result()
 
-            try:
-                track_dict = {**playlist_tracks_list[i], **playlist_tracks_features_list[i]}
+        while len(pending) > 0:
+            yield pending.popleft().result()
 
-                playlist_tracks_all_info_dict["tracks"].append(track_dict)
 
-            except:
+def get_playlist_frame(token, playlist_id, max_workers=PIPELINE_WORKERS):
+    """
+    This function builds the cleaned playlist frame, page by page, in the format
+    written to the playlist CSV
 
-                pass
+    Args:
+        param1 (str): token
+        param2 (str): playlist id
+        param3 (int): number of pages processed at the same time
 
-    return playlist_tracks_all_info_dict
+    Returns:
+        DataFrame: playlist data, one row per unique track
+    """
+
+    frames = list(iter_playlist_pages(token, playlist_id, get_page_frame, max_workers))
+
+    if len(frames) == 0:
+        return build_playlist_frame([], [], [])
+
+    # A track can appear on several pages of the same playlist
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset=["id"], ignore_index=True)
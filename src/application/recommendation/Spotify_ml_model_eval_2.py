@@ -18,13 +18,14 @@ import matplotlib.pyplot as plt
 import pickle
 
 
-def getGenre(filename):
+def getGenre(filename, deadline=None):
 
   '''
   This function takes the filename of the Spotify dataset as input and returns the genre of the playlist.
 
   Args:
       param1 (str): filename of the Spotify dataset
+      param2 (Deadline): deadline of the web request, prediction stops with DeadlineExceeded once it has passed
 
   Returns:
       str: an array of top 5 recomended genres for playlist
@@ -111,6 +112,11 @@ def getGenre(filename):
 
   # # Predictions using rfm36
   for _, row in test_df.iterrows():
+
+      # Stop predicting once the web request has run out of time
+      if deadline is not None:
+          deadline.check()
+
       # Extract the features from the row and Reshape to 2D array for compatibility with model
       features = row[["acousticness", "danceability", "energy", "instrumentalness",
                       "key", "mode", "liveness", "loudness", "speechiness", 
@@ -0,0 +1,308 @@
+"""
+    This file contains the accounting of upstream calls, per logical request and per endpoint.
+
+    The shared transport records every call it sends: the endpoint template it was sent to
+    (IDs replaced by `{id}`, e.g. `GET spotify:/playlists/{id}/tracks`), the bytes received,
+    the status and the latency, kept in a fixed-bucket histogram. The Spotify request helper
+    records its retries. Calls are counted in the process-wide totals and in the metrics of the
+    logical request being served, opened with `metrics_scope`. The scope is a context variable,
+    so calls made by worker threads submitted with `submit_in_context` are counted too.
+
+    Usage:
+        - `with metrics_scope("analyse") as metrics:` around a web request or a scraper run,
+          a summary line is printed when the block exits
+        - `metrics.snapshot()` or `process_metrics().snapshot()` to read the counters
+"""
+
+# Import libraries
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from commons.endpoints import split_service_url
+
+
+# Upper bounds, in seconds, of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Path segments kept as they are in templates, anything else (IDs, numbers) becomes {id}
+TEMPLATE_SEGMENT = re.compile(r"^[a-z][a-z_.\-]*$")
+
+
+def endpoint_template(method, url):
+    """
+        Returns the endpoint a call was sent to, with the IDs in its path replaced by {id}
+
+        Args:
+            param1 (str): HTTP method
+            param2 (str): url of the call
+
+        Returns:
+            str: endpoint template, e.g. 'GET spotify:/artists/{id}/top-tracks'
+    """
+
+    parts = urlsplit(url)
+
+    service, path = split_service_url(f"{parts.scheme}://{parts.netloc}{parts.path}")
+
+    if service is None:
+        service, path = parts.netloc, parts.path
+
+    segments = [segment if TEMPLATE_SEGMENT.match(segment) or segment == "" else "{id}" for segment in path.split("/")]
+
+    return f"{method} {service}:{'/'.join(segments)}"
+
+
+class EndpointStats:
+    """
+        Counters of the calls sent to one endpoint
+    """
+
+    __slots__ = ("calls", "bytes", "retries", "rate_limited", "errors", "latency_total", "histogram")
+
+    def __init__(self):
+
+        self.calls = 0
+        self.bytes = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, status, size, latency):
+
+        self.calls += 1
+        self.bytes += size
+        self.latency_total += latency
+
+        # status is None when no response was received
+        if status == 429:
+            self.rate_limited += 1
+
+        elif status is None or status >= 500:
+            self.errors += 1
+
+        bucket = 0
+
+        while bucket < len(LATENCY_BUCKETS) and latency > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """
+            Returns an upper bound of a latency percentile, read from the histogram
+
+            Args:
+                param1 (float): percentile as a fraction, e.g. 0.95
+
+            Returns:
+                float: upper bound of the bucket holding the percentile, inf for the last bucket,
+                    None without calls
+        """
+
+        if self.calls == 0:
+            return None
+
+        rank = fraction * self.calls
+        seen = 0
+
+        for bucket, count in enumerate(self.histogram):
+
+            seen += count
+
+            if seen >= rank and count > 0:
+                return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else float("inf")
+
+        return float("inf")
+
+    def to_dict(self):
+
+        return {
+            "calls" : self.calls,
+            "bytes" : self.bytes,
+            "retries" : self.retries,
+            "rate_limited" : self.rate_limited,
+            "errors" : self.errors,
+            "latency_total" : self.latency_total,
+            "latency_p50" : self.percentile(0.5),
+            "latency_p95" : self.percentile(0.95),
+            "latency_histogram" : dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["inf"], self.histogram)),
+        }
+
+
+class CallMetrics:
+    """
+        Calls sent during a logical request (or the whole process), by endpoint template
+
+        Args:
+            param1 (str): name of the request, shown in the summary
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.started_at = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _stats(self, template):
+
+        stats = self._endpoints.get(template)
+
+        if stats is None:
+            stats = self._endpoints[template] = EndpointStats()
+
+        return stats
+
+    def record_call(self, template, status, size, latency):
+
+        with self._lock:
+            self._stats(template).record(status, size, latency)
+
+    def record_retry(self, template):
+
+        with self._lock:
+            self._stats(template).retries += 1
+
+    def snapshot(self):
+        """
+            Returns the counters of every endpoint called so far
+
+            Returns:
+                dict: counters by endpoint template, see EndpointStats.to_dict
+        """
+
+        with self._lock:
+            return {template : stats.to_dict() for template, stats in self._endpoints.items()}
+
+    def totals(self):
+        """
+            Returns the counters summed over every endpoint
+
+            Returns:
+                dict: calls, bytes, retries, rate_limited and errors
+        """
+
+        keys = ("calls", "bytes", "retries", "rate_limited", "errors")
+
+        with self._lock:
+            return {key : sum(getattr(stats, key) for stats in self._endpoints.values()) for key in keys}
+
+    def summary(self, top=3):
+        """
+            Returns a one-line summary of the calls, listing the chattiest endpoints
+
+            Args:
+                param1 (int): number of endpoints listed
+
+            Returns:
+                str: summary line
+        """
+
+        totals = self.totals()
+        elapsed = time.monotonic() - self.started_at
+
+        line = (f"Upstream calls for {self.name}: {totals['calls']} calls, {totals['bytes'] / 1e6:.2f} MB, "
+                f"{totals['retries']} retries, {totals['rate_limited']} rate limited, {totals['errors']} errors "
+                f"in {elapsed:.2f} seconds")
+
+        with self._lock:
+
+            chattiest = sorted(self._endpoints.items(), key=lambda item: item[1].calls, reverse=True)[:top]
+
+            endpoints = [f"{template} x{stats.calls} p95<={stats.percentile(0.95)}s" for template, stats in chattiest]
+
+        if len(endpoints) > 0:
+            line += "; " + ", ".join(endpoints)
+
+        return line
+
+
+_process_metrics = CallMetrics("process")
+_current_metrics = contextvars.ContextVar("call_metrics", default=None)
+
+
+def process_metrics():
+    """
+        Returns the metrics of every call sent by this process
+    """
+
+    return _process_metrics
+
+
+def current_metrics():
+    """
+        Returns the metrics of the logical request being served, None outside of a metrics scope
+    """
+
+    return _current_metrics.get()
+
+
+@contextmanager
+def metrics_scope(name, log=True):
+    """
+        Counts the calls made inside the block as one logical request
+
+        Args:
+            param1 (str): name of the request, e.g. 'analyse'
+            param2 (bool): print the summary line when the block exits
+    """
+
+    metrics = CallMetrics(name)
+    token = _current_metrics.set(metrics)
+
+    try:
+        yield metrics
+
+    finally:
+
+        _current_metrics.reset(token)
+
+        if log:
+            print(metrics.summary())
+
+
+def record_call(method, url, status, size, latency):
+    """
+        Counts a call in the process totals and in the current request
+
+        Args:
+            param1 (str): HTTP method
+            param2 (str): url of the call
+            param3 (int): status of the response, None if no response was received
+            param4 (int): bytes received
+            param5 (float): seconds the call took
+    """
+
+    template = endpoint_template(method, url)
+
+    _process_metrics.record_call(template, status, size, latency)
+
+    metrics = current_metrics()
+
+    if metrics is not None:
+        metrics.record_call(template, status, size, latency)
+
+
+def record_retry(method, url):
+    """
+        Counts a retry of a call in the process totals and in the current request
+
+        Args:
+            param1 (str): HTTP method
+            param2 (str): url of the call
+    """
+
+    template = endpoint_template(method, url)
+
+    _process_metrics.record_retry(template)
+
+    metrics = current_metrics()
+
+    if metrics is not None:
+        metrics.record_retry(template)
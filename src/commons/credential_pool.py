@@ -0,0 +1,204 @@
+"""
+    This file contains the pool of Spotify app credentials requests are spread across.
+
+    Each client-id/secret pair has its own cached token and its own rate budget, so the
+    throughput of the scrapers grows with the number of registered apps. Requests lease the
+    next credential with budget left, round robin. A credential that receives a 429 is parked
+    until its Retry-After has passed while the others keep serving requests.
+
+    Without SPOTIFY_CREDENTIALS the pool holds the single CLIENT_ID/CLIENT_SECRET pair, using
+    the process-wide token manager and rate budget, so behaviour is unchanged.
+
+    Environment:
+        SPOTIFY_CREDENTIALS: comma separated client_id:client_secret pairs
+
+    Usage:
+        - `credential = get_credential_pool().lease()` then send with `credential.auth_header()`
+        - `get_credential_pool().park(credential, retry_after)` after a 429
+"""
+
+# Import libraries
+import os
+import hashlib
+import threading
+from commons.rate_limit import TokenBucket, spotify_limiter, SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST
+from commons.spotify_auth import SpotifyTokenManager, token_manager, get_auth_header
+from commons.resilience import sleep_within_deadline
+
+
+class Credential:
+    """
+        One Spotify app: its token manager and its rate budget
+
+        Args:
+            param1 (str): client id, shown in logs
+            param2 (SpotifyTokenManager): token manager of the app
+            param3 (TokenBucket): rate budget of the app
+    """
+
+    def __init__(self, client_id, manager, limiter):
+
+        self.client_id = client_id
+        self.token_manager = manager
+        self.limiter = limiter
+
+    def auth_header(self):
+
+        return get_auth_header(self.token_manager.get_token())
+
+    def __repr__(self):
+
+        return f"Credential({(self.client_id or 'default')[:6]}...)"
+
+
+def parse_credentials(value):
+    """
+        Parses SPOTIFY_CREDENTIALS
+
+        Args:
+            param1 (str): comma separated client_id:client_secret pairs
+
+        Returns:
+            list: (client id, client secret) tuples, without duplicates
+    """
+
+    pairs = []
+
+    for entry in value.split(","):
+
+        entry = entry.strip()
+
+        if len(entry) == 0:
+            continue
+
+        client_id, separator, client_secret = entry.partition(":")
+
+        if separator == "" or len(client_id) == 0 or len(client_secret) == 0:
+            raise ValueError("SPOTIFY_CREDENTIALS entries must be formatted as client_id:client_secret")
+
+        if (client_id, client_secret) not in pairs:
+            pairs.append((client_id, client_secret))
+
+    return pairs
+
+
+class CredentialPool:
+    """
+        Spreads requests across credentials and parks the ones that are rate limited
+
+        Args:
+            param1 (list): Credential objects
+    """
+
+    def __init__(self, credentials):
+
+        if len(credentials) == 0:
+            raise ValueError("A credential pool needs at least one credential")
+
+        self.credentials = credentials
+
+        self._lock = threading.Lock()
+        self._next = 0
+
+    @classmethod
+    def from_pairs(cls, pairs, rate=SPOTIFY_RATE_LIMIT, capacity=SPOTIFY_RATE_BURST):
+        """
+            Builds a pool with one token manager and one rate budget per pair
+
+            Args:
+                param1 (list): (client id, client secret) tuples
+                param2 (float): requests per second of each credential
+                param3 (float): burst of each credential
+
+            Returns:
+                CredentialPool: pool of the credentials
+        """
+
+        credentials = []
+
+        for client_id, client_secret in pairs:
+
+            # Budgets are named after the client id so every process shares each app's budget
+            bucket_name = "spotify_" + hashlib.sha1(client_id.encode()).hexdigest()[:12]
+
+            credentials.append(Credential(client_id, SpotifyTokenManager(client_id, client_secret),
+                                          TokenBucket(bucket_name, rate, capacity)))
+
+        return cls(credentials)
+
+    def lease(self):
+        """
+            Blocks until a credential has budget left and takes one request from it. Background
+            calls wait while interactive calls are using the reserve, see commons.priority
+
+            Returns:
+                Credential: credential to send the request with
+
+            Raises:
+                DeadlineExceeded: the active deadline would pass before a credential frees up
+        """
+
+        while True:
+
+            with self._lock:
+
+                start = self._next
+                self._next = (self._next + 1) % len(self.credentials)
+
+            waits = []
+
+            for i in range(len(self.credentials)):
+
+                credential = self.credentials[(start + i) % len(self.credentials)]
+
+                wait = credential.limiter.try_acquire()
+
+                if wait <= 0:
+                    return credential
+
+                waits.append(wait)
+
+            # Every credential is exhausted or parked, wait for the first one to free up
+            sleep_within_deadline(min(waits))
+
+    def park(self, credential, seconds):
+        """
+            Stops using a credential for the given time, e.g. after a 429 response
+
+            Args:
+                param1 (Credential): rate limited credential
+                param2 (float): seconds to wait
+        """
+
+        credential.limiter.block_for(seconds)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_credential_pool():
+    """
+        Returns the process-wide pool, built on first use so .env files loaded by the caller are picked up
+
+        Returns:
+            CredentialPool: pool of the configured credentials
+    """
+
+    global _pool
+
+    if _pool is None:
+
+        with _pool_lock:
+
+            if _pool is None:
+
+                pairs = parse_credentials(os.getenv("SPOTIFY_CREDENTIALS", ""))
+
+                if len(pairs) == 0:
+                    _pool = CredentialPool([Credential(None, token_manager, spotify_limiter)])
+
+                else:
+                    _pool = CredentialPool.from_pairs(pairs)
+
+    return _pool
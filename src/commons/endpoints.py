@@ -0,0 +1,50 @@
+"""
+    This file contains the base URLs of every upstream API.
+
+    The base URLs are read from the environment so the application and the scrapers can be
+    pointed at the local stub server in `commons.stub_server` instead of the live APIs, e.g.
+    to benchmark changes to the network layer without burning quota. Like the settings of the
+    other commons modules, they are read once when the module is imported, so entry points load
+    their .env file before importing commons.
+
+    Environment:
+        SPOTIFY_API_BASE_URL: base url of the Spotify Web API (default https://api.spotify.com/v1)
+        SPOTIFY_ACCOUNTS_BASE_URL: base url of the Spotify accounts service (default https://accounts.spotify.com)
+        TICKETMASTER_BASE_URL: base url of the Ticketmaster Discovery API (default https://app.ticketmaster.com/discovery/v2)
+
+    Usage:
+        - `from commons.endpoints import SPOTIFY_API_BASE_URL`
+"""
+
+# Import libraries
+import os
+
+
+SPOTIFY_API_BASE_URL = os.getenv("SPOTIFY_API_BASE_URL", "https://api.spotify.com/v1").rstrip("/")
+SPOTIFY_ACCOUNTS_BASE_URL = os.getenv("SPOTIFY_ACCOUNTS_BASE_URL", "https://accounts.spotify.com").rstrip("/")
+TICKETMASTER_BASE_URL = os.getenv("TICKETMASTER_BASE_URL", "https://app.ticketmaster.com/discovery/v2").rstrip("/")
+
+# Services whose responses can be recorded and replayed, by name
+SERVICES = {
+    "spotify" : SPOTIFY_API_BASE_URL,
+    "ticketmaster" : TICKETMASTER_BASE_URL,
+}
+
+
+def split_service_url(url):
+    """
+        Finds the service a url belongs to
+
+        Args:
+            param1 (str): url without its query string
+
+        Returns:
+            tuple: (service name, path relative to the service base url), (None, None) for other urls
+    """
+
+    for service, base_url in SERVICES.items():
+
+        if url.startswith(base_url + "/"):
+            return service, url[len(base_url):]
+
+    return None, None
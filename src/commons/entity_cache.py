@@ -0,0 +1,227 @@
+"""
+    This file contains the persistent on-disk cache of Spotify entities.
+
+    Tracks, artists and audio features almost never change, so the raw API objects are stored
+    in SQLite keyed by entity type and Spotify ID. Playlists are stored as their track ID list
+    together with the snapshot_id it was read at. Each entity type has its own time to live,
+    and the least recently used entries are evicted once the cache grows past its size bound.
+    Only cache misses are sent to the API by the read-through helpers in `commons.spotify_client`.
+
+    The cache sits on the request path, so reads stay read-only: access times are only refreshed
+    once they are older than TOUCH_INTERVAL, and those refreshes are queued and written in batches.
+    Expired and least recently used entries are evicted by a periodic pass, or as soon as the
+    entries written since the last pass may have pushed the cache past its size bound.
+
+    Environment:
+        SPOTIFY_CACHE_PATH: path of the SQLite database (default: system temp dir)
+        SPOTIFY_CACHE_MAX_ENTRIES: maximum number of cached entities (default 500000)
+        SPOTIFY_CACHE_DISABLED: set to 1 to bypass the cache
+
+    Usage:
+        - `from commons.entity_cache import entity_cache`
+"""
+
+# Import libraries
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from commons.fast_json import loads, dumps
+
+
+CACHE_PATH = os.getenv("SPOTIFY_CACHE_PATH", os.path.join(tempfile.gettempdir(), "spotify_cache.sqlite3"))
+MAX_ENTRIES = int(os.getenv("SPOTIFY_CACHE_MAX_ENTRIES", 500000))
+CACHE_DISABLED = os.getenv("SPOTIFY_CACHE_DISABLED", "0") == "1"
+
+DAY = 24 * 60 * 60
+
+# Time to live, in seconds, for each kind of entity
+TTLS = {
+    "track" : 30 * DAY,
+    "artist" : 7 * DAY,
+    "audio_features" : 90 * DAY,
+    "playlist" : 30 * DAY,
+    "artist_search" : 30 * DAY,
+    "track_search" : 30 * DAY,
+    "artist_search_miss" : DAY,
+    "track_search_miss" : DAY,
+}
+
+DEFAULT_TTL = DAY
+
+# SQLite limits the number of variables in a single statement
+QUERY_CHUNK_SIZE = 500
+
+# Seconds before the access time of an entry is refreshed, and queued refreshes written at once
+TOUCH_INTERVAL = 60 * 60
+TOUCH_BATCH_SIZE = 500
+
+# Seconds between two eviction passes, other processes may be writing to the same cache
+EVICTION_INTERVAL = 5 * 60
+
+
+class EntityCache:
+    """
+        SQLite-backed cache of API objects with per-kind TTLs and LRU eviction
+
+        Args:
+            param1 (str): path of the SQLite database
+            param2 (int): maximum number of cached entities
+            param3 (dict): time to live, in seconds, for each kind of entity
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttls=TTLS):
+
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = ttls
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+        # Access times to refresh, and entries counted by the last eviction pass plus those written since
+        self._touches = {}
+        self._entries = None
+        self._evicted_at = 0
+
+    def _connect(self):
+
+        if self._connection is None:
+
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+            # WAL lets the web application and the scrapers read while another process writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entities (
+                    kind TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (kind, id)
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS entities_accessed_at ON entities (accessed_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entities_expires_at ON entities (expires_at)")
+            connection.commit()
+
+            self._connection = connection
+
+        return self._connection
+
+    def get_many(self, kind, ids):
+        """
+            Returns the cached, unexpired entities among ids
+
+            Args:
+                param1 (str): kind of entity, e.g. 'track'
+                param2 (list): Spotify IDs
+
+            Returns:
+                dict: API object for each cached ID
+        """
+
+        found = {}
+
+        if CACHE_DISABLED or len(ids) == 0:
+            return found
+
+        now = time.time()
+        ids = list(dict.fromkeys(ids))
+
+        with self._lock:
+
+            connection = self._connect()
+
+            for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+
+                chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+
+                rows = connection.execute(
+                    f"SELECT id, value, accessed_at FROM entities WHERE kind = ? AND id IN ({placeholders}) AND expires_at > ?",
+                    [kind, *chunk, now]).fetchall()
+
+                for entity_id, value, accessed_at in rows:
+
+                    found[entity_id] = loads(value)
+
+                    # Record the access so popular entities survive eviction
+                    if now - accessed_at >= TOUCH_INTERVAL:
+                        self._touches[(kind, entity_id)] = now
+
+            if len(self._touches) >= TOUCH_BATCH_SIZE:
+
+                self._write_touches(connection)
+                connection.commit()
+
+        return found
+
+    def put_many(self, kind, entities):
+        """
+            Stores entities and evicts the least recently used ones if the cache is full
+
+            Args:
+                param1 (str): kind of entity, e.g. 'track'
+                param2 (dict): API object for each Spotify ID
+        """
+
+        if CACHE_DISABLED or len(entities) == 0:
+            return
+
+        now = time.time()
+        expires_at = now + self.ttls.get(kind, DEFAULT_TTL)
+
+        rows = [(kind, entity_id, dumps(value), expires_at, now) for entity_id, value in entities.items()]
+
+        with self._lock:
+
+            connection = self._connect()
+
+            connection.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?)", rows)
+
+            self._write_touches(connection)
+
+            # Replaced entries are counted too, so the bound is never missed
+            if self._entries is not None:
+                self._entries += len(rows)
+
+            if self._entries is None or self._entries > self.max_entries or now - self._evicted_at >= EVICTION_INTERVAL:
+                self._evict(connection, now)
+
+            connection.commit()
+
+    def _write_touches(self, connection):
+
+        connection.executemany("UPDATE entities SET accessed_at = ? WHERE kind = ? AND id = ?",
+                               [(accessed_at, kind, entity_id) for (kind, entity_id), accessed_at in self._touches.items()])
+
+        self._touches = {}
+
+    def _evict(self, connection, now):
+
+        self._evicted_at = now
+
+        connection.execute("DELETE FROM entities WHERE expires_at <= ?", (now,))
+
+        count = connection.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+
+        self._entries = count
+
+        if count <= self.max_entries:
+            return
+
+        # Evict down to 90% of the bound so eviction does not run on every write
+        excess = count - int(self.max_entries * 0.9)
+
+        connection.execute("""
+            DELETE FROM entities WHERE rowid IN (
+                SELECT rowid FROM entities ORDER BY accessed_at LIMIT ?
+            )""", (excess,))
+
+        self._entries = count - excess
+
+
+# Process-wide cache shared by every Spotify helper
+entity_cache = EntityCache()
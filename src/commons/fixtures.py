@@ -0,0 +1,210 @@
+"""
+    This file contains the fixture store used to record and replay API responses.
+
+    When `HTTP_RECORD_DIR` is set, every Spotify and Ticketmaster response that goes through
+    `commons.http_transport` is written to the store, one JSON file per distinct request. The
+    stub server in `commons.stub_server` replays them. Fixtures are keyed by service, method,
+    path relative to the service base url and query string, without credentials such as the
+    Ticketmaster `apikey`.
+
+    Environment:
+        HTTP_RECORD_DIR: directory responses are recorded to, recording is off when unset
+
+    Usage:
+        - `store = FixtureStore("tmp/fixtures")` then `store.lookup("spotify", "GET", "/tracks", query)`
+"""
+
+# Import libraries
+import os
+import hashlib
+import json
+import threading
+from urllib.parse import urlsplit, parse_qsl
+from commons.endpoints import split_service_url
+
+
+RECORD_DIR = os.getenv("HTTP_RECORD_DIR")
+
+# Query parameters left out of fixture keys
+IGNORED_PARAMS = ("apikey",)
+
+# Query parameters a replay may differ in from the recording, by service. Requests that were
+# never recorded only fall back to a recording of the same path that matches every other
+# parameter, e.g. a Ticketmaster search whose date range moved. Spotify requests select entities
+# by ID or offset, so they are only ever answered with their own recording
+FALLBACK_IGNORED_PARAMS = {
+    "ticketmaster" : ("startDateTime", "endDateTime"),
+}
+
+# Response headers kept in fixtures
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+
+
+def fixture_key(service, method, path, query):
+    """
+        Builds the key of a request, independent of the order of its query parameters
+
+        Args:
+            param1 (str): service name, e.g. 'spotify'
+            param2 (str): HTTP method
+            param3 (str): path relative to the service base url
+            param4 (list): (name, value) pairs of the query string
+
+        Returns:
+            str: key of the request
+    """
+
+    query = sorted((name, value) for name, value in query if name not in IGNORED_PARAMS)
+
+    return json.dumps([service, method.upper(), path, query])
+
+
+class FixtureStore:
+    """
+        Directory of recorded responses, one JSON file per request key
+
+        Args:
+            param1 (str): directory of the store
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        self._lock = threading.Lock()
+        self._by_key = None
+        self._by_path = None
+
+    def _path(self, key):
+
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _load(self):
+
+        if self._by_key is not None:
+            return
+
+        by_key = {}
+        by_path = {}
+
+        if os.path.isdir(self.directory):
+
+            for file_name in sorted(os.listdir(self.directory)):
+
+                if not file_name.endswith(".json"):
+                    continue
+
+                with open(os.path.join(self.directory, file_name)) as file:
+                    fixture = json.load(file)
+
+                by_key[fixture["key"]] = fixture
+                by_path.setdefault((fixture["service"], fixture["method"], fixture["path"]), []).append(fixture)
+
+        self._by_key = by_key
+        self._by_path = by_path
+
+    def record(self, method, url, response):
+        """
+            Stores a response, replacing an earlier recording of the same request
+
+            Args:
+                param1 (str): HTTP method
+                param2 (str): url of the request, including its query string
+                param3 (Response): response received
+
+            Returns:
+                bool: True if the response was recorded, False if the url belongs to no recorded service
+        """
+
+        parts = urlsplit(url)
+        service, path = split_service_url(parts.scheme + "://" + parts.netloc + parts.path)
+
+        if service is None:
+            return False
+
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        key = fixture_key(service, method, path, query)
+
+        fixture = {
+            "key" : key,
+            "service" : service,
+            "method" : method.upper(),
+            "path" : path,
+            "query" : [[name, value] for name, value in query if name not in IGNORED_PARAMS],
+            "status" : response.status_code,
+            "headers" : {name : response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "body" : response.text,
+        }
+
+        with self._lock:
+
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Written to a temporary file first so a concurrent reader never sees half a fixture
+            file_path = self._path(key)
+            temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+            with open(temp_path, "w") as file:
+                json.dump(fixture, file)
+
+            os.replace(temp_path, file_path)
+
+            # Forget the loaded index, it is rebuilt on the next lookup
+            self._by_key = None
+
+        return True
+
+    def lookup(self, service, method, path, query):
+        """
+            Finds the recorded response of a request. Requests that were never recorded fall
+            back to the last recording of the same path that differs only in parameters of
+            FALLBACK_IGNORED_PARAMS
+
+            Args:
+                param1 (str): service name, e.g. 'spotify'
+                param2 (str): HTTP method
+                param3 (str): path relative to the service base url
+                param4 (list): (name, value) pairs of the query string
+
+            Returns:
+                dict: recorded fixture, None if the request was never recorded
+        """
+
+        with self._lock:
+
+            self._load()
+
+            fixture = self._by_key.get(fixture_key(service, method, path, query))
+
+            if fixture is not None:
+                return fixture
+
+            ignored = FALLBACK_IGNORED_PARAMS.get(service)
+
+            if ignored is None:
+                return None
+
+            def fallback_key(pairs):
+
+                return sorted((name, value) for name, value in pairs if name not in ignored and name not in IGNORED_PARAMS)
+
+            matches = [fixture for fixture in self._by_path.get((service, method.upper(), path), [])
+                       if fallback_key(fixture["query"]) == fallback_key(query)]
+
+            return matches[-1] if matches else None
+
+
+_recorder = FixtureStore(RECORD_DIR) if RECORD_DIR else None
+
+
+def record_response(method, response):
+    """
+        Records a response when recording is enabled through HTTP_RECORD_DIR
+
+        Args:
+            param1 (str): HTTP method
+            param2 (Response): response received
+    """
+
+    if _recorder is not None:
+        _recorder.record(method, response.request.url, response)
@@ -0,0 +1,303 @@
+"""
+    This file contains the request hedging used to cut the tail latency of Spotify batch calls.
+
+    A hedged call is sent as usual. If it has not answered once the hedge delay has passed, a
+    duplicate is sent and whichever returns first is used. The delay adapts to each endpoint:
+    it is a percentile of the latencies of the endpoint's recent calls, so only the slowest
+    calls are duplicated. Hedges are capped to a fraction of the calls so they stay within
+    quota, and the duplicate still leases a credential and draws from its rate budget.
+
+    Only the time spent on the wire is sampled: the shared transport reports the latency of each
+    response through `record_transport_latency`, so waits for a credential, the rate budget or a
+    backoff do not inflate the hedge delay. Calls too close to their request deadline for the
+    hedge delay to pass are not hedged.
+
+    Environment:
+        SPOTIFY_HEDGE: hedge batch calls by default, 1 to enable (default 0)
+        SPOTIFY_HEDGE_PERCENTILE: percentile of recent latencies a call may take before it is hedged (default 0.95)
+        SPOTIFY_HEDGE_MAX_RATE: maximum fraction of calls that may be hedged (default 0.05)
+        SPOTIFY_HEDGE_MIN_DELAY: minimum seconds to wait before hedging (default 0.05)
+
+    Usage:
+        - `hedger.call(api_request, url, headers, params=params)`
+        - `hedger.stats()` for how often hedges fire and win
+"""
+
+# Import libraries
+import os
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from commons.resilience import submit_in_context, current_deadline
+
+
+HEDGE_REQUESTS = os.getenv("SPOTIFY_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("SPOTIFY_HEDGE_PERCENTILE", 0.95))
+HEDGE_MAX_RATE = float(os.getenv("SPOTIFY_HEDGE_MAX_RATE", 0.05))
+HEDGE_MIN_DELAY = float(os.getenv("SPOTIFY_HEDGE_MIN_DELAY", 0.05))
+
+# Latencies kept per endpoint, and needed before the percentile is trusted
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+# Hedges allowed before the rate cap applies, so the first slow calls can be hedged
+HEDGE_BURST = 2
+
+# Transport latencies of the responses received by the call being measured
+_transport_latencies = contextvars.ContextVar("transport_latencies", default=None)
+
+
+def record_transport_latency(latency):
+    """
+        Reports the latency of a response received by the transport, sampled if the call is measured
+
+        Args:
+            param1 (float): seconds between sending the request and receiving the response
+    """
+
+    latencies = _transport_latencies.get()
+
+    if latencies is not None:
+        latencies.append(latency)
+
+
+def measured_call(function, *args, **kwargs):
+    """
+        Calls function and returns its result with the transport latency of its last response
+
+        Returns:
+            tuple: (result, latency in seconds or None if no response was received)
+    """
+
+    latencies = []
+    token = _transport_latencies.set(latencies)
+
+    try:
+        result = function(*args, **kwargs)
+
+    finally:
+        _transport_latencies.reset(token)
+
+    return result, latencies[-1] if len(latencies) > 0 else None
+
+
+class LatencyWindow:
+    """
+        Latencies of the most recent calls to an endpoint
+
+        Args:
+            param1 (int): number of latencies kept
+    """
+
+    def __init__(self, size=LATENCY_WINDOW):
+
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, fraction):
+        """
+            Returns a percentile of the recent latencies
+
+            Args:
+                param1 (float): percentile as a fraction, e.g. 0.95
+
+            Returns:
+                float: latency in seconds, None until enough calls were seen
+        """
+
+        with self._lock:
+
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+
+            latencies = sorted(self._latencies)
+
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+
+class Hedger:
+    """
+        Sends calls and duplicates the ones slower than the adaptive hedge delay
+
+        Args:
+            param1 (float): percentile of recent latencies used as hedge delay
+            param2 (float): maximum fraction of calls that may be hedged
+            param3 (float): minimum hedge delay in seconds
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, max_rate=HEDGE_MAX_RATE, min_delay=HEDGE_MIN_DELAY):
+
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self._counts = {"calls" : 0, "hedged" : 0, "hedge_won" : 0, "capped" : 0}
+
+    def _window(self, key):
+
+        with self._lock:
+
+            if key not in self._windows:
+                self._windows[key] = LatencyWindow()
+
+            return self._windows[key]
+
+    def _get_executor(self):
+
+        # Own workers, so a hedged call never waits for a worker held by its caller's pool
+        with self._lock:
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="spotify-hedge")
+
+            return self._executor
+
+    def _count(self, name):
+
+        with self._lock:
+            self._counts[name] += 1
+
+    def _take_hedge(self):
+        """
+            Takes a hedge from the budget, which grows with the number of calls
+
+            Returns:
+                bool: True if a hedge may be sent
+        """
+
+        with self._lock:
+
+            if self._counts["hedged"] >= self.max_rate * self._counts["calls"] + HEDGE_BURST:
+
+                self._counts["capped"] += 1
+
+                return False
+
+            self._counts["hedged"] += 1
+
+            return True
+
+    def delay(self, key):
+        """
+            Returns the seconds a call to an endpoint may take before it is hedged
+
+            Args:
+                param1 (str): endpoint, e.g. its url
+
+            Returns:
+                float: hedge delay, None while the endpoint has too few calls to tell
+        """
+
+        latency = self._window(key).percentile(self.percentile)
+
+        if latency is None:
+            return None
+
+        return max(latency, self.min_delay)
+
+    def _timed_call(self, key, function, args, kwargs):
+
+        result, latency = measured_call(function, *args, **kwargs)
+
+        if latency is not None:
+            self._window(key).add(latency)
+
+        return result
+
+    def _submit(self, key, function, args, kwargs):
+
+        return self._get_executor().submit(*submit_in_context(self._timed_call, key, function, args, kwargs))
+
+    def call(self, function, url, *args, **kwargs):
+        """
+            Calls function(url, *args, **kwargs), duplicating the call if it is slow
+
+            Args:
+                param1 (function): request function, e.g. api_request, returning None or
+                    'Try again' when it fails
+                param2 (str): url of the request, latencies are tracked per url
+                param3: other arguments of the request function
+
+            Returns:
+                Result of the first call to succeed, or of the last one to fail
+        """
+
+        self._count("calls")
+
+        delay = self.delay(url)
+
+        # Until the endpoint has a latency profile its calls are sent without a hedge
+        if delay is None:
+            return self._timed_call(url, function, (url, *args), kwargs)
+
+        deadline = current_deadline()
+
+        # A hedge could not be sent before the deadline, duplicating the call would only add load
+        if deadline is not None and deadline.remaining() <= delay:
+            return self._timed_call(url, function, (url, *args), kwargs)
+
+        primary = self._submit(url, function, (url, *args), kwargs)
+
+        done, _ = wait([primary], timeout=delay)
+
+        if len(done) > 0 or not self._take_hedge():
+            return primary.result()
+
+        hedge = self._submit(url, function, (url, *args), kwargs)
+        pending = {primary, hedge}
+
+        result = None
+        error = None
+
+        # Use the first call to succeed, the other one is left to finish in the background
+        while len(pending) > 0:
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+
+                if future.exception() is not None:
+
+                    error = future.exception()
+
+                    continue
+
+                result = future.result()
+
+                if result is not None and result != 'Try again':
+
+                    if future is hedge:
+                        self._count("hedge_won")
+
+                    return result
+
+        # Both calls failed, a failed response is preferred over an exception
+        if result is None and error is not None:
+            raise error
+
+        return result
+
+    def stats(self):
+        """
+            Returns how often hedges were sent and won
+
+            Returns:
+                dict: calls, hedged (duplicates sent), hedge_won (duplicates that answered first)
+                    and capped (hedges skipped because of the rate cap)
+        """
+
+        with self._lock:
+            return dict(self._counts)
+
+
+hedger = Hedger()
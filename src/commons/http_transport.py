@@ -0,0 +1,199 @@
+"""
+    This file contains the shared HTTP transport used for every Spotify and Ticketmaster call.
+
+    One `requests.Session` is kept per host so connections are reused (keep-alive) instead of
+    paying a new TCP and TLS handshake for each request. Pool size and default timeouts can be
+    tuned through environment variables. Every call has a timeout, shortened to the active
+    request deadline, and goes through the circuit breaker of its host (see `commons.resilience`).
+    Every call sent is counted in `commons.call_metrics`.
+
+    Environment:
+        HTTP_POOL_SIZE: maximum number of pooled connections per host (default 20)
+        HTTP_CONNECT_TIMEOUT: seconds to wait for a connection (default 3.05)
+        HTTP_READ_TIMEOUT: seconds to wait for the response (default 20)
+        HTTP_RECORD_DIR: directory responses are recorded to, see `commons.fixtures`
+
+    Usage:
+        - `from commons.http_transport import get, post`
+"""
+
+# Import libraries
+import atexit
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout, RequestException
+from commons.fixtures import record_response
+from commons.call_metrics import record_call
+from commons.hedging import record_transport_latency
+from commons.resilience import current_deadline, get_breaker, DeadlineExceeded
+
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 20))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def create_session(pool_size=POOL_SIZE):
+    """
+        Creates a session whose connection pool keeps up to pool_size connections alive
+
+        Args:
+            param1 (int): maximum number of pooled connections
+
+        Returns:
+            Session: session with pooled adapters mounted for http and https
+    """
+
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session(url):
+    """
+        Returns the shared session for the host of url, creating it on first use
+
+        Args:
+            param1 (str): url of the request
+
+        Returns:
+            Session: pooled session for the host
+    """
+
+    parts = urlsplit(url)
+    host = parts.scheme + "://" + parts.netloc
+
+    session = _sessions.get(host)
+
+    if session is None:
+
+        with _sessions_lock:
+
+            session = _sessions.get(host)
+
+            if session is None:
+                session = create_session()
+                _sessions[host] = session
+
+    return session
+
+
+def request(method, url, **kwargs):
+    """
+        Sends a request through the pooled session of the target host
+
+        Args:
+            param1 (str): HTTP method
+            param2 (str): url of the request
+            param3: keyword arguments accepted by `requests.Session.request`
+
+        Returns:
+            Response: response of the request
+    """
+
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    # Never wait on the upstream past the deadline of the request being served
+    deadline = current_deadline()
+
+    if deadline is not None:
+
+        deadline.check()
+
+        remaining = deadline.remaining()
+        timeout = (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+
+    kwargs.setdefault("timeout", timeout)
+
+    # Fail fast while the upstream is unhealthy
+    breaker = get_breaker(url)
+    breaker.check()
+
+    started_at = time.monotonic()
+
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+
+    except (ConnectionError, Timeout):
+
+        record_call(method, url, None, 0, time.monotonic() - started_at)
+
+        if deadline is not None and deadline.expired():
+
+            breaker.record_cancelled()
+
+            raise DeadlineExceeded(f"Request deadline exceeded while waiting for {url}")
+
+        breaker.record_failure()
+
+        raise
+
+    # Any other failure of the upstream, e.g. a broken chunked body or too many redirects
+    except RequestException:
+
+        record_call(method, url, None, 0, time.monotonic() - started_at)
+
+        breaker.record_failure()
+
+        raise
+
+    # Not the upstream's fault (e.g. KeyboardInterrupt), a half-open breaker must not stay stuck on its trial call
+    except BaseException:
+
+        breaker.record_cancelled()
+
+        raise
+
+    latency = time.monotonic() - started_at
+
+    record_call(method, url, response.status_code, len(response.content), latency)
+    record_transport_latency(latency)
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+
+    else:
+        breaker.record_success()
+
+    # Kept as a fixture for the stub server when HTTP_RECORD_DIR is set
+    record_response(method, response)
+
+    return response
+
+
+def get(url, **kwargs):
+
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+
+    return request("POST", url, **kwargs)
+
+
+def close_sessions():
+    """
+        Closes every pooled session, e.g. before forking worker processes. Registered to
+        run at interpreter exit, so the app and the scrapers release their connections
+    """
+
+    with _sessions_lock:
+
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
+
+
+atexit.register(close_sessions)
@@ -0,0 +1,127 @@
+"""
+    This file contains the pagination helper used for every paginated Spotify endpoint.
+
+    The first page tells how many items exist (`total`), so the remaining offsets are requested
+    concurrently instead of following `next` one page at a time. Every request still goes
+    through `api_request`, which draws from the shared rate budget, and pages are handed out
+    in offset order whatever order they arrive in.
+
+    Usage:
+        - `from commons.pagination import get_all_pages` to get every item at once
+        - `from commons.pagination import iter_pages` to process each page once it and the pages before it arrived
+"""
+
+# Import libraries
+from concurrent.futures import ThreadPoolExecutor
+from commons.spotify_async import MAX_CONCURRENCY
+from commons.resilience import submit_in_context
+from commons.spotify_auth import get_auth_header
+from commons.spotify_client import api_request
+from commons.fast_json import loads
+
+
+def get_page(url, headers, offset, page_size, paging_key=None, params=None):
+    """
+        Fetches the page starting at offset
+
+        Args:
+            param1 (str): url of the paginated endpoint
+            param2 (dict): declared header
+            param3 (int): offset of the page
+            param4 (int): number of items per page
+            param5 (str): key of the response holding the paging object, None if the
+                response is the paging object itself
+            param6 (dict): extra parameters for the api request
+
+        Returns:
+            dict: paging object with 'items' and 'total', None if the request failed
+    """
+
+    params = {**(params or {}), 'offset' : offset, 'limit' : page_size}
+
+    result = api_request(url, headers=headers, params=params)
+
+    if result is None or result == 'Try again':
+
+        print(f"Failed to retrieve page at offset {offset}.")
+
+        return None
+
+    page = loads(result.content)
+
+    return page if paging_key is None else page[paging_key]
+
+
+def iter_pages(token, url, page_size, paging_key=None, params=None, first_page=None, max_workers=MAX_CONCURRENCY):
+    """
+        Yields the pages of a paginated endpoint in offset order. The first page is yielded
+        first, the following pages are requested concurrently and each one is yielded as soon
+        as it and every page before it arrived
+
+        Args:
+            param1 (str): token
+            param2 (str): url of the paginated endpoint
+            param3 (int): number of items per page
+            param4 (str): key of the response holding the paging object, e.g. 'playlists'
+            param5 (dict): extra parameters for the api request
+            param6 (dict): paging object of the first page if it was already fetched, e.g.
+                embedded in the playlist header
+            param7 (int): maximum number of pages requested at once
+
+        Yields:
+            tuple: (offset, paging object), the paging object is None if the page could not be retrieved
+    """
+
+    headers = get_auth_header(token)
+
+    if first_page is None:
+        first_page = get_page(url, headers, 0, page_size, paging_key, params)
+
+    yield 0, first_page
+
+    if first_page is None:
+        return
+
+    # The first page may be shorter than page_size, e.g. when embedded in the playlist header
+    first_offset = len(first_page['items'])
+    offsets = range(first_offset, first_page['total'], page_size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        futures = [(offset, pool.submit(*submit_in_context(get_page, url, headers, offset, page_size, paging_key, params))) \
+                   for offset in offsets]
+
+        # A page finishing early waits for the pages before it, so items keep their order
+        for offset, future in futures:
+            yield offset, future.result()
+
+
+def get_all_pages(token, url, page_size, paging_key=None, params=None, first_page=None, max_workers=MAX_CONCURRENCY):
+    """
+        Fetches every item of a paginated endpoint, requesting the pages after the first
+        one concurrently
+
+        Args:
+            param1 (str): token
+            param2 (str): url of the paginated endpoint
+            param3 (int): number of items per page
+            param4 (str): key of the response holding the paging object, e.g. 'playlists'
+            param5 (dict): extra parameters for the api request
+            param6 (dict): paging object of the first page if it was already fetched, e.g.
+                embedded in the playlist header
+            param7 (int): maximum number of pages requested at once
+
+        Returns:
+            list: items of every page in order, None if any page could not be retrieved
+    """
+
+    items = []
+
+    for offset, page in iter_pages(token, url, page_size, paging_key, params, first_page, max_workers):
+
+        if page is None:
+            return None
+
+        items += page['items']
+
+    return items
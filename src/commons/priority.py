@@ -0,0 +1,61 @@
+"""
+    This file contains the priority of the upstream calls being made.
+
+    Calls made while serving a user (e.g. `playlist_to_csv`) are interactive, everything else,
+    such as the scrapers, is background work. The rate limiter in `commons.rate_limit` lets
+    interactive calls go first: while interactive calls were made recently, in any process
+    sharing the budget, background calls leave a reserve of the budget untouched.
+
+    The priority is a context variable, so work handed to thread pools must be submitted with
+    `commons.resilience.submit_in_context` to keep it.
+
+    Environment:
+        PRIORITY_RESERVE: fraction of a rate budget's burst kept for interactive calls (default 0.5)
+        INTERACTIVE_WINDOW: seconds an interactive call keeps background calls out of the reserve (default 2)
+
+    Usage:
+        - `with priority_scope(INTERACTIVE):` around the work of a web request
+"""
+
+# Import libraries
+import os
+import contextvars
+from contextlib import contextmanager
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+PRIORITY_RESERVE = float(os.getenv("PRIORITY_RESERVE", 0.5))
+INTERACTIVE_WINDOW = float(os.getenv("INTERACTIVE_WINDOW", 2))
+
+_current_priority = contextvars.ContextVar("priority", default=BACKGROUND)
+
+
+def current_priority():
+    """
+        Returns the priority of the calls being made, BACKGROUND outside of a priority scope
+    """
+
+    return _current_priority.get()
+
+
+@contextmanager
+def priority_scope(priority):
+    """
+        Sets the priority of the calls made inside the block
+
+        Args:
+            param1 (str): INTERACTIVE or BACKGROUND
+    """
+
+    if priority not in (INTERACTIVE, BACKGROUND):
+        raise ValueError(f"Unknown priority {priority}")
+
+    token = _current_priority.set(priority)
+
+    try:
+        yield priority
+
+    finally:
+        _current_priority.reset(token)
@@ -0,0 +1,74 @@
+"""
+    This file contains the live throughput report of long scraping runs.
+
+    Workers report each finished unit of work, and a line with the progress, the rates since the
+    start and the estimated time left is printed at most every `interval` seconds.
+
+    Usage:
+        - `progress = Progress(total, "playlists")` then `progress.update(tracks=n)` per unit of work
+"""
+
+# Import libraries
+import threading
+import time
+
+
+class Progress:
+    """
+        Counts finished units of work and prints the throughput
+
+        Args:
+            param1 (int): number of units of work to do
+            param2 (str): name of the units, e.g. 'playlists'
+            param3 (float): minimum seconds between two printed lines
+    """
+
+    def __init__(self, total, unit, interval=5):
+
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+
+        self.done = 0
+        self.failed = 0
+        self.tracks = 0
+
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._printed_at = self._started_at
+
+    def update(self, tracks=0, failed=False):
+        """
+            Records one finished unit of work
+
+            Args:
+                param1 (int): tracks written by the unit
+                param2 (bool): True if the unit failed
+        """
+
+        with self._lock:
+
+            self.done += 1
+            self.failed += int(failed)
+            self.tracks += tracks
+
+            now = time.monotonic()
+
+            if now - self._printed_at < self.interval and self.done < self.total:
+                return
+
+            self._printed_at = now
+
+            line = self.line(now)
+
+        print(line)
+
+    def line(self, now=None):
+
+        elapsed = max((now or time.monotonic()) - self._started_at, 1e-9)
+        rate = self.done / elapsed
+
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+
+        return (f"{self.done}/{self.total} {self.unit} ({self.failed} failed), {rate:.2f} {self.unit}/s, "
+                f"{self.tracks / elapsed:.1f} tracks/s, {eta / 60:.1f} minutes left")
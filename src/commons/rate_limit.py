@@ -0,0 +1,240 @@
+"""
+    This file contains the rate limiter shared by every thread and worker process calling an API.
+
+    Each limiter is a token bucket whose state lives in a small file guarded by a file lock, so
+    the scraper and the web application draw from one budget even when they run as separate
+    processes. A 429 response blocks the whole bucket until its Retry-After has passed.
+
+    Interactive calls go ahead of background calls (see `commons.priority`): each interactive
+    call is noted in the bucket state, and while one was made recently background calls may
+    not take the tokens reserved for interactive calls.
+
+    Environment:
+        RATE_LIMIT_DIR: directory holding the bucket state files (default: system temp dir)
+        SPOTIFY_RATE_LIMIT: Spotify requests per second, per credential (default 10)
+        SPOTIFY_RATE_BURST: Spotify requests allowed in a burst, per credential (default 20)
+        TICKETMASTER_RATE_LIMIT: Ticketmaster requests per second (default 5)
+
+    Usage:
+        - `from commons.rate_limit import spotify_limiter` then `spotify_limiter.acquire()`
+"""
+
+# Import libraries
+import os
+import json
+import random
+import tempfile
+import threading
+import time
+from commons.priority import current_priority, INTERACTIVE, PRIORITY_RESERVE, INTERACTIVE_WINDOW
+from commons.resilience import sleep_within_deadline
+
+try:
+    import fcntl
+
+except ImportError:
+
+    # File locks are unavailable (e.g. Windows), the budget is then only shared between threads
+    fcntl = None
+
+
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", tempfile.gettempdir())
+
+# Base and cap, in seconds, of the jittered exponential backoff
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+
+
+class TokenBucket:
+    """
+        Token bucket whose state is shared through a locked file
+
+        Args:
+            param1 (str): name of the bucket, processes using the same name share the budget
+            param2 (float): tokens added per second
+            param3 (float): maximum number of tokens in the bucket
+            param4 (str): directory holding the state file
+            param5 (float): fraction of capacity background calls leave to interactive calls
+    """
+
+    def __init__(self, name, rate, capacity, state_dir=RATE_LIMIT_DIR, reserve=PRIORITY_RESERVE):
+
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.reserve = reserve * self.capacity
+        self.path = os.path.join(state_dir, name + "_rate_limit.json")
+
+        self._thread_lock = threading.Lock()
+
+    def _update(self, update):
+        """
+            Applies update to the bucket state while holding the thread and file locks
+
+            Args:
+                param1 (function): receives the refilled state and the current time, returns a result
+
+            Returns:
+                Result of update
+        """
+
+        with self._thread_lock:
+
+            with open(self.path, "a+") as f:
+
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+
+                try:
+
+                    f.seek(0)
+                    raw = f.read()
+
+                    now = time.time()
+
+                    try:
+                        state = json.loads(raw)
+
+                    except ValueError:
+                        state = {"tokens" : self.capacity, "updated_at" : now, "blocked_until" : 0}
+
+                    # Refill the bucket for the time elapsed since the last update
+                    elapsed = max(0, now - state["updated_at"])
+                    state["tokens"] = min(self.capacity, state["tokens"] + elapsed * self.rate)
+                    state["updated_at"] = now
+
+                    result = update(state, now)
+
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+
+                    return result
+
+                finally:
+
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, tokens=1, priority=None):
+        """
+            Takes tokens from the bucket if possible
+
+            Args:
+                param1 (float): number of tokens to take
+                param2 (str): priority of the call, defaults to the current priority
+
+            Returns:
+                float: 0 if the tokens were taken, otherwise seconds to wait before trying again
+        """
+
+        interactive = (priority or current_priority()) == INTERACTIVE
+
+        def take(state, now):
+
+            if interactive:
+                state["interactive_at"] = now
+
+            if now < state["blocked_until"]:
+                return state["blocked_until"] - now
+
+            # Background calls yield the reserve while interactive calls are being made
+            floor = 0
+
+            if not interactive and now - state.get("interactive_at", 0) < INTERACTIVE_WINDOW:
+                floor = min(self.reserve, self.capacity - tokens)
+
+            if state["tokens"] - floor >= tokens:
+
+                state["tokens"] -= tokens
+
+                return 0
+
+            return (tokens + floor - state["tokens"]) / self.rate
+
+        return self._update(take)
+
+    def acquire(self, tokens=1):
+        """
+            Blocks until tokens could be taken from the bucket
+
+            Args:
+                param1 (float): number of tokens to take
+
+            Raises:
+                DeadlineExceeded: the active deadline would pass before the tokens are available
+        """
+
+        while True:
+
+            wait = self.try_acquire(tokens)
+
+            if wait <= 0:
+                return
+
+            sleep_within_deadline(wait)
+
+    def block_for(self, seconds):
+        """
+            Stops every user of the bucket from sending requests for the given time,
+            e.g. after a 429 response with a Retry-After header
+
+            Args:
+                param1 (float): seconds to wait
+        """
+
+        def block(state, now):
+
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+            state["tokens"] = 0
+
+        self._update(block)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+        Jittered exponential backoff ("full jitter")
+
+        Args:
+            param1 (int): number of the retry, starting at 0
+            param2 (float): delay of the first retry
+            param3 (float): maximum delay
+
+        Returns:
+            float: seconds to wait before the retry
+    """
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_delay(response, attempt):
+    """
+        Returns how long to wait after a 429 response, honouring its Retry-After header
+
+        Args:
+            param1 (Response): rate limited response
+            param2 (int): number of the retry, starting at 0
+
+        Returns:
+            float: seconds to wait before the retry
+    """
+
+    try:
+        retry_after = float(response.headers.get('Retry-After'))
+
+    except (TypeError, ValueError):
+        return backoff_delay(attempt)
+
+    # Spread the retries of concurrent callers instead of waking them all at once
+    return retry_after + random.uniform(0, BACKOFF_BASE)
+
+
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 10))
+SPOTIFY_RATE_BURST = float(os.getenv("SPOTIFY_RATE_BURST", 20))
+
+# Budget of the default credential, see commons.credential_pool for additional credentials
+spotify_limiter = TokenBucket("spotify", SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST)
+
+ticketmaster_limiter = TokenBucket("ticketmaster", float(os.getenv("TICKETMASTER_RATE_LIMIT", 5)),
+                                   float(os.getenv("TICKETMASTER_RATE_LIMIT", 5)))
@@ -0,0 +1,259 @@
+"""
+    This file contains the request deadlines and circuit breakers protecting upstream calls.
+
+    A `Deadline` bounds the total time a user request may spend waiting on Spotify and
+    Ticketmaster. It is activated with `deadline_scope` and read by the shared transport, which
+    shortens each call's read timeout to the time left and refuses to send once it has passed.
+    The active deadline is a context variable, so work handed to thread pools must be submitted
+    with `submit_in_context` to keep it.
+
+    Each upstream host has a `CircuitBreaker`. After several consecutive connection failures,
+    timeouts or server errors it opens and calls to that host fail fast. After a cool-down a
+    single trial call is let through, and the breaker closes again once that call succeeds.
+
+    Environment:
+        REQUEST_DEADLINE: seconds a web request may spend on upstream calls (default 60)
+        CIRCUIT_FAILURE_THRESHOLD: consecutive failures that open a breaker (default 5)
+        CIRCUIT_RESET_TIMEOUT: seconds an open breaker waits before a trial call (default 30)
+
+    Usage:
+        - `with deadline_scope(Deadline(REQUEST_DEADLINE)):` around the work of a web request
+        - `pool.submit(*submit_in_context(function, *args))` to keep the deadline in a worker thread
+"""
+
+# Import libraries
+import os
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 60))
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+
+class DeadlineExceeded(Exception):
+    """
+        Raised when the deadline of a request has passed before an upstream call could complete
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+        Raised instead of calling an upstream whose circuit breaker is open
+    """
+
+
+class Deadline:
+    """
+        Point in time by which a request must be done
+
+        Args:
+            param1 (float): seconds from now
+    """
+
+    def __init__(self, seconds):
+
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+
+        return self.remaining() <= 0
+
+    def check(self):
+        """
+            Raises DeadlineExceeded if the deadline has passed
+        """
+
+        if self.expired():
+            raise DeadlineExceeded("Request deadline exceeded")
+
+
+_current_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline():
+    """
+        Returns the active deadline, None outside of a deadline scope
+    """
+
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """
+        Activates a deadline for the calls made inside the block, None leaves the calls unbounded
+
+        Args:
+            param1 (Deadline): deadline to activate
+    """
+
+    token = _current_deadline.set(deadline)
+
+    try:
+        yield deadline
+
+    finally:
+        _current_deadline.reset(token)
+
+
+def check_deadline():
+    """
+        Raises DeadlineExceeded if the active deadline has passed
+    """
+
+    deadline = current_deadline()
+
+    if deadline is not None:
+        deadline.check()
+
+
+def sleep_within_deadline(seconds):
+    """
+        Sleeps, unless the active deadline would pass first
+
+        Args:
+            param1 (float): seconds to sleep
+    """
+
+    deadline = current_deadline()
+
+    if deadline is not None and deadline.remaining() < seconds:
+        raise DeadlineExceeded(f"Request deadline exceeded, cannot wait {seconds:.1f} seconds")
+
+    time.sleep(seconds)
+
+
+def submit_in_context(function, *args):
+    """
+        Wraps a call so it runs in a copy of the caller's context, keeping the active deadline
+
+        Args:
+            param1 (function): function to call
+            param2: arguments of the call
+
+        Returns:
+            tuple: arguments for `Executor.submit`
+    """
+
+    return (contextvars.copy_context().run, function, *args)
+
+
+class CircuitBreaker:
+    """
+        Fails calls fast while an upstream is unhealthy
+
+        Args:
+            param1 (str): name of the upstream, shown in logs
+            param2 (int): consecutive failures that open the breaker
+            param3 (float): seconds the breaker stays open before a trial call
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def allow(self):
+        """
+            Tells whether a call may be sent, reserving the trial call of a half-open breaker
+
+            Returns:
+                bool: True if the call may be sent
+        """
+
+        with self._lock:
+
+            if self._opened_at is None:
+                return True
+
+            # Half open: let a single trial call through once the cool-down is over
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+
+                self._trial_in_flight = True
+
+                return True
+
+            return False
+
+    def record_success(self):
+
+        with self._lock:
+
+            if self._opened_at is not None:
+                print(f"Circuit for {self.name} closed.")
+
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_cancelled(self):
+        """
+            Releases the trial call of a half-open breaker that was abandoned for a reason
+            unrelated to the upstream, e.g. the request deadline passed
+        """
+
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+
+        with self._lock:
+
+            self._failures += 1
+
+            # A failed trial reopens the breaker for another cool-down
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+
+                if self._opened_at is None:
+                    print(f"Circuit for {self.name} opened after {self._failures} consecutive failures.")
+
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def check(self):
+        """
+            Raises CircuitOpenError if the call may not be sent
+        """
+
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable, circuit open")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """
+        Returns the circuit breaker of the host of url, creating it on first use
+
+        Args:
+            param1 (str): url of the request
+
+        Returns:
+            CircuitBreaker: breaker of the host
+    """
+
+    host = urlsplit(url).netloc
+
+    with _breakers_lock:
+
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+
+        return _breakers[host]
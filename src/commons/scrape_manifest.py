@@ -0,0 +1,220 @@
+"""
+    This file contains the manifest checkpointing a corpus scrape, so reruns resume where they stopped.
+
+    The manifest is a journal, one JSON line per finished unit of work: a completed playlist with
+    the file it was written to and the SHA-256 of that file, or a failure with its error. A line is
+    appended and flushed to disk as soon as the work is done, so an interrupted run loses at most
+    the work in flight. A torn last line is ignored when the journal is read back, and the next
+    line is started on a line of its own. Worker processes of one host share the journal and only
+    ever append to it, so it is compacted to one line per unit of work only when a single-process
+    run starts.
+
+    Output files are written with `atomic_write`, to a temporary file renamed over the target, so
+    a file listed in the manifest is always complete.
+
+    Usage:
+        - `manifest = ScrapeManifest("data/json/json_scraped/manifest.jsonl")`
+        - `if not manifest.is_done(key):` ... `manifest.record_done(key, path, digest, tracks)`
+"""
+
+# Import libraries
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def atomic_write(path, data):
+    """
+        Writes a file so that it is either fully written or left untouched
+
+        Args:
+            param1 (str): path of the file
+            param2 (bytes): content of the file
+
+        Returns:
+            str: SHA-256 of the content, hex encoded
+    """
+
+    temporary_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+    with open(temporary_path, "wb") as f:
+
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temporary_path, path)
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    """
+        Returns the SHA-256 of a file, None if it does not exist
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class ScrapeManifest:
+    """
+        Journal of the playlists of a scrape that are done or failed
+
+        Args:
+            param1 (str): path of the journal
+            param2 (bool): rewrite the journal with one line per unit of work, only safe when
+                no other process is appending to it
+    """
+
+    def __init__(self, path, compact=True):
+
+        self.path = path
+        self.entries = {}
+
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.load()
+
+        if compact:
+            self.compact()
+
+    def load(self):
+        """
+            Reads the journal back, the last line of each unit of work wins
+        """
+
+        entries = {}
+
+        if os.path.exists(self.path):
+
+            with open(self.path, "r", encoding="utf-8") as f:
+
+                for line in f:
+
+                    try:
+                        entry = json.loads(line)
+
+                    # Line torn by an interruption
+                    except ValueError:
+                        continue
+
+                    entries[entry["key"]] = entry
+
+        with self._lock:
+            self.entries = entries
+
+    def compact(self):
+
+        with self._lock:
+
+            lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.entries.values())
+
+            atomic_write(self.path, lines.encode("utf-8"))
+
+    def _append(self, entry):
+
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with self._lock:
+
+            with open(self.path, "a+b") as f:
+
+                # A line torn by an interruption would swallow this entry, it goes on a line of its own
+                if f.seek(0, os.SEEK_END) > 0:
+
+                    f.seek(-1, os.SEEK_END)
+
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+
+                # One write, so entries appended by other processes never interleave
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.entries[entry["key"]] = entry
+
+    def is_done(self, key, verify=True):
+        """
+            Tells whether a unit of work was completed by an earlier run
+
+            Args:
+                param1 (str): unit of work, e.g. 'genre/playlist id'
+                param2 (bool): also check that its output file still has the recorded hash
+
+            Returns:
+                bool: True if the work can be skipped
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None or entry["status"] != "done":
+            return False
+
+        if verify and file_digest(entry["file"]) != entry["sha256"]:
+
+            print(f"Output of {key} is missing or was modified, it will be scraped again.")
+
+            return False
+
+        return True
+
+    def record_done(self, key, file_path, digest, tracks):
+        """
+            Records a completed unit of work
+
+            Args:
+                param1 (str): unit of work
+                param2 (str): path of the output file
+                param3 (str): SHA-256 of the output file
+                param4 (int): number of tracks written
+        """
+
+        self._append({"key" : key, "status" : "done", "file" : file_path, "sha256" : digest,
+                      "tracks" : tracks, "finished_at" : time.time()})
+
+    def record_failure(self, key, error):
+        """
+            Records a failed unit of work, it is retried by the next run
+
+            Args:
+                param1 (str): unit of work
+                param2 (str): error that made it fail
+        """
+
+        previous = self.entries.get(key, {})
+
+        self._append({"key" : key, "status" : "failed", "error" : error,
+                      "attempts" : previous.get("attempts", 0) + 1, "finished_at" : time.time()})
+
+    def failures(self):
+        """
+            Returns the units of work whose last attempt failed
+
+            Returns:
+                dict: manifest entry by unit of work
+        """
+
+        with self._lock:
+            return {key : entry for key, entry in self.entries.items() if entry["status"] == "failed"}
+
+    def summary(self):
+
+        with self._lock:
+            done = sum(1 for entry in self.entries.values() if entry["status"] == "done")
+
+        return f"{done} playlists done, {len(self.failures())} failed"
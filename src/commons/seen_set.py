@@ -0,0 +1,249 @@
+"""
+    This file contains the disk-backed set of Spotify IDs a corpus scrape has already written.
+
+    Genre playlists overlap heavily, so each track should be fetched and written once, by the
+    first playlist that references it, while the other playlists only list its ID. The set is
+    stored in SQLite next to the scraped files, so memory stays bounded at corpus scale and the
+    set survives interrupted runs together with the manifest in `commons.scrape_manifest`.
+
+    Each ID is claimed by the unit of work (e.g. 'genre/playlist id') that first saw it. A unit of
+    work that is retried after a failure or an interruption gets its own claims back, so the rows
+    it owns are written once it succeeds. Before writing, a unit of work fetches its missing tracks
+    once more and claims again the IDs it skipped, taking over those another unit of work has
+    given up in the meantime. Claims whose rows still could not be written (e.g. the track has no
+    audio features) are then released, so a later unit of work can write them.
+
+    Workers on several hosts share a `RedisSeenSet` instead, stored on the broker of the work
+    queue in `commons.work_queue`.
+
+    Usage:
+        - `seen = SeenSet("data/json/json_scraped/seen.sqlite3")`
+        - `new_ids = seen.claim("track", ids, key)` then `seen.release("track", unwritten_ids, key)`
+"""
+
+# Import libraries
+import os
+import sqlite3
+import threading
+
+try:
+    import redis
+
+except ImportError:
+
+    # Only the SQLite seen-set is available
+    redis = None
+
+
+# SQLite limits the number of variables in a single statement
+QUERY_CHUNK_SIZE = 500
+
+
+class SeenSet:
+    """
+        SQLite-backed set of IDs, each claimed by the unit of work that saw it first
+
+        Args:
+            param1 (str): path of the SQLite database
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+
+        if self._connection is None:
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+
+            # WAL lets scraper processes sharing the set read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS seen (
+                    kind TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    PRIMARY KEY (kind, id)
+                ) WITHOUT ROWID""")
+
+            self._connection = connection
+
+        return self._connection
+
+    def claim(self, kind, ids, owner):
+        """
+            Claims the IDs nobody has seen yet
+
+            Args:
+                param1 (str): kind of entity, e.g. 'track'
+                param2 (list): Spotify IDs, duplicates allowed
+                param3 (str): unit of work claiming the IDs
+
+            Returns:
+                list: IDs claimed by owner, now or by an earlier attempt, in the order of ids
+        """
+
+        ids = list(dict.fromkeys(ids))
+        claimed = set()
+
+        with self._lock:
+
+            connection = self._connect()
+
+            # Claims are atomic, two workers seeing the same ID at once cannot both get it
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+
+                for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+
+                    chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                    placeholders = ",".join("?" * len(chunk))
+
+                    connection.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?, ?)",
+                                           [(kind, entity_id, owner) for entity_id in chunk])
+
+                    rows = connection.execute(
+                        f"SELECT id FROM seen WHERE kind = ? AND owner = ? AND id IN ({placeholders})",
+                        [kind, owner, *chunk]).fetchall()
+
+                    claimed.update(entity_id for entity_id, in rows)
+
+                connection.execute("COMMIT")
+
+            except sqlite3.Error:
+
+                connection.execute("ROLLBACK")
+
+                raise
+
+        return [entity_id for entity_id in ids if entity_id in claimed]
+
+    def release(self, kind, ids, owner):
+        """
+            Gives up claims, IDs claimed by another unit of work are left as they are
+
+            Args:
+                param1 (str): kind of entity, e.g. 'track'
+                param2 (list): Spotify IDs
+                param3 (str): unit of work that claimed the IDs
+        """
+
+        ids = list(dict.fromkeys(ids))
+
+        with self._lock:
+
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+
+                for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+
+                    chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                    placeholders = ",".join("?" * len(chunk))
+
+                    connection.execute(f"DELETE FROM seen WHERE kind = ? AND owner = ? AND id IN ({placeholders})",
+                                       [kind, owner, *chunk])
+
+                connection.execute("COMMIT")
+
+            except sqlite3.Error:
+
+                connection.execute("ROLLBACK")
+
+                raise
+
+    def __len__(self):
+
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+
+class RedisSeenSet:
+    """
+        Redis-backed set of IDs, shared by workers on any number of hosts
+
+        Args:
+            param1 (str): Redis url, e.g. redis://broker:6379/0
+            param2 (str): name of the set
+    """
+
+    def __init__(self, url, name):
+
+        if redis is None:
+            raise ImportError("The redis package is needed for a Redis seen-set")
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = f"seen:{name}:"
+
+        # Deletes the IDs still owned by ARGV[1], atomically
+        self._release = self.client.register_script("""
+            for i = 2, #ARGV do
+                if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[1] then
+                    redis.call('HDEL', KEYS[1], ARGV[i])
+                end
+            end""")
+
+    def claim(self, kind, ids, owner):
+        """
+            Claims the IDs nobody has seen yet, see SeenSet.claim
+        """
+
+        ids = list(dict.fromkeys(ids))
+
+        if len(ids) == 0:
+            return []
+
+        key = self.prefix + kind
+
+        # HSETNX is atomic, the first worker to set an ID owns it
+        pipeline = self.client.pipeline()
+
+        for entity_id in ids:
+            pipeline.hsetnx(key, entity_id, owner)
+
+        pipeline.execute()
+
+        owners = self.client.hmget(key, ids)
+
+        return [entity_id for entity_id, entity_owner in zip(ids, owners) if entity_owner == owner]
+
+    def release(self, kind, ids, owner):
+        """
+            Gives up claims, see SeenSet.release
+        """
+
+        ids = list(dict.fromkeys(ids))
+
+        if len(ids) > 0:
+            self._release(keys=[self.prefix + kind], args=[owner, *ids])
+
+    def __len__(self):
+
+        return sum(self.client.hlen(key) for key in self.client.scan_iter(self.prefix + "*"))
+
+
+def open_seen_set(url, name, path):
+    """
+        Opens the seen-set shared by the workers of a corpus scrape
+
+        Args:
+            param1 (str): Redis url of the work queue broker, or None
+            param2 (str): name of the set on the broker
+            param3 (str): path of the SQLite database used without a Redis broker
+
+        Returns:
+            SeenSet or RedisSeenSet: the set
+    """
+
+    if url is not None and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSeenSet(url, name)
+
+    return SeenSet(path)
@@ -5,143 +5,70 @@
 """
 
 from dotenv import load_dotenv
-import os
-import base64
-from requests import post, get
+import sys
 import json
-import time
-
+from pathlib import Path
+# Load .env file, before the commons modules read their settings
 load_dotenv()
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from commons.endpoints import SPOTIFY_API_BASE_URL
+from commons.pagination import get_all_pages
+from commons.spotify_auth import get_token, get_auth_header
+from commons.spotify_client import SpotifyClient, api_request, cache_batch
+from commons.spotify_playlists import get_playlist_track_ids
+from commons.spotify_search import resolve_names
+from commons.track_records import requested_track_id
 
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
-
-def get_token():
-
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-
-    url = "https://accounts.spotify.com/api/token"
-
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type":"application/x-www-form-urlencoded"
-        }
-    
-    data = {"grant_type": "client_credentials"}
-
-    result = post(url, headers = headers, data = data)
-
-    json_result = json.loads(result.content)
-
-    token = json_result["access_token"]
-    return token
-
-
-def get_auth_header(token):
-
-    return {"Authorization":"Bearer " + token}
-
-
-def api_request(url, headers, params=None, data=None):
-
-    retry = True
-
-    while retry:
-
-        response = get(url, headers=headers, params=params, data=data)
-
-        if response.status_code == 200:
-            return response
-        
-        elif response.status_code == 429:
-
-            retry_after = int(response.headers.get('Retry-After'))
-            print(f"Rate limit exceeded. Wait for {retry_after} seconds before trying again.")
-            return 'Try again'
-        else:
-
-            print(f"Request failed with error {response.status_code}: {response.text}")
-            
-            return None
-        
 def search_for_artist(token, artist_name):
 
-    url = "https://api.spotify.com/v1/search"
-    headers = get_auth_header(token)
-
-    query = f"q={artist_name}&type=artist&limit=1"
-
-    query_url = url + "?" + query
+    artist_id = resolve_names(SpotifyClient(token), [artist_name], 'artist')[artist_name]
 
-    result = get(query_url, headers = headers)
-
-    artist_id = json.loads(result.content)["artists"]["items"][0]["id"]
-    if len(artist_id) ==0:
+    if artist_id is None:
         print("No artist found with this name")
-        return None
 
-    else:
-        return artist_id
+    return artist_id
 
 def search_for_track(token, track_name):
 
-    url = "https://api.spotify.com/v1/search"
-    headers = get_auth_header(token)
-
-    query = f"q={track_name}&type=track&limit=1"
+    track_id = resolve_names(SpotifyClient(token), [track_name], 'track')[track_name]
 
-    query_url = url + "?" + query
-
-    result = get(query_url, headers = headers)
-
-    track_id = json.loads(result.content)["tracks"]["items"][0]["id"]
-    if len(track_id) == 0:
+    if track_id is None:
         print("No track found with this name")
-        return None
-
-    else:
-        return track_id
 
-def get_top_songs_by_artists(token, artist_id):
-    url = f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks?country=US"
-    headers = get_auth_header(token)
+    return track_id
 
-    result = get(url, headers = headers)
+def get_top_songs_by_artists(client, artist_id):
 
-    json_result = json.loads(result.content)["tracks"]
+    url = f"{SPOTIFY_API_BASE_URL}/artists/{artist_id}/top-tracks"
 
-    tracks_dict = {
-        "tracks" : []
-    }
+    json_result = client.get_json(url, params={'country' : 'US'})
 
-    tracks_list = []
-    for index, track in enumerate(json_result):
+    if json_result is None or len(json_result["tracks"]) == 0:
+        print("No artist found with this name")
+        return None
 
-        if index == 10:
-            break
+    top_tracks = json_result["tracks"][:10]
 
-        tracks = get_track_info(track)
+    # Top tracks are full track objects, keep them for later track lookups
+    cache_batch('track', [track["id"] for track in top_tracks], top_tracks)
 
-        tracks_list.append(tracks)
-    
-    tracks_dict["tracks"] = tracks_list
+    # One batched request hydrates the genres of every track instead of one per track
+    artists = get_artists(client, [track["artists"][0]["id"] for track in top_tracks])
 
-    json_result_formatted = json.dumps(tracks_dict, indent=4)
-    if len(json_result) ==0:
-        print("No artist found with this name")
-        return None
+    tracks_dict = {
+        "tracks" : [get_track_info(track, artists) for track in top_tracks]
+    }
 
-    else:
-        return tracks_dict
+    return tracks_dict
 
 def get_songs_by_playlists(token, playlist_id):
 
-    playlist_info_url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
+    playlist_info_url = f'{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}'
     headers = get_auth_header(token)
 
-    playlist_result = api_request(playlist_info_url, headers = headers)
+    params = {'fields' : 'name,owner(display_name,id),followers.total'}
+
+    playlist_result = api_request(playlist_info_url, headers = headers, params = params)
 
     playlist_info_dict = {
         'name' : None,
@@ -164,78 +91,45 @@ def get_songs_by_playlists(token, playlist_id):
         playlist_info_dict['owner id'] = playlist_info["owner"]["id"]
         playlist_info_dict['followers'] = playlist_info["followers"]["total"]
 
-    # Creating offset to parse all tracks
-    offset = 0
-    track_ids = []
-
-    while True:
-
-        url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?offset={offset}&limit=100"
-        headers = get_auth_header(token)
-
-        result = api_request(url, headers = headers)
-
-        if playlist_result is None or playlist_result == 'Try again':
-
-            print("Failed to retrieve playlist information.")
-
-        else:
-
-            playlist= json.loads(result.content)
-
-            playlist_tracks = playlist["items"]
-            for item in playlist_tracks:
-                track_id = item['track']['id']
-                track_ids.append(track_id)
+    # Track IDs are fetched with a fields= projection and reused while the snapshot is unchanged
+    playlist_info_dict['tracks'] = get_playlist_track_ids(token, playlist_id)
+    
+    return playlist_info_dict
 
-            if playlist['next']:
+def get_artist_metadata(artist):
 
-                offset += 100
-            else:
+    artist_metadata = {
+        "followers" : artist["followers"]["total"],
+        "genres" : artist["genres"],
+        "name" : artist["name"],
+        "id" : artist["id"],
+        "popularity" : artist["popularity"]
+    }
 
-                break
-            
-    playlist_info_dict['tracks'] = track_ids
-    
-    return playlist_info_dict
+    return artist_metadata
 
-def get_artist(token, artist_id):
+def get_artists(client, artist_id_list):
 
-    url = f"https://api.spotify.com/v1/artists/{artist_id}"
+    url = f"{SPOTIFY_API_BASE_URL}/artists"
 
-    headers = get_auth_header(token)
+    # Unique artists are fetched 50 per request, cached artists are not requested again
+    artist_id_list = list(dict.fromkeys(artist_id_list))
 
-    result = get(url, headers = headers)
+    artist_data = client.get_entities(url, artist_id_list, 50, 'artists', 'artist')
 
-    if result.status_code == 429:
-        retry_after = int(result.headers.get('Retry-After'))
-        print(f"Rate limit exceeded. Wait for {retry_after} seconds before trying again.")
-        return 'try again'
-    
-    elif result.status_code == 200:
+    return {artist_id : get_artist_metadata(artist) for artist_id, artist in zip(artist_id_list, artist_data) \
+            if artist is not None}
 
-        json_result = json.loads(result.content)
+def get_artist(client, artist_id):
 
-        followers = json_result["followers"]["total"]
-        artist_genre = json_result["genres"]
-        artist_name = json_result["name"]
-        artist_popularity = json_result["popularity"]
+    artist_metadata = get_artists(client, [artist_id]).get(artist_id)
 
-        artist_metadata = {
-            "followers" : followers,
-            "genres" : artist_genre, 
-            "name" : artist_name,
-            "id" : artist_id,
-            "popularity" : artist_popularity
-        }
-        if len(result.content) ==0:
-            print("Wrong ID")
-            return None
+    if artist_metadata is None:
+        print("Wrong ID")
 
-        else:
-            return artist_metadata
+    return artist_metadata
 
-def get_track_info(track):
+def get_track_info(track, artists=None):
 
     tracks = {
         "id" : None,
@@ -251,9 +145,9 @@ def get_track_info(track):
         "popularity" : None,
     }
 
-    tracks["id"] = track["id"]
+    # Keyed like the audio features, by the ID that was requested
+    tracks["id"] = requested_track_id(track)
     tracks["name"]= track["name"]
-    # tracks["artist id"] = track["album"]["artists"][0]["id"]
     tracks["popularity"] = track["popularity"]
     tracks["duration_ms"] = track["duration_ms"]
     tracks["album type"] = track["album"]["album_type"]
@@ -261,37 +155,20 @@ def get_track_info(track):
     tracks["album name"] = track["album"]["name"]
     tracks["album release date"] = track["album"]["release_date"]
 
-    artists = track["artists"]
-
-    artist_dict = {
-        "name" : None,
-        "id" : None
-    }
-    # genre = get_artist(token, artist_id)
-
     artist_name_list = []
     artist_id_list = []
 
-    artist_dict_list = []         
-    for artist in artists:
+    for artist in track["artists"]:
 
         artist_name_list.append(artist["name"])
         artist_id_list.append(artist["id"])
-        
-        artist_dict_list.append(artist_dict)
-        
-        artist_dict = {
-            "name" : None,
-            "id" : None
-        }
-    
-    artist_id = artists[0]["id"]
-    genre = get_artist(token, artist_id)["genres"]
-    
+
+    # Genres come from the artists hydrated in batch by the caller, see get_artists
+    artist_metadata = (artists or {}).get(artist_id_list[0]) if len(artist_id_list) > 0 else None
 
     tracks["artist id"] = artist_id_list
     tracks["artists"] = artist_name_list
-    tracks["artist genre"] = genre
+    tracks["artist genre"] = artist_metadata["genres"] if artist_metadata is not None else []
 
     return tracks
     
@@ -332,174 +209,60 @@ def get_track_feature_info(track_features):
     return track_feature_info
 
 
-def get_track(token, track_id):
-
-    url = f"https://api.spotify.com/v1/tracks/{track_id}"
-    headers = get_auth_header(token)
-
-    result = get(url, headers = headers)
+def get_track(client, track_id):
 
-    track = json.loads(result.content)
+    url = f"{SPOTIFY_API_BASE_URL}/tracks"
 
-    tracks = get_track_info(track)
+    track = client.get_entities(url, [track_id], 50, 'tracks', 'track', params={'market' : 'US'})[0]
 
-    if len(tracks) ==0:
+    if track is None:
         print("No track found with this name")
         return None
 
-    else:
-        return tracks
+    return get_track_info(track, get_artists(client, [track["artists"][0]["id"]]))
 
-def get_track_features(token, track_id):
+def get_track_features(client, track_id):
 
-    url = f"https://api.spotify.com/v1/audio-features/{track_id}"
-    headers = get_auth_header(token)
+    url = f"{SPOTIFY_API_BASE_URL}/audio-features"
 
-    result = get(url, headers = headers)
+    features = client.get_entities(url, [track_id], 100, 'audio_features', 'audio_features')[0]
 
-    features = json.loads(result.content)
-
-    if len(features) ==0:
+    if features is None:
         print("No track found with this id")
         return None
 
     else:
         return get_track_feature_info(features)
 
-def get_mul_tracks(token, playlist_id, track_id_list):
+def get_mul_tracks(client, playlist_id, track_id_list):
 
-    params = {
-        'ids' : ','.join(track_id_list[:50]), # Get first 50 tracks
-        'market' : 'US'
-    }
+    url = f"{SPOTIFY_API_BASE_URL}/tracks"
+
+    # Tracks are fetched 50 per request, then their artists 50 per request
+    track_data = client.get_entities(url, track_id_list, 50, 'tracks', 'track', params={'market' : 'US'})
+    track_data = [track for track in track_data if track is not None]
+
+    artists = get_artists(client, [track["artists"][0]["id"] for track in track_data])
 
     playlist_track_info_dict = {
         'playlist id' : playlist_id,
-        'tracks' : []
+        'tracks' : [get_track_info(track, artists) for track in track_data]
     }
 
-    tracks_list = []
-
-    url = f"https://api.spotify.com/v1/tracks"
-    headers = get_auth_header(token)
-
-    playlist_result = api_request(url, headers=headers, params=params)
-
-    if playlist_result is None or playlist_result == 'Try again':
-
-        print("Failed to retrieve playlist information.")
-
-    else:
-        
-        tracks = json.loads(playlist_result.content)
-
-        track_data = tracks['tracks']
-
-        track_id_length = len(track_id_list)
-
-        for track in track_data:
-            
-            track_info = get_track_info(track)
-
-            tracks_list.append(track_info)
-        
-        offset = 50
-        
-        while offset < track_id_length:
-
-            params['ids'] = ','.join(track_id_list[offset:offset+50])
-
-            playlist_result = api_request(url, headers=headers, params=params)
-
-            if playlist_result is None or playlist_result == 'Try again':
-
-                print("Failed to retrieve playlist information.")
-
-            else:   
-                
-                tracks = json.loads(playlist_result.content)
-
-                track_data = tracks['tracks']
-
-                for track in track_data:
-                    
-                    track_info = get_track_info(track)
-
-                    tracks_list.append(track_info)
-            
-            offset += 50
-
-    playlist_track_info_dict['playlist id'] = playlist_id
-    playlist_track_info_dict['tracks'] = tracks_list
-
     return playlist_track_info_dict
 
 
-def get_mul_tracks_features(token, playlist_id, track_id_list):
+def get_mul_tracks_features(client, playlist_id, track_id_list):
 
-    params = {
-        'ids' : ','.join(track_id_list[:100]), # Get first 100 tracks
-    }
+    url = f"{SPOTIFY_API_BASE_URL}/audio-features"
+
+    track_data = client.get_entities(url, track_id_list, 100, 'audio_features', 'audio_features')
 
     playlist_track_feature_info_dict = {
         'playlist id' : playlist_id,
-        'tracks' : []
+        'tracks' : [get_track_feature_info(track) for track in track_data if track is not None]
     }
 
-    tracks_features_list = []
-
-    url = f"https://api.spotify.com/v1/audio-features"
-    headers = get_auth_header(token)
-
-    playlist_result = api_request(url, headers=headers, params=params)
-
-    if playlist_result is None or playlist_result == 'Try again':
-
-        print("Failed to retrieve playlist information.")
-
-    else:
-        
-        tracks = json.loads(playlist_result.content)
-
-        track_data = tracks['audio_features']
-
-        track_id_length = len(track_id_list)
-        
-        for track in track_data:
-            
-            track_info = get_track_feature_info(track)
-
-            tracks_features_list.append(track_info)
-        
-        offset = 100
-        
-        while offset < track_id_length:
-
-            params['ids'] = ','.join(track_id_list[offset:offset+100])
-
-            playlist_result = api_request(url, headers=headers, params=params)
-
-            if playlist_result is None or playlist_result == 'Try again':
-
-                print("Failed to retrieve playlist information.")
-
-            else:   
-                
-                tracks = json.loads(playlist_result.content)
-
-                track_data = tracks['audio_features']
-
-                for track in track_data:
-                    
-                    track_info = get_track_feature_info(track)
-
-                    tracks_features_list.append(track_info)
-            
-            offset += 100
-
-    playlist_track_feature_info_dict['playlist id'] = playlist_id
-    playlist_track_feature_info_dict['tracks'] = tracks_features_list
-
     return playlist_track_feature_info_dict
 
 def concatenate_playlist_info(playlist_track_info, playlist_features_info):
@@ -510,89 +273,47 @@ def concatenate_playlist_info(playlist_track_info, playlist_features_info):
         }
     
     track_info_id = playlist_track_info["playlist id"]
-    track_features_id = playlist_tracks_features_info["playlist id"]
+    track_features_id = playlist_features_info["playlist id"]
 
-    playlist_tracks_list = playlist_track_info["tracks"]
-    playlist_tracks_features_list = playlist_features_info["tracks"]
+    if track_info_id != track_features_id:
+        return playlist_tracks_all_info_dict
 
-    if (track_info_id == track_features_id) and len(playlist_tracks_features_list) == len(playlist_tracks_list):
+    playlist_tracks_all_info_dict["playlist id"] = track_info_id
 
-        playlist_tracks_all_info_dict["playlist id"] = track_info_id
+    # Tracks and features are matched by ID, a missing entry on one side only loses that track
+    features_by_id = {features["id"] : features for features in playlist_features_info["tracks"]}
 
-        playlist_tracks_list = playlist_track_info["tracks"]
-        playlist_tracks_features_list = playlist_features_info["tracks"]
+    playlist_tracks_all_info_dict["tracks"] = [{**track, **features_by_id[track["id"]]} \
+                                               for track in playlist_track_info["tracks"] if track["id"] in features_by_id]
 
-        playlist_tracks_all_info_dict["tracks"] = [{**playlist_tracks_list[i], **playlist_tracks_features_list [i]}\
-                                               for i in range(len(playlist_tracks_list))]
+    without_features = len(playlist_track_info["tracks"]) - len(playlist_tracks_all_info_dict["tracks"])
+
+    if without_features > 0:
+        print(f"Playlist {track_info_id}: {without_features} tracks without features were left out.")
 
     return playlist_tracks_all_info_dict
 
 def get_categories_playlists(token, category_id):
 
-    offset = 0
+    url = f"{SPOTIFY_API_BASE_URL}/browse/categories/{category_id}/playlists"
 
-    headers = get_auth_header(token)
+    # total is read from the first page, the remaining pages are fetched concurrently
+    playlists = get_all_pages(token, url, 50, paging_key="playlists", params={"country" : "US"})
 
-    url = f"https://api.spotify.com/v1/browse/categories/{category_id}/playlists"
-    
-    playlist_result = api_request(url, headers=headers, params={"limit": 1, "offset": 0})
-
-    if playlist_result is None or playlist_result == 'Try again':
+    if playlists is None:
 
         print("Failed to retrieve playlist information.")
-        
-
-    else:
-
-        total = json.loads(playlist_result.content)["playlists"]["total"]
-        print("total: " , total)
-
-
-    playlist_id_list = []
-
-    while len(playlist_id_list) < total:
-        
-        params = {
-            "limit" : 50,
-            "country" : "US",
-            "offset" : offset
-        }
-        url = f"https://api.spotify.com/v1/browse/categories/{category_id}/playlists"
-        headers = get_auth_header(token)
-        
-        playlist_result = api_request(url, headers=headers, params=params)
 
-        if playlist_result is None or playlist_result == 'Try again':
-
-            print("Failed to retrieve playlist information.")
-
-        else:
-
-            response = json.loads(playlist_result.content)
-
-            
-            playlist_list = response["playlists"]["items"]
-
-            for playlists in playlist_list:
-
-                if playlists == None:
-                    total -= 1
-                
-                elif playlists != None:
-
-                    playlist_id_list.append(playlists["id"])
-
-            offset += 50
-
-        #print(len((playlist_id_list)))
+        return None
 
-            
+    playlist_id_list = list(dict.fromkeys(playlist["id"] for playlist in playlists if playlist is not None))
 
-    print(len(list(set(playlist_id_list))))
-    return response
+    print(len(playlist_id_list))
+    return playlist_id_list
     
 if __name__ == "__main__":
     token = get_token()
+    client = SpotifyClient(token)
 
     # Get Artist ID
     # artist_id = search_for_artist(token, "Goo Goo Dolls")
@@ -600,14 +321,14 @@ if __name__ == "__main__":
     # print("<-------------------------------------------------------->")
 
     # # Get Artist Info 
-    # artist_info = get_artist(token, artist_id)
+    # artist_info = get_artist(client, artist_id)
     # print(artist_info['genres'])
    
     # with open('artist_info.json', 'w', encoding='utf-8') as f:
     #     json.dump(artist_info, f, ensure_ascii=False, indent=4)
 
     # # Get an Artist's top 10 tracks
-    # artist_top_tracks = get_top_songs_by_artists(token, artist_id)
+    # artist_top_tracks = get_top_songs_by_artists(client, artist_id)
 
     # with open('artist_top_tracks.json', 'w', encoding='utf-8') as f:
     #     json.dump(artist_top_tracks, f, ensure_ascii=False, indent=4)
@@ -617,7 +338,7 @@ if __name__ == "__main__":
     # print(track_id)
 
     # # Get a track info
-    # track_info = get_track(token, "0G21yYKMZoHa30cYVi1iA8")
+    # track_info = get_track(client, "0G21yYKMZoHa30cYVi1iA8")
     # print(track_info)
     # with open('track_info.json', 'w', encoding='utf-8') as f:
     #     json.dump(track_info, f, ensure_ascii=False, indent=4)
@@ -625,7 +346,7 @@ if __name__ == "__main__":
     
 
     # # Get track features
-    # track_features = get_track_features(token, track_id)
+    # track_features = get_track_features(client, track_id)
     # with open('track_features.json', 'w', encoding='utf-8') as f:
     #     json.dump(track_features, f, ensure_ascii= False, indent = 4)
     
@@ -639,12 +360,12 @@ if __name__ == "__main__":
     # playlist_tracks = playlists['tracks']
     # print(len(playlist_tracks))
 
-    # playlist_tracks_info = get_mul_tracks(token, playlist_id, playlist_tracks)
+    # playlist_tracks_info = get_mul_tracks(client, playlist_id, playlist_tracks)
     # with open('playlists_track_info.json', 'w', encoding='utf-8') as f:
     #     json.dump(playlist_tracks_info, f, ensure_ascii=False, indent=4)
 
 
-    # playlist_tracks_features_info = get_mul_tracks_features(token, playlist_id, playlist_tracks)
+    # playlist_tracks_features_info = get_mul_tracks_features(client, playlist_id, playlist_tracks)
     # with open('playlists_track_features_info.json', 'w', encoding='utf-8') as f:
     #     json.dump(playlist_tracks_features_info, f, ensure_ascii=False, indent=4) 
     
@@ -0,0 +1,212 @@
+"""
+    This file contains the asyncio Spotify client used to fetch id batches concurrently.
+
+    Batches of /tracks, /audio-features and /artists are issued at the same time, bounded by a
+    semaphore, instead of one after another. Requests still go through `api_request`, so they
+    share the pooled transport and token handling of the synchronous helpers. Batches can be
+    hedged, see `commons.hedging`.
+
+    Environment:
+        SPOTIFY_MAX_CONCURRENCY: maximum number of requests in flight per client (default 8)
+
+    Usage:
+        - `client = AsyncSpotifyClient(token)` then `await client.get_batches(...)`
+        - `run_sync(coro)` to call a coroutine from synchronous code such as a Flask route
+"""
+
+# Import libraries
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from commons.http_transport import POOL_SIZE
+from commons.resilience import submit_in_context
+from commons.spotify_auth import get_auth_header
+from commons.entity_cache import entity_cache
+from commons.spotify_client import api_request, batch_request, cache_batch
+from commons.hedging import HEDGE_REQUESTS
+from commons.fast_json import loads
+
+
+MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", 8))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+        Returns the process-wide executor running blocking requests, one worker per pooled connection
+    """
+
+    global _executor
+
+    if _executor is None:
+
+        with _executor_lock:
+
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="spotify")
+
+    return _executor
+
+
+def chunk_ids(id_list, batch_size):
+    """
+        Splits a list of IDs into batches accepted by Spotify's multi-id endpoints
+
+        Args:
+            param1 (list): IDs to split
+            param2 (int): maximum number of IDs per batch
+
+        Returns:
+            list: list of ID lists
+    """
+
+    return [id_list[i:i + batch_size] for i in range(0, len(id_list), batch_size)]
+
+
+class AsyncSpotifyClient:
+    """
+        Issues Spotify requests concurrently with at most max_concurrency in flight
+
+        Args:
+            param1 (str): token
+            param2 (int): maximum number of requests in flight
+            param3 (bool): hedge batch calls, see commons.hedging
+    """
+
+    def __init__(self, token, max_concurrency=MAX_CONCURRENCY, hedge=HEDGE_REQUESTS):
+
+        self.headers = get_auth_header(token)
+        self.max_concurrency = max_concurrency
+        self.hedge = hedge
+
+        # Created lazily so the semaphore belongs to the running event loop
+        self._semaphore = None
+
+    async def get_json(self, url, params=None, function=api_request):
+        """
+            Sends a GET request without blocking the event loop
+
+            Args:
+                param1 (str): url of the request
+                param2 (dict): parameters for the api request
+                param3 (function): request function, api_request or batch_request
+
+            Returns:
+                dict: decoded response, None if the request failed
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+
+            loop = asyncio.get_running_loop()
+            # Run in a copy of the task's context so the request deadline reaches the worker thread
+            request = functools.partial(*submit_in_context(function, url, self.headers), params=params)
+
+            result = await loop.run_in_executor(get_executor(), request)
+
+        if result is None or result == 'Try again':
+
+            print("Failed to retrieve playlist information.")
+
+            return None
+
+        return loads(result.content)
+
+    async def get_batch(self, url, id_batch, key, params=None):
+        """
+            Fetches one batch of IDs from a multi-id endpoint
+
+            Args:
+                param1 (str): url of the endpoint
+                param2 (list): IDs of the batch
+                param3 (str): key of the response holding the items
+                param4 (dict): extra parameters for the api request
+
+            Returns:
+                list: items of the batch, empty if the request failed
+        """
+
+        params = {**(params or {}), 'ids' : ','.join(id_batch)}
+
+        result = await self.get_json(url, params=params, function=functools.partial(batch_request, hedge=self.hedge))
+
+        if result is None:
+            return []
+
+        return result[key]
+
+    async def get_batches(self, url, id_list, batch_size, key, params=None):
+        """
+            Fetches every batch of a multi-id endpoint at once
+
+            Args:
+                param1 (str): url of the endpoint
+                param2 (list): IDs to fetch
+                param3 (int): maximum number of IDs per request
+                param4 (str): key of the response holding the items
+                param5 (dict): extra parameters for the api request
+
+            Returns:
+                list: list of item lists, in the order of the batches
+        """
+
+        batches = chunk_ids(id_list, batch_size)
+
+        return await asyncio.gather(*(self.get_batch(url, batch, key, params) for batch in batches))
+
+    async def get_entities(self, url, id_list, batch_size, key, kind, params=None):
+        """
+            Reads entities from a multi-id endpoint through the on-disk cache, fetching
+            every batch of cache misses at once
+
+            Args:
+                param1 (str): url of the endpoint
+                param2 (list): IDs to fetch
+                param3 (int): maximum number of IDs per request
+                param4 (str): key of the response holding the items
+                param5 (str): kind of entity in the cache, e.g. 'track'
+                param6 (dict): extra parameters for the api request
+
+            Returns:
+                list: API object for each ID in id_list, None where it could not be retrieved
+        """
+
+        entities = entity_cache.get_many(kind, id_list)
+
+        missing_ids = [entity_id for entity_id in dict.fromkeys(id_list) if entity_id not in entities]
+
+        batches = chunk_ids(missing_ids, batch_size)
+        batch_results = await asyncio.gather(*(self.get_batch(url, batch, key, params) for batch in batches))
+
+        for batch, items in zip(batches, batch_results):
+            entities.update(cache_batch(kind, batch, items))
+
+        return [entities.get(entity_id) for entity_id in id_list]
+
+
+def run_sync(coro):
+    """
+        Runs a coroutine to completion from synchronous code
+
+        Args:
+            param1 (coroutine): coroutine to run
+
+        Returns:
+            Result of the coroutine
+    """
+
+    try:
+        asyncio.get_running_loop()
+
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Already inside an event loop, so run the coroutine on a loop of its own
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(*submit_in_context(asyncio.run, coro)).result()
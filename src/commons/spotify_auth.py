@@ -0,0 +1,139 @@
+"""
+    This file contains the process-wide token manager used to authorize requests to Spotify's API.
+
+    The client-credentials token is cached and only refreshed shortly before it expires, so
+    helpers no longer POST to accounts.spotify.com for every playlist or genre they process.
+    Concurrent refreshes are coalesced, meaning only one thread fetches a new token at a time.
+
+    Functions:
+        get_token(): Returns the cached token, refreshing it when it is about to expire
+        get_auth_header(token): Sets the authorization header for the API request
+
+    Usage:
+        - `from commons.spotify_auth import get_token, get_auth_header`
+"""
+
+# Import libraries
+import os
+import base64
+import json
+import threading
+import time
+from commons.endpoints import SPOTIFY_ACCOUNTS_BASE_URL
+from commons.http_transport import post
+
+
+# Base url used to get client credentials tokens
+TOKEN_URL = f"{SPOTIFY_ACCOUNTS_BASE_URL}/api/token"
+
+# Seconds before expiry at which the cached token is considered stale
+REFRESH_MARGIN = 60
+
+
+class SpotifyTokenManager:
+    """
+        Caches a client-credentials token and refreshes it shortly before `expires_in`
+
+        Args:
+            param1 (str): client id, read from CLIENT_ID when not given
+            param2 (str): client secret, read from CLIENT_SECRET when not given
+            param3 (int): seconds before expiry at which the token is refreshed
+    """
+
+    def __init__(self, client_id=None, client_secret=None, refresh_margin=REFRESH_MARGIN):
+
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+
+    def _is_fresh(self):
+
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _fetch_token(self):
+
+        # Credentials are read lazily so .env files loaded by the caller are picked up
+        client_id = self.client_id or os.getenv("CLIENT_ID")
+        client_secret = self.client_secret or os.getenv("CLIENT_SECRET")
+
+        # Only a credential pool is configured, authorize with its first app
+        if client_id is None and os.getenv("SPOTIFY_CREDENTIALS"):
+            client_id, _, client_secret = os.getenv("SPOTIFY_CREDENTIALS").split(",")[0].strip().partition(":")
+
+        auth_string = client_id + ":" + client_secret
+        auth_bytes = auth_string.encode("utf-8")
+        auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
+
+        # Declare headers
+        headers = {
+            "Authorization": "Basic " + auth_base64,
+            "Content-Type":"application/x-www-form-urlencoded"
+            }
+
+        data = {"grant_type": "client_credentials"}
+
+        result = post(TOKEN_URL, headers=headers, data=data)
+
+        json_result = json.loads(result.content)
+
+        self._token = json_result["access_token"]
+        self._expires_at = time.time() + int(json_result.get("expires_in", 3600))
+
+    def get_token(self):
+        """
+            Returns the cached token, fetching a new one if it is missing or about to expire
+
+            Returns:
+                str: access token
+        """
+
+        if self._is_fresh():
+            return self._token
+
+        with self._lock:
+
+            # Another thread may have refreshed the token while we waited for the lock
+            if not self._is_fresh():
+                self._fetch_token()
+
+            return self._token
+
+    def refresh(self, stale_token=None):
+        """
+            Forces a refresh, unless another thread already replaced the stale token
+
+            Args:
+                param1 (str): token that was rejected by the API
+
+            Returns:
+                str: access token
+        """
+
+        with self._lock:
+
+            if stale_token is None or stale_token == self._token:
+                self._token = None
+                self._expires_at = 0
+
+        return self.get_token()
+
+
+# Process-wide manager shared by every Spotify helper
+token_manager = SpotifyTokenManager()
+
+
+# Get token using client credentials
+def get_token():
+
+    return token_manager.get_token()
+
+
+# Set Authorization
+def get_auth_header(token):
+
+    return {"Authorization":"Bearer " + token}
+
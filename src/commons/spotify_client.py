@@ -0,0 +1,307 @@
+"""
+    This file contains the request helper shared by every Spotify helper.
+
+    Requests go through the pooled transport in `commons.http_transport`. Each attempt leases a
+    credential from `commons.credential_pool` and is sent with that credential's token, drawing
+    from its rate budget. A credential that is rate limited (429) is parked and the retry goes to
+    another one, transient failures are retried with backoff, and a rejected token is refreshed
+    once before giving up. `get_entities` reads multi-id endpoints through
+    the on-disk cache in `commons.entity_cache`, so only cache misses reach the API.
+
+    The multi-id endpoints do not accept a `fields=` projection, so fetched objects are
+    projected to the keys the pipeline parses before they are cached. Batch calls can be
+    hedged, see `commons.hedging`.
+
+    Environment:
+        SPOTIFY_MAX_RETRIES: retries for rate limited or transient failures (default 5)
+
+    Usage:
+        - `from commons.spotify_client import api_request, get_entities`
+        - `client = SpotifyClient(token)` to pass credentials to helpers explicitly
+"""
+
+# Import libraries
+import os
+from requests.exceptions import ConnectionError, Timeout
+from commons.http_transport import get
+from commons.rate_limit import backoff_delay, retry_after_delay
+from commons.credential_pool import get_credential_pool
+from commons.resilience import check_deadline, sleep_within_deadline
+from commons.entity_cache import entity_cache
+from commons.call_metrics import record_retry
+from commons.hedging import hedger, HEDGE_REQUESTS
+from commons.spotify_auth import get_auth_header
+from commons.fast_json import loads
+
+
+MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 5))
+
+# Server errors that are worth retrying
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Keys kept for each kind of entity, None keeps the whole value, a list projects every element
+PROJECTIONS = {
+    "track" : {
+        "id" : None,
+        "name" : None,
+        "popularity" : None,
+        "duration_ms" : None,
+        "album" : {
+            "album_type" : None,
+            "id" : None,
+            "name" : None,
+            "release_date" : None,
+            "artists" : [{"id" : None, "name" : None}],
+        },
+        "artists" : [{"id" : None, "name" : None}],
+        # ID the track was requested with, when the market relinked it
+        "linked_from" : {"id" : None},
+    },
+    "artist" : {
+        "id" : None,
+        "name" : None,
+        "genres" : None,
+        "popularity" : None,
+        "followers" : {"total" : None},
+    },
+}
+
+
+def api_request(url, headers, params=None, data=None):
+    """
+        Create a function to generate API request using custom url, parameters and data
+
+        Args:
+            param1 (str): url of the request
+            param2 (str): declared header
+            param3 (dict): parameters for the api request
+            param4 (dict): additional data to pass
+
+        Returns:
+            dict: return dict format of response. If response empty, return error.
+                'Try again' if the request was still rate limited after every retry
+
+        Raises:
+            CircuitOpenError: the Spotify circuit breaker is open
+            DeadlineExceeded: the active deadline passed before the request could complete
+    """
+
+    attempt = 0
+    refreshed = False
+
+    pool = get_credential_pool()
+
+    while attempt <= MAX_RETRIES:
+
+        check_deadline()
+
+        # Every attempt after the first one is counted as a retry of the endpoint
+        if attempt > 0 or refreshed:
+            record_retry("GET", url)
+
+        # Each attempt is sent with the next credential that has budget left
+        credential = pool.lease()
+        request_headers = {**headers, **credential.auth_header()}
+
+        try:
+            response = get(url, headers=request_headers, params=params, data=data)
+
+        except (ConnectionError, Timeout) as error:
+
+            print(f"Request failed with error {error}, retrying.")
+
+            sleep_within_deadline(backoff_delay(attempt))
+            attempt += 1
+
+            continue
+
+        # Status Code == 200 means successful request
+        if response.status_code == 200:
+            return response
+
+        # Unauthorized - the token was rejected, refresh it and retry once
+        elif response.status_code == 401 and not refreshed:
+
+            credential.token_manager.refresh(request_headers["Authorization"].replace("Bearer ", "", 1))
+            refreshed = True
+
+        # Time out error - API Request limit exceeded, park the credential, the others keep going
+        elif response.status_code == 429:
+
+            retry_after = retry_after_delay(response, attempt)
+            print(f"Rate limit exceeded for {credential}. Parked for {retry_after:.1f} seconds.")
+
+            pool.park(credential, retry_after)
+            attempt += 1
+
+        # Transient server error
+        elif response.status_code in RETRY_STATUS_CODES:
+
+            sleep_within_deadline(backoff_delay(attempt))
+            attempt += 1
+
+        else:
+
+            print(f"Request failed with error {response.status_code}: {response.text}")
+
+            return None
+
+    print(f"Giving up on {url} after {MAX_RETRIES} retries.")
+
+    return 'Try again'
+
+
+def get_entities(token, url, id_list, batch_size, key, kind, params=None, hedge=HEDGE_REQUESTS):
+    """
+        Reads entities from a multi-id endpoint through the on-disk cache. Cache misses
+        are packed into full batches and stored once fetched
+
+        Args:
+            param1 (str): token
+            param2 (str): url of the endpoint, e.g. https://api.spotify.com/v1/tracks
+            param3 (list): IDs to fetch
+            param4 (int): maximum number of IDs per request
+            param5 (str): key of the response holding the items, e.g. 'tracks'
+            param6 (str): kind of entity in the cache, e.g. 'track'
+            param7 (dict): extra parameters for the api request
+            param8 (bool): duplicate batch calls that are slower than usual
+
+        Returns:
+            list: API object for each ID in id_list, None where it could not be retrieved
+    """
+
+    entities = entity_cache.get_many(kind, id_list)
+
+    missing_ids = [entity_id for entity_id in dict.fromkeys(id_list) if entity_id not in entities]
+
+    headers = get_auth_header(token)
+
+    for offset in range(0, len(missing_ids), batch_size):
+
+        batch = missing_ids[offset:offset + batch_size]
+
+        result = batch_request(url, headers, {**(params or {}), 'ids' : ','.join(batch)}, hedge)
+
+        if result is None or result == 'Try again':
+
+            print("Failed to retrieve playlist information.")
+
+            continue
+
+        fetched = cache_batch(kind, batch, loads(result.content)[key])
+
+        entities.update(fetched)
+
+    return [entities.get(entity_id) for entity_id in id_list]
+
+
+def batch_request(url, headers, params, hedge=HEDGE_REQUESTS):
+    """
+        Sends one batch of a multi-id endpoint, hedged if requested
+
+        Args:
+            param1 (str): url of the endpoint
+            param2 (dict): declared header
+            param3 (dict): parameters for the api request, including the IDs
+            param4 (bool): duplicate the call if it is slower than usual
+
+        Returns:
+            Response: see api_request
+    """
+
+    if hedge:
+        return hedger.call(api_request, url, headers, params=params)
+
+    return api_request(url, headers, params=params)
+
+
+class SpotifyClient:
+    """
+        Sends Spotify requests with the token it was created with, so helpers receive
+        their credentials explicitly instead of reading a module-global token
+
+        Args:
+            param1 (str): token
+            param2 (bool): hedge batch calls, see commons.hedging
+    """
+
+    def __init__(self, token, hedge=HEDGE_REQUESTS):
+
+        self.token = token
+        self.hedge = hedge
+        self.headers = get_auth_header(token)
+
+    def get_json(self, url, params=None):
+        """
+            Sends a GET request
+
+            Args:
+                param1 (str): url of the request
+                param2 (dict): parameters for the api request
+
+            Returns:
+                dict: decoded response, None if the request failed
+        """
+
+        result = api_request(url, self.headers, params=params)
+
+        if result is None or result == 'Try again':
+
+            print(f"Failed to retrieve {url}.")
+
+            return None
+
+        return loads(result.content)
+
+    def get_entities(self, url, id_list, batch_size, key, kind, params=None):
+        """
+            Reads entities from a multi-id endpoint through the on-disk cache, see get_entities
+        """
+
+        return get_entities(self.token, url, id_list, batch_size, key, kind, params, self.hedge)
+
+
+def cache_batch(kind, id_batch, items):
+    """
+        Stores the items returned for a batch of IDs in the on-disk cache
+
+        Items are matched to the requested IDs by position, since relinked tracks can come
+        back with a different ID than the one requested.
+
+        Args:
+            param1 (str): kind of entity in the cache
+            param2 (list): requested IDs
+            param3 (list): items returned by the API, None for unknown IDs
+
+        Returns:
+            dict: API object for each requested ID that was found
+    """
+
+    projection = PROJECTIONS.get(kind)
+
+    fetched = {entity_id : project(item, projection) for entity_id, item in zip(id_batch, items) if item is not None}
+
+    entity_cache.put_many(kind, fetched)
+
+    return fetched
+
+
+def project(value, projection):
+    """
+        Keeps only the keys of value listed in projection, like Spotify's fields= parameter
+
+        Args:
+            param1: decoded JSON value
+            param2 (dict): keys to keep, see PROJECTIONS
+
+        Returns:
+            Projected copy of value
+    """
+
+    if projection is None or value is None:
+        return value
+
+    if isinstance(projection, list):
+        return [project(element, projection[0]) for element in value]
+
+    return {key : project(value[key], sub_projection) for key, sub_projection in projection.items() if key in value}
@@ -0,0 +1,131 @@
+"""
+    This file contains the playlist fetch layer shared by the application and the scrapers.
+
+    Requests use Spotify's `fields=` projection so only track IDs are downloaded, not whole
+    track objects. The playlist header is requested first, together with the first page of track IDs. When
+    its `snapshot_id` matches the one stored in the on-disk cache, the cached track ID list is
+    returned without walking the remaining pages. Otherwise only the pages after the embedded
+    first page are fetched, concurrently through `commons.pagination`. A playlist that cannot be
+    read completely raises a RuntimeError rather than passing a partial track ID list for the
+    whole playlist, and is not stored in the cache.
+
+    Usage:
+        - `from commons.spotify_playlists import get_playlist_track_ids`
+        - `from commons.spotify_playlists import iter_playlist_track_ids` to stream the pages
+"""
+
+# Import libraries
+from commons.endpoints import SPOTIFY_API_BASE_URL
+from commons.entity_cache import entity_cache
+from commons.pagination import iter_pages
+from commons.spotify_auth import get_auth_header
+from commons.spotify_client import api_request
+from commons.fast_json import loads
+
+
+PLAYLISTS_URL = f"{SPOTIFY_API_BASE_URL}/playlists"
+
+# Page size of /playlists/{id}/tracks
+PAGE_SIZE = 100
+
+# Fields of the playlist header, including the first page of track IDs
+HEADER_FIELDS = "snapshot_id,tracks.total,tracks.items(track(id))"
+
+# Fields of the following pages, only the track IDs are parsed
+PAGE_FIELDS = "total,items(track(id))"
+
+# Market used to resolve tracks, which also drops per-track available_markets
+MARKET = "US"
+
+
+def parse_track_ids(items):
+    """
+        Extracts the track IDs of a page of playlist items, skipping local and removed tracks
+
+        Args:
+            param1 (list): playlist items
+
+        Returns:
+            list: track IDs
+    """
+
+    return [item['track']['id'] for item in items \
+            if item.get('track') is not None and item['track'].get('id') is not None]
+
+
+def iter_playlist_track_ids(token, playlist_id):
+    """
+        Yields the track IDs of a playlist page by page as the pages arrive. The cached
+        list is used when the playlist's snapshot_id has not changed
+
+        Args:
+            param1 (str): token
+            param2 (str): playlist id
+
+        Yields:
+            tuple: (offset, list of track IDs of the page)
+
+        Raises:
+            RuntimeError: the playlist or one of its pages could not be retrieved, the pages
+                yielded so far are only part of the playlist
+    """
+
+    headers = get_auth_header(token)
+
+    params = {'fields' : HEADER_FIELDS, 'market' : MARKET}
+
+    header_result = api_request(f"{PLAYLISTS_URL}/{playlist_id}", headers=headers, params=params)
+
+    if header_result is None or header_result == 'Try again':
+        raise RuntimeError(f"Failed to retrieve playlist information of {playlist_id}.")
+
+    header = loads(header_result.content)
+    snapshot_id = header['snapshot_id']
+
+    cached = entity_cache.get_many('playlist', [playlist_id]).get(playlist_id)
+
+    # Unchanged playlist, no page needs to be fetched
+    if cached is not None and cached['snapshot_id'] == snapshot_id:
+
+        for offset in range(0, len(cached['tracks']), PAGE_SIZE):
+            yield offset, cached['tracks'][offset:offset + PAGE_SIZE]
+
+        return
+
+    # The remaining pages are fetched concurrently after the embedded first page
+    params = {'fields' : PAGE_FIELDS, 'market' : MARKET}
+
+    track_ids = []
+
+    for offset, page in iter_pages(token, f"{PLAYLISTS_URL}/{playlist_id}/tracks", PAGE_SIZE, params=params, first_page=header['tracks']):
+
+        # A partial list would pass for the whole playlist, and would hide the missing pages next time
+        if page is None:
+            raise RuntimeError(f"Failed to retrieve the tracks of playlist {playlist_id} at offset {offset}.")
+
+        page_track_ids = parse_track_ids(page['items'])
+        track_ids += page_track_ids
+
+        yield offset, page_track_ids
+
+    # Only a complete list is stored
+    entity_cache.put_many('playlist', {playlist_id : {'snapshot_id' : snapshot_id, 'tracks' : track_ids}})
+
+
+def get_playlist_track_ids(token, playlist_id):
+    """
+        Returns the track IDs of a playlist, reusing the cached list when the playlist's
+        snapshot_id has not changed
+
+        Args:
+            param1 (str): token
+            param2 (str): playlist id
+
+        Returns:
+            list: track IDs of the playlist in playlist order
+
+        Raises:
+            RuntimeError: the playlist or one of its pages could not be retrieved
+    """
+
+    return [track_id for offset, page_track_ids in iter_playlist_track_ids(token, playlist_id) for track_id in page_track_ids]
@@ -0,0 +1,132 @@
+"""
+    This file contains the bulk resolver of artist and track names to Spotify IDs.
+
+    Names are normalised (Unicode NFKC, case folded, whitespace collapsed) and deduplicated
+    before anything is requested, then the remaining names are searched concurrently. Every
+    request still goes through `api_request`, so the searches share the Spotify rate budget.
+    Results are memoised in the on-disk cache of `commons.entity_cache`, including names
+    that matched nothing, so a name is only searched once per cache lifetime.
+
+    Usage:
+        - `from commons.spotify_search import resolve_names`
+        - `artist_ids = resolve_names(SpotifyClient(token), names, 'artist')`
+"""
+
+# Import libraries
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from commons.endpoints import SPOTIFY_API_BASE_URL
+from commons.entity_cache import entity_cache
+from commons.resilience import submit_in_context
+from commons.spotify_async import MAX_CONCURRENCY
+
+
+SEARCH_URL = f"{SPOTIFY_API_BASE_URL}/search"
+
+# Kinds of entity that can be searched, with the key of the response holding the results
+SEARCH_TYPES = {
+    "artist" : "artists",
+    "track" : "tracks",
+}
+
+
+def normalise_name(name):
+    """
+        Normalises a name so spellings that only differ in case, width or spacing are searched once
+
+        Args:
+            param1 (str): artist or track name
+
+        Returns:
+            str: normalised name
+    """
+
+    name = unicodedata.normalize("NFKC", name).casefold()
+
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def search_name(client, name, search_type):
+    """
+        Searches the best match of one name
+
+        Args:
+            param1 (SpotifyClient): client used to send the request
+            param2 (str): normalised name
+            param3 (str): 'artist' or 'track'
+
+        Returns:
+            str: Spotify ID of the best match, None if nothing matched
+            bool: False if the request failed, so the result must not be memoised
+    """
+
+    # The query is encoded by requests, names may contain '&', '#' or non-ASCII characters
+    result = client.get_json(SEARCH_URL, params={'q' : name, 'type' : search_type, 'limit' : 1})
+
+    if result is None:
+        return None, False
+
+    items = result[SEARCH_TYPES[search_type]]["items"]
+
+    if len(items) == 0:
+        return None, True
+
+    return items[0]["id"], True
+
+
+def resolve_names(client, names, search_type, max_workers=MAX_CONCURRENCY):
+    """
+        Resolves many artist or track names to Spotify IDs at once
+
+        Args:
+            param1 (SpotifyClient): client used to send the requests
+            param2 (iterable): names to resolve, duplicates allowed
+            param3 (str): 'artist' or 'track'
+            param4 (int): maximum number of searches in flight
+
+        Returns:
+            dict: Spotify ID for each name, None where nothing matched or the search failed
+    """
+
+    if search_type not in SEARCH_TYPES:
+        raise ValueError(f"Cannot search for {search_type}, expected one of {list(SEARCH_TYPES)}")
+
+    names = [name for name in names if name is not None]
+    normalised = {name : normalise_name(name) for name in names}
+
+    unique_names = [name for name in dict.fromkeys(normalised.values()) if len(name) > 0]
+
+    # Memoised matches and misses are kept under their own kinds so misses can expire sooner
+    memo = entity_cache.get_many(f"{search_type}_search", unique_names)
+    memo.update(entity_cache.get_many(f"{search_type}_search_miss", unique_names))
+
+    missing_names = [name for name in unique_names if name not in memo]
+
+    if len(missing_names) > 0:
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(*submit_in_context(search_name, client, name, search_type)) for name in missing_names]
+
+            results = [future.result() for future in futures]
+
+        found = {}
+        not_found = {}
+
+        for name, (spotify_id, complete) in zip(missing_names, results):
+
+            memo[name] = {"id" : spotify_id}
+
+            if not complete:
+                continue
+
+            if spotify_id is None:
+                not_found[name] = memo[name]
+
+            else:
+                found[name] = memo[name]
+
+        entity_cache.put_many(f"{search_type}_search", found)
+        entity_cache.put_many(f"{search_type}_search_miss", not_found)
+
+    return {name : memo.get(normalised[name], {"id" : None})["id"] for name in names}
@@ -0,0 +1,210 @@
+"""
+    This script serves recorded Spotify and Ticketmaster responses from a local HTTP server.
+
+    Responses recorded with `HTTP_RECORD_DIR` (see `commons.fixtures`) are replayed with a
+    configurable latency, and failures can be injected at a given rate: server errors (503)
+    and rate limiting (429 with a Retry-After header). Client-credentials token requests are
+    answered with a stub token. This lets the pipeline be benchmarked reproducibly without
+    touching the live APIs.
+
+    The server prints the environment to set so the application and the scrapers use it, e.g.
+        SPOTIFY_API_BASE_URL=http://127.0.0.1:8765/spotify
+        SPOTIFY_ACCOUNTS_BASE_URL=http://127.0.0.1:8765/accounts
+        TICKETMASTER_BASE_URL=http://127.0.0.1:8765/ticketmaster
+
+    Usage:
+        - Record: `HTTP_RECORD_DIR=tmp/fixtures python3 application/app.py`, then use the application
+        - Replay: `python3 commons/stub_server.py --fixtures tmp/fixtures --latency 0.05 --rate-limit-rate 0.02`
+"""
+
+# Import libraries
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from commons.endpoints import SERVICES
+from commons.fixtures import FixtureStore
+
+
+class StubConfig:
+    """
+        Behaviour of the stub server
+
+        Args:
+            param1 (FixtureStore): recorded responses
+            param2 (float): seconds added to every response
+            param3 (float): maximum random seconds added on top of latency
+            param4 (float): fraction of requests answered with a 503
+            param5 (float): fraction of requests answered with a 429
+            param6 (int): Retry-After of injected 429 responses, in seconds
+            param7 (int): seed of the failure injection, None for a random seed
+    """
+
+    def __init__(self, store, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        # Number of responses sent, by status code
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+
+    def draw(self):
+
+        with self.random_lock:
+            return self.random.random(), self.random.uniform(0, self.jitter)
+
+    def count(self, status):
+
+        with self.counts_lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+        Replays the recorded response of each request
+    """
+
+    # Keep-alive, like the live APIs, so the pooled transport is measured as it is used
+    protocol_version = "HTTP/1.1"
+
+    config = None
+
+    def log_message(self, format, *args):
+
+        # Printing every request would dominate the time spent by the server
+        pass
+
+    def send_body(self, status, body, headers=None):
+
+        body = body.encode() if isinstance(body, str) else body
+
+        self.send_response(status)
+
+        for name, value in (headers or {"Content-Type" : "application/json"}).items():
+            self.send_header(name, value)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.config.count(status)
+
+    def handle_request(self, method):
+
+        # Drain the request body so the connection can be reused
+        length = int(self.headers.get("Content-Length", 0))
+
+        if length > 0:
+            self.rfile.read(length)
+
+        parts = urlsplit(self.path)
+        service, _, path = parts.path.lstrip("/").partition("/")
+        path = "/" + path
+
+        failure, jitter = self.config.draw()
+
+        time.sleep(self.config.latency + jitter)
+
+        # Client-credentials token requests always succeed
+        if service == "accounts":
+
+            token = {"access_token" : "stub-token", "token_type" : "Bearer", "expires_in" : 3600}
+
+            return self.send_body(200, json.dumps(token))
+
+        if service not in SERVICES:
+            return self.send_body(404, json.dumps({"error" : f"unknown service {service}"}))
+
+        # 429 and 503 are drawn from the same number so the two rates add up
+        if failure < self.config.rate_limit_rate:
+
+            headers = {"Content-Type" : "application/json", "Retry-After" : str(self.config.retry_after)}
+
+            return self.send_body(429, json.dumps({"error" : {"status" : 429, "message" : "API rate limit exceeded"}}), headers)
+
+        if failure < self.config.rate_limit_rate + self.config.error_rate:
+            return self.send_body(503, json.dumps({"error" : {"status" : 503, "message" : "Service unavailable"}}))
+
+        fixture = self.config.store.lookup(service, method, path, parse_qsl(parts.query, keep_blank_values=True))
+
+        if fixture is None:
+            return self.send_body(404, json.dumps({"error" : {"status" : 404, "message" : f"no fixture for {method} {path}"}}))
+
+        self.send_body(fixture["status"], fixture["body"], fixture["headers"])
+
+    def do_GET(self):
+
+        self.handle_request("GET")
+
+    def do_POST(self):
+
+        self.handle_request("POST")
+
+
+def start_stub_server(config, host="127.0.0.1", port=0):
+    """
+        Starts the stub server on a background thread
+
+        Args:
+            param1 (StubConfig): behaviour of the server
+            param2 (str): interface to listen on
+            param3 (int): port to listen on, 0 picks a free port
+
+        Returns:
+            tuple: (server, base url of the server)
+    """
+
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config" : config})
+
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay recorded Spotify and Ticketmaster responses")
+    parser.add_argument("--fixtures", required=True, help="directory of recorded responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random seconds added on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of injected 429 responses")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the failure injection")
+    args = parser.parse_args()
+
+    config = StubConfig(FixtureStore(args.fixtures), args.latency, args.jitter, args.error_rate,
+                        args.rate_limit_rate, args.retry_after, args.seed)
+
+    server, base_url = start_stub_server(config, args.host, args.port)
+
+    print(f"SPOTIFY_API_BASE_URL={base_url}/spotify")
+    print(f"SPOTIFY_ACCOUNTS_BASE_URL={base_url}/accounts")
+    print(f"TICKETMASTER_BASE_URL={base_url}/ticketmaster")
+
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Responses sent by status: {config.counts}")
+
+    except KeyboardInterrupt:
+        server.shutdown()
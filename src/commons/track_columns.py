@@ -0,0 +1,164 @@
+"""
+    This file contains the columnar extraction of tracks and audio features into a DataFrame.
+
+    Decoded API objects are written straight into one preallocated NumPy buffer per field,
+    so no intermediate per-track dictionary is built, merged and converted back into columns
+    by pandas. The frame comes out in the cleaned format of the playlist CSV: the same columns,
+    lowercased names, joined artist and genre lists and the album release year.
+
+    Usage:
+        - `from commons.track_columns import build_playlist_frame`
+"""
+
+# Import libraries
+import numpy as np
+import pandas as pd
+from commons.track_records import requested_track_id
+
+
+# Audio features stored as floats, missing values are NaN
+FLOAT_FEATURES = ("danceability", "energy", "loudness", "speechiness", "acousticness",
+                  "instrumentalness", "liveness", "valence", "tempo")
+
+# Audio features stored as nullable integers
+INT_FEATURES = ("key", "mode", "time_signature")
+
+# Columns of the playlist CSV, in order
+PLAYLIST_COLUMNS = ['id', 'name', 'artist_id', 'artists', 'artist_genre', 'album_type',
+                    'album_id', 'album_name', 'album_release_date', 'duration_ms',
+                    'popularity', 'danceability', 'energy', 'key', 'loudness', 'mode',
+                    'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+                    'valence', 'tempo', 'time_signature']
+
+
+def join_unique(values):
+    """
+        Joins values without duplicates, the way the playlist CSV stores lists
+
+        Args:
+            param1 (iterable): strings to join
+
+        Returns:
+            str: comma separated values, double quotes replaced by single quotes
+    """
+
+    return ','.join(dict.fromkeys(values)).replace('"', "'")
+
+
+def release_year(release_date):
+    """
+        Returns the year of a Spotify release date, which can be 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD'
+
+        Args:
+            param1 (str): release date
+
+        Returns:
+            int: year, None if the date could not be parsed
+    """
+
+    if release_date is None or not release_date[:4].isdigit():
+        return None
+
+    return int(release_date[:4])
+
+
+def int_column(values, mask):
+    """
+        Wraps an integer buffer and its missing-value mask in a nullable integer column
+    """
+
+    return pd.arrays.IntegerArray(values, mask)
+
+
+def build_playlist_frame(tracks, features, track_genres):
+    """
+        Builds the playlist frame from decoded tracks and audio features. Tracks without
+        track information or audio features are left out, as are duplicate tracks
+
+        Args:
+            param1 (list): track objects as returned by /tracks, None where missing
+            param2 (list): audio features objects aligned with tracks, None where missing
+            param3 (list): genres of each track, aligned with tracks
+
+        Returns:
+            DataFrame: playlist data with the columns of PLAYLIST_COLUMNS
+    """
+
+    seen = set()
+    rows = []
+
+    # Only complete, unique tracks get a row in the buffers
+    for index, (track, track_features) in enumerate(zip(tracks, features)):
+
+        if track is None or track_features is None or len(track["artists"]) == 0:
+            continue
+
+        # Relinked tracks are identified by the ID the playlist lists them under
+        track_id = requested_track_id(track)
+
+        if track_id in seen:
+            continue
+
+        seen.add(track_id)
+        rows.append(index)
+
+    n = len(rows)
+
+    text_columns = {column : np.empty(n, dtype=object) for column in
+                    ('id', 'name', 'artist_id', 'artists', 'artist_genre', 'album_type', 'album_id', 'album_name')}
+
+    int_values = {column : np.zeros(n, dtype=np.int64) for column in ('album_release_date', 'duration_ms', 'popularity') + INT_FEATURES}
+    int_masks = {column : np.zeros(n, dtype=bool) for column in int_values}
+
+    float_values = {column : np.full(n, np.nan) for column in FLOAT_FEATURES}
+
+    for row, index in enumerate(rows):
+
+        track = tracks[index]
+        album = track["album"]
+
+        text_columns['id'][row] = requested_track_id(track)
+        text_columns['name'][row] = track["name"].lower()
+        text_columns['artist_id'][row] = join_unique(artist["id"] for artist in track["artists"])
+        text_columns['artists'][row] = join_unique(artist["name"] for artist in track["artists"]).lower()
+        text_columns['artist_genre'][row] = join_unique(track_genres[index]).lower()
+        text_columns['album_type'][row] = album["album_type"]
+        text_columns['album_id'][row] = album["id"]
+        text_columns['album_name'][row] = album["name"].lower()
+
+        year = release_year(album["release_date"])
+
+        if year is None:
+            int_masks['album_release_date'][row] = True
+
+        else:
+            int_values['album_release_date'][row] = year
+
+        track_features = features[index]
+
+        # As in the scraped JSON files, the duration of the audio features wins
+        duration_ms = track_features.get("duration_ms")
+        int_values['duration_ms'][row] = track["duration_ms"] if duration_ms is None else duration_ms
+        int_values['popularity'][row] = track["popularity"]
+
+        for column in FLOAT_FEATURES:
+
+            value = track_features.get(column)
+
+            if value is not None:
+                float_values[column][row] = value
+
+        for column in INT_FEATURES:
+
+            value = track_features.get(column)
+
+            if value is None:
+                int_masks[column][row] = True
+
+            else:
+                int_values[column][row] = value
+
+    columns = {**text_columns, **float_values}
+    columns.update({column : int_column(int_values[column], int_masks[column]) for column in int_values})
+
+    return pd.DataFrame({column : columns[column] for column in PLAYLIST_COLUMNS})
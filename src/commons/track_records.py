@@ -0,0 +1,267 @@
+"""
+    This file contains the compact record types tracks travel through the pipeline in.
+
+    `TrackRecord` holds one track, its information and its audio features, in `__slots__`
+    attributes instead of a dictionary with space-containing keys, so a record costs a fraction
+    of the memory of the equivalent dict. `TrackColumns` stores a collection of tracks as one
+    list per field (struct of arrays) and converts to a pandas DataFrame without building a
+    dictionary per track.
+
+    Both convert back to the dictionary format of the scraped JSON files, e.g. `"artist id"`,
+    so files written by the scrapers keep their schema.
+
+    Records are keyed by the track ID that was requested. With a market, /tracks may relink a
+    track to another ID, while playlists, the audio features and the entity cache use the
+    requested one, given back in `linked_from`.
+
+    Usage:
+        - `record = TrackRecord.from_track(track)` then `record.merge_features(features_record)`
+        - `merged, without_features, without_info = join_track_features(track_records, feature_records)`
+        - `TrackColumns.from_records(records).to_frame()`
+"""
+
+
+# Attributes holding track information, with their key in the scraped JSON files
+TRACK_FIELDS = (
+    ("id", "id"),
+    ("name", "name"),
+    ("artist_ids", "artist id"),
+    ("artists", "artists"),
+    ("artist_genres", "artist genre"),
+    ("album_type", "album type"),
+    ("album_id", "album id"),
+    ("album_name", "album name"),
+    ("album_release_date", "album release date"),
+    ("duration_ms", "duration_ms"),
+    ("popularity", "popularity"),
+)
+
+# Audio features, named as in the API and in the scraped JSON files
+FEATURE_FIELDS = ("danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+                  "instrumentalness", "liveness", "valence", "tempo", "time_signature")
+
+RECORD_FIELDS = tuple(attribute for attribute, _ in TRACK_FIELDS) + FEATURE_FIELDS
+
+# Key of each attribute in the scraped JSON files
+RECORD_KEYS = dict(TRACK_FIELDS, **{feature : feature for feature in FEATURE_FIELDS})
+
+
+def requested_track_id(track):
+    """
+        Returns the ID a track object was requested with, which differs from its own ID when
+        the track was relinked to a version playable in the requested market
+
+        Args:
+            param1 (dict): track object as returned by /tracks
+
+        Returns:
+            str: requested track ID
+    """
+
+    linked_from = track.get("linked_from")
+
+    return track["id"] if linked_from is None else linked_from["id"]
+
+
+class TrackRecord:
+    """
+        One track with its information and its audio features. Written with explicit
+        __slots__ rather than a slotted dataclass so it also runs on Python 3.8
+
+        Args:
+            Keyword arguments named after RECORD_FIELDS, missing fields are None
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, **fields):
+
+        for attribute in RECORD_FIELDS:
+            setattr(self, attribute, fields.pop(attribute, None))
+
+        if len(fields) > 0:
+            raise TypeError(f"Unknown track fields: {', '.join(fields)}")
+
+    @classmethod
+    def from_track(cls, track, artist_genres=None):
+        """
+            Builds a record from a track object as returned by /tracks
+
+            Args:
+                param1 (dict): track object
+                param2 (list): genres of the track
+
+            Returns:
+                TrackRecord: record without audio features, keyed by the requested track ID
+        """
+
+        album = track["album"]
+
+        return cls(id=requested_track_id(track),
+                   name=track["name"],
+                   artist_ids=[artist["id"] for artist in track["artists"]],
+                   artists=[artist["name"] for artist in track["artists"]],
+                   artist_genres=[] if artist_genres is None else artist_genres,
+                   album_type=album["album_type"],
+                   album_id=album["id"],
+                   album_name=album["name"],
+                   album_release_date=album["release_date"],
+                   duration_ms=track["duration_ms"],
+                   popularity=track["popularity"])
+
+    @classmethod
+    def from_features(cls, features):
+        """
+            Builds a record from an audio features object as returned by /audio-features
+
+            Args:
+                param1 (dict): audio features object
+
+            Returns:
+                TrackRecord: record holding the ID, duration and audio features only
+        """
+
+        record = cls(id=features["id"], duration_ms=features["duration_ms"])
+
+        for feature in FEATURE_FIELDS:
+            setattr(record, feature, features[feature])
+
+        return record
+
+    def merge_features(self, features_record):
+        """
+            Copies the audio features of another record of the same track into this one
+
+            Args:
+                param1 (TrackRecord): record built by from_features
+
+            Returns:
+                TrackRecord: this record
+        """
+
+        # Like merging the legacy dictionaries, the duration of the audio features wins
+        self.duration_ms = features_record.duration_ms
+
+        for feature in FEATURE_FIELDS:
+            setattr(self, feature, getattr(features_record, feature))
+
+        return self
+
+    def to_dict(self):
+        """
+            Returns the track in the dictionary format of the scraped JSON files
+        """
+
+        return {RECORD_KEYS[attribute] : getattr(self, attribute) for attribute in RECORD_FIELDS}
+
+    def __repr__(self):
+
+        return f"TrackRecord(id={self.id!r}, name={self.name!r})"
+
+
+def join_track_features(track_records, feature_records):
+    """
+        Merges the audio features of each track into its track record, matching them by track
+        ID in one pass over each list. Records missing from either side are left out and reported
+
+        Args:
+            param1 (list): records built by TrackRecord.from_track
+            param2 (list): records built by TrackRecord.from_features
+
+        Returns:
+            tuple: (merged records in the order of track_records, IDs of tracks without audio
+                features, IDs of audio features without track information)
+    """
+
+    features_by_id = {record.id : record for record in feature_records if record is not None}
+
+    merged = []
+    without_features = []
+    matched_ids = set()
+
+    for record in track_records:
+
+        if record is None:
+            continue
+
+        features_record = features_by_id.get(record.id)
+
+        if features_record is None:
+
+            without_features.append(record.id)
+
+            continue
+
+        matched_ids.add(record.id)
+        merged.append(record.merge_features(features_record))
+
+    without_info = [track_id for track_id in features_by_id if track_id not in matched_ids]
+
+    return merged, without_features, without_info
+
+
+class TrackColumns:
+    """
+        Collection of tracks stored as one list per field
+    """
+
+    __slots__ = ("columns",)
+
+    def __init__(self):
+
+        self.columns = {attribute : [] for attribute in RECORD_FIELDS}
+
+    @classmethod
+    def from_records(cls, records):
+        """
+            Builds a collection from track records, skipping None entries
+
+            Args:
+                param1 (iterable): TrackRecord objects
+
+            Returns:
+                TrackColumns: collection of the records
+        """
+
+        collection = cls()
+        collection.extend(records)
+
+        return collection
+
+    def append(self, record):
+
+        for attribute in RECORD_FIELDS:
+            self.columns[attribute].append(getattr(record, attribute))
+
+    def extend(self, records):
+
+        for record in records:
+
+            if record is not None:
+                self.append(record)
+
+    def __len__(self):
+
+        return len(self.columns["id"])
+
+    def __iter__(self):
+
+        for values in zip(*(self.columns[attribute] for attribute in RECORD_FIELDS)):
+            yield TrackRecord(**dict(zip(RECORD_FIELDS, values)))
+
+    def to_dicts(self):
+        """
+            Returns the tracks in the dictionary format of the scraped JSON files
+        """
+
+        return [record.to_dict() for record in self]
+
+    def to_frame(self):
+        """
+            Returns the tracks as a DataFrame whose columns are named as in the scraped JSON files
+        """
+
+        # Imported here so the record types do not need pandas, e.g. in the scrapers
+        import pandas as pd
+
+        return pd.DataFrame({RECORD_KEYS[attribute] : self.columns[attribute] for attribute in RECORD_FIELDS})
@@ -0,0 +1,590 @@
+"""
+    This file contains the work queue scraping jobs are spread across worker processes and hosts with.
+
+    Items (e.g. playlists to scrape) are enqueued once under a unique ID. Workers lease an item,
+    process it and ack it. A leased item is invisible to other workers until its visibility
+    timeout passes, so the work of a crashed worker goes back on the queue and is picked up
+    by another one. While an item is being processed its worker keeps extending the lease, so
+    long items are not handed to a second worker, up to a maximum task duration after which a
+    stuck item is left to expire and goes back on the queue. An item that keeps failing is set
+    aside once it used up its attempts.
+
+    Two brokers are supported:
+        - SQLite, for worker processes on one host, e.g. `data/work_queue.sqlite3`
+        - Redis, for workers on any number of hosts, e.g. `redis://broker:6379/0`
+
+    Environment:
+        WORK_QUEUE_URL: Redis url or SQLite path of the broker (default data/work_queue.sqlite3)
+        WORK_QUEUE_VISIBILITY_TIMEOUT: seconds a lease lasts before the item is handed out again (default 600)
+        WORK_QUEUE_MAX_ATTEMPTS: attempts before an item is set aside as failed (default 3)
+        WORK_QUEUE_MAX_TASK_DURATION: seconds the lease of an item is kept alive while it is processed (default 3600)
+
+    Usage:
+        - `queue = open_queue(WORK_QUEUE_URL, "playlists_to_json")` then `queue.enqueue(items)`
+        - `run_worker(queue, handler, threads)` on every worker process, or
+          `spawn_workers(function, args, processes)` to start several of them
+"""
+
+# Import libraries
+import os
+import json
+import multiprocessing
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from commons.resilience import submit_in_context
+
+try:
+    import redis
+
+except ImportError:
+
+    # Only the SQLite broker is available
+    redis = None
+
+
+WORK_QUEUE_URL = os.getenv("WORK_QUEUE_URL", "data/work_queue.sqlite3")
+VISIBILITY_TIMEOUT = float(os.getenv("WORK_QUEUE_VISIBILITY_TIMEOUT", 600))
+MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", 3))
+MAX_TASK_DURATION = float(os.getenv("WORK_QUEUE_MAX_TASK_DURATION", 3600))
+
+# Seconds an idle worker waits before asking for work again while other workers hold leases
+IDLE_WAIT = 5
+
+
+def worker_name():
+    """
+        Returns a name unique to this worker thread, across hosts
+    """
+
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:6]}"
+
+
+class SQLiteWorkQueue:
+    """
+        Work queue stored in a SQLite database, shared by the processes of one host
+
+        Args:
+            param1 (str): path of the SQLite database
+            param2 (str): name of the queue
+            param3 (float): seconds a lease lasts
+            param4 (int): attempts before an item is set aside as failed
+    """
+
+    def __init__(self, path, name, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+
+        self.path = path
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+
+        if self._connection is None:
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    queue TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    PRIMARY KEY (queue, id)
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS items_state ON items (queue, state, lease_until)")
+
+            self._connection = connection
+
+        return self._connection
+
+    def _transaction(self, statements):
+        """
+            Runs statements(connection) in a write transaction, so no other process interleaves
+        """
+
+        with self._lock:
+
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+
+                result = statements(connection)
+
+                connection.execute("COMMIT")
+
+                return result
+
+            except sqlite3.Error:
+
+                connection.execute("ROLLBACK")
+
+                raise
+
+    def enqueue(self, items):
+        """
+            Adds items to the queue, items already in it are left as they are
+
+            Args:
+                param1 (dict): JSON serialisable payload for each item ID
+
+            Returns:
+                int: number of items added
+        """
+
+        rows = [(self.name, item_id, json.dumps(payload)) for item_id, payload in items.items()]
+
+        def insert(connection):
+
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO items (queue, id, payload, state) VALUES (?, ?, ?, 'ready')", rows)
+
+            return connection.total_changes - before
+
+        return self._transaction(insert)
+
+    def lease(self, worker):
+        """
+            Leases the next item that is ready, or whose lease has expired
+
+            Args:
+                param1 (str): name of the worker
+
+            Returns:
+                tuple: (item ID, payload), None if no item is available
+        """
+
+        def take(connection):
+
+            now = time.time()
+
+            # Items whose workers kept crashing are set aside instead of being handed out forever
+            connection.execute("""
+                UPDATE items SET state = 'failed', error = 'lease expired'
+                WHERE queue = ? AND state = 'leased' AND lease_until < ? AND attempts >= ?""",
+                               (self.name, now, self.max_attempts))
+
+            row = connection.execute("""
+                SELECT id, payload FROM items
+                WHERE queue = ? AND (state = 'ready' OR (state = 'leased' AND lease_until < ?))
+                LIMIT 1""", (self.name, now)).fetchone()
+
+            if row is None:
+                return None
+
+            connection.execute("""
+                UPDATE items SET state = 'leased', lease_until = ?, worker = ?, attempts = attempts + 1
+                WHERE queue = ? AND id = ?""", (now + self.visibility_timeout, worker, self.name, row[0]))
+
+            return row[0], json.loads(row[1])
+
+        return self._transaction(take)
+
+    def ack(self, item_id, worker):
+        """
+            Marks a leased item as done
+
+            Args:
+                param1 (str): item ID
+                param2 (str): name of the worker holding the lease
+
+            Returns:
+                bool: False if the lease had expired and was given to another worker
+        """
+
+        def done(connection):
+
+            cursor = connection.execute("UPDATE items SET state = 'done' WHERE queue = ? AND id = ? AND state = 'leased' AND worker = ?",
+                                        (self.name, item_id, worker))
+
+            return cursor.rowcount == 1
+
+        return self._transaction(done)
+
+    def extend(self, item_id, worker):
+        """
+            Extends a lease by the visibility timeout, from now
+
+            Args:
+                param1 (str): item ID
+                param2 (str): name of the worker holding the lease
+
+            Returns:
+                bool: False if the lease had expired and was given to another worker
+        """
+
+        def renew(connection):
+
+            cursor = connection.execute("UPDATE items SET lease_until = ? WHERE queue = ? AND id = ? AND state = 'leased' AND worker = ?",
+                                        (time.time() + self.visibility_timeout, self.name, item_id, worker))
+
+            return cursor.rowcount == 1
+
+        return self._transaction(renew)
+
+    def nack(self, item_id, worker, error):
+        """
+            Returns a leased item that failed to the queue, or sets it aside once it used up its attempts
+
+            Args:
+                param1 (str): item ID
+                param2 (str): name of the worker holding the lease
+                param3 (str): error that made the item fail
+        """
+
+        def retry(connection):
+
+            connection.execute("""
+                UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'ready' END, lease_until = 0, error = ?
+                WHERE queue = ? AND id = ? AND state = 'leased' AND worker = ?""",
+                               (self.max_attempts, error, self.name, item_id, worker))
+
+        self._transaction(retry)
+
+    def counts(self):
+        """
+            Returns the number of items in each state
+
+            Returns:
+                dict: counts of 'ready', 'leased', 'done' and 'failed' items
+        """
+
+        counts = {"ready" : 0, "leased" : 0, "done" : 0, "failed" : 0}
+
+        with self._lock:
+
+            rows = self._connect().execute("SELECT state, COUNT(*) FROM items WHERE queue = ? GROUP BY state", (self.name,)).fetchall()
+
+        counts.update(dict(rows))
+
+        return counts
+
+
+# Moves the expired leases back to the ready list, or to the failed items once they used up
+# their attempts, then leases the first ready item
+REDIS_LEASE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, item_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], item_id)
+    if tonumber(redis.call('HGET', KEYS[4], item_id) or 0) >= tonumber(ARGV[4]) then
+        redis.call('HSET', KEYS[6], item_id, 'lease expired')
+    else
+        redis.call('RPUSH', KEYS[1], item_id)
+    end
+end
+local item_id = redis.call('LPOP', KEYS[1])
+if not item_id then
+    return nil
+end
+redis.call('ZADD', KEYS[2], ARGV[2], item_id)
+redis.call('HSET', KEYS[3], item_id, ARGV[3])
+redis.call('HINCRBY', KEYS[4], item_id, 1)
+return {item_id, redis.call('HGET', KEYS[5], item_id)}
+"""
+
+# Acks or nacks an item, only if the worker still holds its lease
+REDIS_FINISH = """
+if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] or not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if ARGV[3] == 'done' then
+    redis.call('SADD', KEYS[4], ARGV[1])
+elseif tonumber(redis.call('HGET', KEYS[5], ARGV[1])) >= tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[6], ARGV[1], ARGV[5])
+else
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# Extends a lease, only if the worker still holds it
+REDIS_EXTEND = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] or not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+
+class RedisWorkQueue:
+    """
+        Work queue stored in Redis, shared by workers on any number of hosts
+
+        Args:
+            param1 (str): Redis url, e.g. redis://broker:6379/0
+            param2 (str): name of the queue
+            param3 (float): seconds a lease lasts
+            param4 (int): attempts before an item is set aside as failed
+    """
+
+    def __init__(self, url, name, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+
+        if redis is None:
+            raise ImportError("The redis package is needed for a Redis work queue")
+
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+        prefix = f"work_queue:{name}:"
+
+        self.keys = {key : prefix + key for key in ("ready", "leased", "workers", "attempts", "payloads", "done", "failed")}
+
+        self._lease = self.client.register_script(REDIS_LEASE)
+        self._finish = self.client.register_script(REDIS_FINISH)
+        self._extend = self.client.register_script(REDIS_EXTEND)
+
+    def enqueue(self, items):
+
+        added = 0
+
+        for item_id, payload in items.items():
+
+            # The payload hash doubles as the set of known items, so enqueueing is idempotent
+            if self.client.hsetnx(self.keys["payloads"], item_id, json.dumps(payload)):
+
+                self.client.rpush(self.keys["ready"], item_id)
+                added += 1
+
+        return added
+
+    def lease(self, worker):
+
+        now = time.time()
+
+        result = self._lease(keys=[self.keys[key] for key in ("ready", "leased", "workers", "attempts", "payloads", "failed")],
+                             args=[now, now + self.visibility_timeout, worker, self.max_attempts])
+
+        if result is None:
+            return None
+
+        return result[0], json.loads(result[1])
+
+    def _finish_item(self, item_id, worker, outcome, error=""):
+
+        keys = [self.keys[key] for key in ("ready", "leased", "workers", "done", "attempts", "failed")]
+
+        return self._finish(keys=keys, args=[item_id, worker, outcome, self.max_attempts, error]) == 1
+
+    def ack(self, item_id, worker):
+
+        return self._finish_item(item_id, worker, "done")
+
+    def extend(self, item_id, worker):
+
+        return self._extend(keys=[self.keys["leased"], self.keys["workers"]],
+                            args=[item_id, worker, time.time() + self.visibility_timeout]) == 1
+
+    def nack(self, item_id, worker, error):
+
+        self._finish_item(item_id, worker, "failed", error)
+
+    def counts(self):
+
+        return {
+            "ready" : self.client.llen(self.keys["ready"]),
+            "leased" : self.client.zcard(self.keys["leased"]),
+            "done" : self.client.scard(self.keys["done"]),
+            "failed" : self.client.hlen(self.keys["failed"]),
+        }
+
+
+def open_queue(url, name):
+    """
+        Opens a work queue on the broker at url
+
+        Args:
+            param1 (str): redis:// url, or path of a SQLite database
+            param2 (str): name of the queue
+
+        Returns:
+            SQLiteWorkQueue or RedisWorkQueue: the queue
+    """
+
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url, name)
+
+    return SQLiteWorkQueue(url, name)
+
+
+def keep_leased(queue, item_id, worker, stop, max_duration=MAX_TASK_DURATION):
+    """
+        Extends the lease of an item every third of the visibility timeout until stop is set,
+        or until the item has been processed for max_duration seconds
+
+        Args:
+            param1 (SQLiteWorkQueue or RedisWorkQueue): queue the item was leased from
+            param2 (str): item ID
+            param3 (str): name of the worker holding the lease
+            param4 (threading.Event): set once the item is processed
+            param5 (float): seconds the lease is kept alive at most
+    """
+
+    started_at = time.monotonic()
+
+    while not stop.wait(queue.visibility_timeout / 3):
+
+        # A stuck item would otherwise stay leased forever, its lease expires and it goes back on the queue
+        if time.monotonic() - started_at >= max_duration:
+
+            print(f"Item {item_id} is still processed after {max_duration:.0f} seconds, its lease is left to expire.")
+
+            return
+
+        if not queue.extend(item_id, worker):
+
+            print(f"Lease of {item_id} was lost, it may be processed twice.")
+
+            return
+
+
+def work(queue, handler, progress_interval=30, max_task_duration=MAX_TASK_DURATION):
+    """
+        Leases and processes items until the queue has no item left, ready or leased
+
+        Args:
+            param1 (SQLiteWorkQueue or RedisWorkQueue): queue to work on
+            param2 (function): receives the item ID and payload, raises to fail the item
+            param3 (float): seconds between two progress lines
+            param4 (float): seconds the lease of an item is kept alive while it is processed
+
+        Returns:
+            int: number of items this worker processed
+    """
+
+    worker = worker_name()
+    processed = 0
+
+    started_at = time.monotonic()
+    printed_at = started_at
+
+    while True:
+
+        item = queue.lease(worker)
+
+        if item is None:
+
+            # Other workers still hold leases, their items come back if they crash
+            if queue.counts()["leased"] == 0:
+                return processed
+
+            time.sleep(min(IDLE_WAIT, queue.visibility_timeout))
+
+            continue
+
+        item_id, payload = item
+
+        # The lease is kept alive while the item is processed, up to max_task_duration
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_leased, args=(queue, item_id, worker, stop, max_task_duration),
+                                     name=f"lease-{item_id}", daemon=True)
+        heartbeat.start()
+
+        try:
+            handler(item_id, payload)
+
+        except Exception as error:
+
+            print(f"Item {item_id} failed: {error!r}")
+
+            stop.set()
+            heartbeat.join()
+
+            queue.nack(item_id, worker, repr(error))
+
+        else:
+
+            stop.set()
+            heartbeat.join()
+
+            if not queue.ack(item_id, worker):
+                print(f"Lease of {item_id} expired before it was acked, it may be processed twice.")
+
+        processed += 1
+
+        if time.monotonic() - printed_at >= progress_interval:
+
+            printed_at = time.monotonic()
+
+            print(f"Queue {queue.name}: {queue.counts()}, this worker: {processed / (printed_at - started_at):.2f} items/s")
+
+
+def run_worker(queue, handler, threads=1):
+    """
+        Works on a queue with several threads of this process
+
+        Args:
+            param1 (SQLiteWorkQueue or RedisWorkQueue): queue to work on
+            param2 (function): receives the item ID and payload, raises to fail the item
+            param3 (int): number of threads
+
+        Returns:
+            int: number of items processed by this process
+    """
+
+    results = []
+
+    def target():
+        results.append(work(queue, handler))
+
+    pool = []
+
+    # Threads keep the caller's context, e.g. its metrics scope
+    for i in range(threads):
+
+        function, *args = submit_in_context(target)
+        pool.append(threading.Thread(target=function, args=args, name=f"worker-{i}"))
+
+    for thread in pool:
+        thread.start()
+
+    for thread in pool:
+        thread.join()
+
+    print(f"Queue {queue.name}: {queue.counts()}")
+
+    return sum(results)
+
+
+def spawn_workers(function, args, processes):
+    """
+        Runs function(*args) in several worker processes and waits for them to finish. Processes
+        are spawned rather than forked, so none inherits the pooled sessions, database connections,
+        locks and threads of this process
+
+        Args:
+            param1 (function): module-level function running a worker, e.g. calling run_worker
+            param2 (tuple): arguments of the function
+            param3 (int): number of processes, 1 runs the function in this process
+    """
+
+    if processes <= 1:
+        return function(*args)
+
+    context = multiprocessing.get_context("spawn")
+
+    workers = [context.Process(target=function, args=args, name=f"worker-process-{i}") for i in range(processes)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
@@ -5,100 +5,60 @@
         Directory containing the playlist links for each genre
     
     Output:
-        Directories containing JSON files for every playlist in each genre
+        Directories containing JSON files for every playlist in each genre, and a manifest of the
+        playlists done so far. A rerun skips them and retries the ones that failed, so the
+        script can be interrupted and started again at any point.
+        Each file lists the IDs of every track of its playlist under 'track ids', but 'tracks'
+        only holds the tracks no other playlist of the corpus has written yet
     
     Usage:
-        python3 scraping/playlists_to_json.py
+        python3 scraping/playlists_to_json.py [--workers 8]
+        Work queue mode, see commons.work_queue, e.g. with WORK_QUEUE_URL=redis://broker:6379/0:
+            python3 scraping/playlists_to_json.py --enqueue
+            python3 scraping/playlists_to_json.py --worker --processes 4 --workers 4   (on every worker host)
+
+    Environment:
+        SCRAPE_WORKERS: number of playlists scraped at the same time (default 4)
+        SCRAPE_DEDUPLICATE: set to 0 to write every track of every playlist (default 1)
 """
 
 # Importing the required libraries
 from dotenv import load_dotenv
+import argparse
 import os
-import shutil
-import base64
-from requests import post, get
 import json
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.get_song_features import get_songs_by_playlists, get_mul_tracks, get_mul_tracks_features, concatenate_playlist_info
-
-
-# Set up the Spotify API credentials
+# Set up the Spotify API credentials, before the commons modules read their settings
 dotenv_path = 'utils/.env'
 load_dotenv(dotenv_path ,verbose=False)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from commons.spotify_auth import get_token
+from commons.track_records import TrackColumns
+from commons.call_metrics import metrics_scope
+from commons.scrape_manifest import ScrapeManifest, atomic_write
+from commons.seen_set import SeenSet, open_seen_set
+from commons.work_queue import WORK_QUEUE_URL, open_queue, run_worker, spawn_workers
+from commons.progress import Progress
+from commons.resilience import submit_in_context
+from utils.get_song_features import get_songs_by_playlists, get_mul_tracks, get_mul_tracks_features, concatenate_playlist_info
 
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
-
-# Get token using client credentials
-def get_token():
-
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-
-    # Base url to be used
-    url = "https://accounts.spotify.com/api/token"
-
-    # Declare headers
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type":"application/x-www-form-urlencoded"
-        }
-    
-    data = {"grant_type": "client_credentials"}
-
-    result = post(url, headers = headers, data = data)
-
-    json_result = json.loads(result.content)
-
-    token = json_result["access_token"]
-    
-    return token
-
-# Set Authorization
-def get_auth_header(token):
-
-    return {"Authorization":"Bearer " + token}
-
-def api_request(url, headers, params=None, data=None):
-    """
-        Create a function to generate API request using custom url, parameters and data
-
-        Args:
-            param1 (str): url of the request
-            param2 (str): declared header
-            param3 (dict): parameters for the api request
-            param4 (dict): additional data to pass
-
-        Returns:
-            dict: return dict format of response. If response empty, return error
-    """
-
-    retry = True
-
-    while retry:
 
-        response = get(url, headers=headers, params=params, data=data)
+# Where the JSON files are written, and the manifest of the playlists already scraped
+OUTPUT_DIR = "data/json/json_scraped"
+MANIFEST_FILE = "manifest.jsonl"
 
-        # Status Code == 200 means successful request 
-        if response.status_code == 200:
-            return response
-        
-        # Time out error - API Request limit exceeded
-        elif response.status_code == 429:
+# Tracks already written by a playlist of the corpus, each one is fetched and written once
+SEEN_FILE = "seen.sqlite3"
+DEDUPLICATE = os.getenv("SCRAPE_DEDUPLICATE", "1") == "1"
 
-            retry_after = int(response.headers.get('Retry-After'))
-            print(f"Rate limit exceeded. Wait for {retry_after} seconds before trying again.")
-            return 'Try again'
-        
-        else:
+# Name of the work queue of playlists to scrape
+QUEUE_NAME = "playlists_to_json"
 
-            print(f"Request failed with error {response.status_code}: {response.text}")
-            
-            return None
+# Playlists scraped at the same time
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", 4))
 
 # Create a dictionary of playlist links
 def create_playlist_dict(folder_path):
@@ -141,77 +101,296 @@ def create_playlist_dict(folder_path):
     return playlist_dict
 
 
-# Get the playlist details
-def get_user_playlists_to_json(filepath):
+# Fetch the records of some tracks of a playlist
+def fetch_track_records(token, playlist_id, track_ids, artist_genres):
     """
-        Create a function that will generate a folder with subfolders of genres, containing info on each playlist
+        Create a function that will fetch the information and the audio features of tracks and join them
 
         Args:
-            param1 (str): path to where the json files will be stored
-    
+            param1 (str): token
+            param2 (str): playlist id
+            param3 (list): track IDs
+            param4 (dict): genres already known for each artist ID, shared across the run
+
         Returns:
-            dict: None
+            list: TrackRecord of each track that has both, keyed by the requested track ID
+    """
+
+    playlist_tracks = {'tracks' : track_ids}
+
+    playlist_tracks_info = get_mul_tracks(token, playlist_id, playlist_tracks, artist_genres)
+
+    playlist_tracks_features_info = get_mul_tracks_features(token, playlist_id, playlist_tracks)
+
+    return concatenate_playlist_info(playlist_tracks_info, playlist_tracks_features_info)['tracks']
+
+
+# Scrape one playlist into its JSON file
+def playlist_to_json(token, genre, playlist_id, artist_genres, output_dir=OUTPUT_DIR, seen=None):
+    """
+        Create a function that will write the info on every track of a playlist to a JSON file
+
+        Args:
+            param1 (str): token
+            param2 (str): genre of the playlist, name of the subfolder the file is written to
+            param3 (str): playlist id
+            param4 (dict): genres already known for each artist ID, shared across the run
+            param5 (str): path to where the json files will be stored
+            param6 (SeenSet): tracks already written by other playlists, None to write every track
+
+        Returns:
+            tuple: (path of the JSON file, SHA-256 of the file, number of tracks written)
+    """
+
+    playlist_tracks = get_songs_by_playlists(token, playlist_id)
+
+    track_ids = [track_id for track_id in playlist_tracks['tracks'] if track_id is not None]
+
+    owner = genre + "/" + playlist_id
+
+    if seen is None:
+
+        records = fetch_track_records(token, playlist_id, track_ids, artist_genres)
+
+    else:
+
+        # Only the tracks this playlist is the first to see are fetched, the others are referenced by ID
+        claimed_ids = seen.claim('track', track_ids, owner)
+
+        records = fetch_track_records(token, playlist_id, claimed_ids, artist_genres)
+
+        written_ids = {record.id for record in records}
+        skipped_ids = set(track_ids).difference(claimed_ids)
+
+        # Second pass over the claimed tracks that are still missing (e.g. their batch failed), and over
+        # the skipped tracks that their playlist has given up since, so no track is left unwritten
+        released_ids = seen.claim('track', [track_id for track_id in track_ids if track_id in skipped_ids], owner)
+        retry_ids = [track_id for track_id in claimed_ids if track_id not in written_ids] + released_ids
+
+        claimed_ids += released_ids
+
+        if len(retry_ids) > 0:
+
+            records += fetch_track_records(token, playlist_id, retry_ids, artist_genres)
+
+            # Rows keep the order of the playlist
+            positions = {track_id : position for position, track_id in enumerate(track_ids)}
+            records.sort(key=lambda record: positions[record.id])
+
+    # Records are stored by column until the file is written in the scraped JSON format
+    playlist_tracks_columns = TrackColumns.from_records(records)
+
+    playlist_tracks_all_info = {
+        'playlist id' : playlist_id,
+        'tracks' : playlist_tracks_columns.to_dicts(),
+        'track ids' : track_ids
+    }
+
+    file_path = os.path.join(output_dir, genre, genre + "_" + playlist_id + '.json')
+
+    # Written to a temporary file first, so an interrupted run never leaves half a file behind
+    data = json.dumps(playlist_tracks_all_info, ensure_ascii=False, indent=4).encode('utf-8')
+    digest = atomic_write(file_path, data)
+
+    # Claimed tracks still without a row (no audio features, unknown track) are given up. Claims and rows
+    # are both keyed by the requested track ID, so relinked tracks that were written keep their claim
+    if seen is not None:
+
+        written_ids = set(playlist_tracks_columns.columns['id'])
+
+        seen.release('track', [track_id for track_id in claimed_ids if track_id not in written_ids], owner)
+
+    return file_path, digest, len(playlist_tracks_columns)
+
+
+# Scrape one playlist and record the outcome in the manifest
+def scrape_playlist(manifest, progress, genre, playlist_id, artist_genres, output_dir, seen=None):
+    """
+        Create a function that will scrape a playlist, record it in the manifest and report the progress
+
+        Args:
+            param1 (ScrapeManifest): manifest of the run
+            param2 (Progress): live throughput of the run
+            param3 (str): genre of the playlist
+            param4 (str): playlist id
+            param5 (dict): genres already known for each artist ID, shared across the run
+            param6 (str): path to where the json files will be stored
+            param7 (SeenSet): tracks already written by other playlists, None to write every track
+    """
+
+    key = genre + "/" + playlist_id
+
+    try:
+
+        # Cached by the shared token manager, only refreshed shortly before it expires
+        file_path, digest, tracks = playlist_to_json(get_token(), genre, playlist_id, artist_genres, output_dir, seen)
+
+        manifest.record_done(key, file_path, digest, tracks)
+
+        progress.update(tracks=tracks)
+
+    except Exception as error:
+
+        print('failed at: ' + playlist_id + ' for ' + genre + ': ' + repr(error))
+
+        manifest.record_failure(key, repr(error))
+
+        progress.update(failed=True)
+
+
+# List the playlists left to scrape
+def list_playlists(filepath, output_dir, manifest):
+    """
+        Create a function that will list the playlists of every genre that an earlier run did not finish
+
+        Args:
+            param1 (str): path to the playlists txt folder
+            param2 (str): path to where the json files will be stored
+            param3 (ScrapeManifest): manifest of the playlists done so far
+
+        Returns:
+            list: (genre, playlist id) tuples
     """
 
     # Get all genre dictionaries and sort them using the names of genres
     playlist_link_dicts = create_playlist_dict(filepath)
     playlist_link_dicts = dict(sorted(playlist_link_dicts.items()))
 
-    # keys_to_delete = list(playlist_link_dicts.keys())[:89]
+    playlists = []
 
-    # for key in keys_to_delete:
-    #     del playlist_link_dicts[key]
-    
-    # write code to save playlists for each genre
     for playlist_name, playlist_links in playlist_link_dicts.items():
 
-        token = get_token()
-
         # extract genre name from the playlist name
-        filename = playlist_name[:-14]
-        filename = filename.replace(" ", "_")
+        genre = playlist_name[:-14]
+        genre = genre.replace(" ", "_")
 
-        # make a new folder with the filename
-        os.system("cd data/json/json_scraped/ && mkdir %s" %filename)
+        # make a new folder with the genre name
+        os.makedirs(os.path.join(output_dir, genre), exist_ok=True)
 
-        # extract features for tracks in the playlist for each playlists
-        for playlist_id in playlist_links:
+        playlists += [(genre, playlist_id) for playlist_id in playlist_links if not manifest.is_done(genre + "/" + playlist_id)]
 
-            try: 
+    return playlists
 
-                playlist_tracks = get_songs_by_playlists(token, playlist_id)
-            
-                playlist_tracks_info = get_mul_tracks(token, playlist_id, playlist_tracks)
 
-                playlist_tracks_features_info = get_mul_tracks_features(token, playlist_id, playlist_tracks)
+# Get the playlist details
+def get_user_playlists_to_json(filepath, output_dir=OUTPUT_DIR, workers=SCRAPE_WORKERS):
+    """
+        Create a function that will generate a folder with subfolders of genres, containing info on each playlist.
+        Playlists of every genre are scraped concurrently by a pool of workers drawing from the shared rate budget.
+        Completed playlists are recorded in a manifest, so a rerun skips them and only retries the ones that failed
 
-                playlist_tracks_all_info = concatenate_playlist_info(playlist_tracks_info, playlist_tracks_features_info)
+        Args:
+            param1 (str): path to the playlists txt folder
+            param2 (str): path to where the json files will be stored
+            param3 (int): number of playlists scraped at the same time
+    
+        Returns:
+            dict: None
+    """
 
-                with open("data/json/json_scraped" + "/" + filename  + "/" + filename + "_" + playlist_id + '.json', 'w', encoding='utf-8') as f:
-                    json.dump(playlist_tracks_all_info, f, ensure_ascii=False, indent=4)
+    manifest = ScrapeManifest(os.path.join(output_dir, MANIFEST_FILE))
+    print(f"Resuming from manifest: {manifest.summary()}")
 
-                print("Done!")
+    # Kept next to the files, so a resumed run knows which tracks were already written
+    seen = SeenSet(os.path.join(output_dir, SEEN_FILE)) if DEDUPLICATE else None
 
-            except:
-                
-                print('failed at: ' + playlist_id + 'for ' + filename)
-                
-        # sleep the code so API requests doesn't encounter a timeout error
-            time.sleep(5)
-        
-        time.sleep(5)
+    queue = list_playlists(filepath, output_dir, manifest)
+
+    print(f"Scraping {len(queue)} playlists with {workers} workers")
+
+    # Artist genres are shared across the whole run so each artist is fetched once
+    artist_genres = {}
+
+    progress = Progress(len(queue), "playlists")
+
+    # Every worker leases requests from the same rate budget, so concurrency never exceeds the quota
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scrape") as pool:
+
+        for genre, playlist_id in queue:
+            pool.submit(*submit_in_context(scrape_playlist, manifest, progress, genre, playlist_id, artist_genres, output_dir, seen))
+
+    print(f"Manifest: {manifest.summary()}")
+
+
+# Scrape the playlists of the work queue
+def queue_worker(queue_url, output_dir, threads):
+    """
+        Create a function that will scrape the playlists of the work queue until it is empty. The worker
+        processes of a host append their playlists to the manifest of the shared output folder
+
+        Args:
+            param1 (str): Redis url or SQLite path of the work queue
+            param2 (str): path to where the json files will be stored
+            param3 (int): number of playlists scraped at the same time by this process
+    """
+
+    queue = open_queue(queue_url, QUEUE_NAME)
+
+    # Other processes may be appending to the manifest, so it is never compacted in queue mode
+    manifest = ScrapeManifest(os.path.join(output_dir, MANIFEST_FILE), compact=False)
 
-        print("Done for playlist: " +  filename)
+    # Workers on several hosts share the seen-set of the Redis broker
+    seen = open_seen_set(queue_url, QUEUE_NAME, os.path.join(output_dir, SEEN_FILE)) if DEDUPLICATE else None
+
+    # Artist genres are shared by the threads of this process
+    artist_genres = {}
+
+    def handle(key, payload):
+
+        # Done by a worker whose ack was lost
+        if manifest.is_done(key):
+            return
+
+        os.makedirs(os.path.join(output_dir, payload["genre"]), exist_ok=True)
+
+        try:
+
+            # Cached by the shared token manager, only refreshed shortly before it expires
+            file_path, digest, tracks = playlist_to_json(get_token(), payload["genre"], payload["playlist_id"],
+                                                         artist_genres, output_dir, seen)
+
+        except Exception as error:
+
+            manifest.record_failure(key, repr(error))
+
+            raise
+
+        manifest.record_done(key, file_path, digest, tracks)
+
+    with metrics_scope(f"playlists_to_json worker {os.getpid()}"):
+        run_worker(queue, handle, threads)
 
 
 if __name__ == "__main__":
 
     start_time = time.time()
 
-    filename = 'json_scraped'
-    os.system("cd data/json && mkdir %s" %filename)
+    parser = argparse.ArgumentParser(description="Scrape the playlists of every genre to JSON files")
+    parser.add_argument("--workers", type=int, default=SCRAPE_WORKERS, help="number of playlists scraped at the same time by each process")
+    parser.add_argument("--enqueue", action="store_true", help="put every playlist left to scrape on the work queue")
+    parser.add_argument("--worker", action="store_true", help="scrape the playlists of the work queue")
+    parser.add_argument("--queue", default=WORK_QUEUE_URL, help="Redis url or SQLite path of the work queue")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes started on this host")
+    args = parser.parse_args()
+
+    if args.enqueue:
+
+        # Workers may already be appending to the manifest
+        manifest = ScrapeManifest(os.path.join(OUTPUT_DIR, MANIFEST_FILE), compact=False)
+        items = {genre + "/" + playlist_id : {"genre" : genre, "playlist_id" : playlist_id}
+                 for genre, playlist_id in list_playlists("data/playlists", OUTPUT_DIR, manifest)}
+
+        added = open_queue(args.queue, QUEUE_NAME).enqueue(items)
+        print(f"Enqueued {added} playlists")
+
+    if args.worker:
+        spawn_workers(queue_worker, (args.queue, OUTPUT_DIR, args.workers), args.processes)
+
+    if not args.enqueue and not args.worker:
 
-    get_user_playlists_to_json("data/playlists")
+        # prints the upstream calls made by the run when it is done
+        with metrics_scope("playlists_to_json"):
+            get_user_playlists_to_json("data/playlists", workers=args.workers)
 
     end_time = time.time()
     runtime = end_time - start_time
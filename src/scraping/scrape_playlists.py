@@ -9,91 +9,129 @@
 
     Usage:
         python3 scraping/scrape_playlists.py
+        Work queue mode, see commons.work_queue, e.g. with WORK_QUEUE_URL=redis://broker:6379/0:
+            python3 scraping/scrape_playlists.py --enqueue
+            python3 scraping/scrape_playlists.py --worker --processes 4   (on every worker host)
 """
 
 # Importing the required libraries
 from dotenv import load_dotenv
-from requests import get, post
-import time
+import argparse
 import os
+import time
+import sys
 import json
-import base64
-
-# Set up the Spotify API credentials
+from pathlib import Path
+# Set up the Spotify API credentials, before the commons modules read their settings
 dotenv_path = 'utils/.env'
 load_dotenv(dotenv_path ,verbose=False)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from commons.endpoints import SPOTIFY_API_BASE_URL
+from commons.spotify_auth import get_token, get_auth_header
+from commons.spotify_client import api_request
+from commons.call_metrics import metrics_scope
+from commons.resilience import CircuitOpenError
+from commons.work_queue import WORK_QUEUE_URL, open_queue, run_worker, spawn_workers
+
+
+# Name of the work queue of genres to scrape
+QUEUE_NAME = "scrape_playlists"
+
+# Genres playlists are scraped for
+GENRES = [  'acoustic', 'afrobeat', 'alt-country', 'alternatives', 'ambient',
+            'americana', 'avant-garde', 'ballads', 'blues', 'bollywood', 'brazilian',
+            'breakbeat', 'britpop', 'celtic', 'chamber', 'chanson francaise',
+            'children', 'chillout', 'classical', 'country', 'dance', 
+            'darkwave', 'death metal', 'deep house', 'disco', 'downtempo', 
+            'drone', 'dubstep', 'easy listening', 'electronic', 'emo', 
+            'experimental', 'folk', 'funk', 'fusion', 'garage', 'glitch',
+            'goa', 'gospel', 'grunge', 'hard rock', 'hardcore', 'hip hop',
+            'holiday', 'house', 'idm', 'indie', 'indie pop', 'industrial',
+            'instrumental', 'international', 'jazz', 'jungle', 'latin',
+            'lo-fi', 'medieval', 'metal', 'minimal', 'modern classical',
+            'new age', 'noise', 'nu-jazz', 'other', 'pop', 'post-punk',
+            'post-rock', 'power pop', 'progressive', 'psychedelic',
+            'punk', 'r and b', 'rap', 'reggae', 'religious', 
+            'renaissance', 'rock', 'rockabilly', 'romantic',
+            'shoegaze', 'singer-songwriter', 'ska', 'soul', 'soundtrack',
+            'space rock', 'stage and screen', 'surf', 'synthpop',
+            'techno', 'trance', 'trip hop', 'unknown', 'vocal', 'world']
+
+
+def scrape_genre(token, genre):
 
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
+    """
+        Create a function to generate the text file of a genre containing 60 playlists
 
-# Get token using client credentials
-def get_token():
+        Args:
+            param1 (str): token
+            param2 (str): genre to search playlists for
 
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
+        Raises:
+            RuntimeError: the playlists could not be retrieved
+    """
 
-    # Base url to be used
-    url = "https://accounts.spotify.com/api/token"
+    offset = 0
+    user_playlists = []
 
-    # Declare headers
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type":"application/x-www-form-urlencoded"
-        }
-    
-    data = {"grant_type": "client_credentials"}
+    params = {
+        'type': 'playlist',
+        'limit': 50,
+        'offset': 0
+    }
 
-    result = post(url, headers = headers, data = data)
+    # Get the first 60 playlists
+    while len(user_playlists) < 60:
 
-    json_result = json.loads(result.content)
+            url = f'{SPOTIFY_API_BASE_URL}/search?q={genre}'
 
-    token = json_result["access_token"]
-    
-    return token
+            headers = get_auth_header(token)
 
-# Set Authorization
-def get_auth_header(token):
+            # Make the API request and get the data
+            playlist_result = api_request(url, headers=headers, params = params)
 
-    return {"Authorization":"Bearer " + token}
+            if playlist_result is None or playlist_result == 'Try again':
 
-def api_request(url, headers, params=None, data=None):
+                raise RuntimeError("Failed to retrieve playlist information.")
 
-    """
-        Create a function to generate API request using custom url, parameters and data
+            playlists = json.loads(playlist_result.content)
 
-        Args:
-            param1 (str): url of the request
-            param2 (str): declared header
-            param3 (dict): parameters for the api request
-            param4 (dict): additional data to pass
+            # Get the playlists from the response
+            playlists_data = playlists['playlists']['items']
 
-        Returns:
-            dict: return dict format of response. If response empty, return error
-    """
+            for playlist in playlists_data:
+                
+                # Getting only user made playlists, search results can hold removed playlists as null
+                if playlist is not None and playlist['owner']['id'] != 'spotify':
+                    
+                    user_playlists.append(playlist)
+                    
+                    # Checking if the number of playlists has not crossed 60
+                    if len(user_playlists) >= 60:
 
-    retry = True
+                        break
 
-    while retry:
+            # The search has no more results for this genre
+            if playlists['playlists']['next'] is None or len(playlists_data) == 0:
+                break
 
-        response = get(url, headers=headers, params=params, data=data)
+            # Resetting parameters to accomodate offset number 
+            offset += len(playlists_data)
 
-        # Status Code == 200 means successful request 
-        if response.status_code == 200:
-            return response
-        
-        # Time out error - API Request limit exceeded
-        elif response.status_code == 429:
+            params = {
+                'type': 'playlist',
+                'limit': 50,
+                'offset': offset
+            }
 
-            retry_after = int(response.headers.get('Retry-After'))
-            print(f"Rate limit exceeded. Wait for {retry_after} seconds before trying again.")
-            return 'Try again'
+    # Write the playlist links to a text file
+    with open('data/playlists/%s_playlists.txt' % genre, 'w') as f:
         
-        else:
-
-            print(f"Request failed with error {response.status_code}: {response.text}")
+        for playlist in user_playlists:
             
-            return None
+            playlist_url = playlist['external_urls']['spotify']
+            f.write(playlist_url + '\n')
+
 
 def get_playlists(token):
 
@@ -106,96 +144,65 @@ def get_playlists(token):
         Returns:
             None
     """
-    
-    # Create a list of genres
-    genre_list = [  'acoustic', 'afrobeat', 'alt-country', 'alternatives', 'ambient',
-                    'americana', 'avant-garde', 'ballads', 'blues', 'bollywood', 'brazilian',
-                    'breakbeat', 'britpop', 'celtic', 'chamber', 'chanson francaise',
-                    'children', 'chillout', 'classical', 'country', 'dance', 
-                    'darkwave', 'death metal', 'deep house', 'disco', 'downtempo', 
-                    'drone', 'dubstep', 'easy listening', 'electronic', 'emo', 
-                    'experimental', 'folk', 'funk', 'fusion', 'garage', 'glitch',
-                    'goa', 'gospel', 'grunge', 'hard rock', 'hardcore', 'hip hop',
-                    'holiday', 'house', 'idm', 'indie', 'indie pop', 'industrial',
-                    'instrumental', 'international', 'jazz', 'jungle', 'latin',
-                    'lo-fi', 'medieval', 'metal', 'minimal', 'modern classical',
-                    'new age', 'noise', 'nu-jazz', 'other', 'pop', 'post-punk',
-                    'post-rock', 'power pop', 'progressive', 'psychedelic',
-                    'punk', 'r and b', 'rap', 'reggae', 'religious', 
-                    'renaissance', 'rock', 'rockabilly', 'romantic',
-                    'shoegaze', 'singer-songwriter', 'ska', 'soul', 'soundtrack',
-                    'space rock', 'stage and screen', 'surf', 'synthpop',
-                    'techno', 'trance', 'trip hop', 'unknown', 'vocal', 'world']
 
     # Scrape the playlists for each genre
-    for genre in genre_list:
-
-        offset = 0
-        user_playlists = []
+    for genre in GENRES:
 
-        params = {
-            'type': 'playlist',
-            'limit': 50,
-            'offset': 0
-        }
+        try:
+            scrape_genre(token, genre)
 
-        # Get the first 60 playlists
-        while len(user_playlists) < 60:
+        except (RuntimeError, CircuitOpenError) as error:
+            return str(error)
 
-                url = f'https://api.spotify.com/v1/search?q={genre}'
 
-                headers = get_auth_header(token)
-
-                # Make the API request and get the data
-                playlist_result = api_request(url, headers=headers, params = params)
-
-                if playlist_result is None or playlist_result == 'Try again':
+def queue_worker(queue_url, threads):
+    """
+        Create a function to scrape the genres of the work queue until it is empty
 
-                    return ("Failed to retrieve playlist information.")
+        Args:
+            param1 (str): Redis url or SQLite path of the work queue
+            param2 (int): number of genres scraped at the same time by this process
+    """
 
-                else:
+    queue = open_queue(queue_url, QUEUE_NAME)
 
-                    playlists = json.loads(playlist_result.content)
+    def handle(genre, payload):
 
-                    # Get the playlists from the response
-                    playlists_data = playlists['playlists']['items']
+        # Cached by the shared token manager, only refreshed shortly before it expires
+        scrape_genre(get_token(), genre)
 
-                    for playlist in playlists_data:
-                        
-                        # Getting only user made playlists
-                        if playlist['owner']['id'] != 'spotify':
-                            
-                            user_playlists.append(playlist)
-                            
-                            # Checking if the number of playlists has not crossed 60
-                            if len(user_playlists) >= 60:
+    with metrics_scope(f"scrape_playlists worker {os.getpid()}"):
+        run_worker(queue, handle, threads)
 
-                                break
-                    
-                    # Resetting parameters to accomodate offset number 
-                    params = {
-                        'type': 'playlist',
-                        'limit': 50,
-                        'offset': offset + len(playlists)
-                    }
-
-                    # Write the playlist links to a text file
-                    with open('data/playlists/%s_playlists.txt' % genre, 'w') as f:
-                        
-                        for playlist in user_playlists:
-                            
-                            playlist_url = playlist['external_urls']['spotify']
-                            f.write(playlist_url + '\n')
-
-                    time.sleep(3)                            
 
 if __name__ == "__main__":
 
     start_time = time.time()
     
-    token = get_token()
+    parser = argparse.ArgumentParser(description="Scrape user made playlists for every genre")
+    parser.add_argument("--enqueue", action="store_true", help="put every genre on the work queue")
+    parser.add_argument("--worker", action="store_true", help="scrape the genres of the work queue")
+    parser.add_argument("--queue", default=WORK_QUEUE_URL, help="Redis url or SQLite path of the work queue")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes started on this host")
+    parser.add_argument("--threads", type=int, default=1, help="genres scraped at the same time by each worker process")
+    args = parser.parse_args()
+
+    if args.enqueue:
+
+        added = open_queue(args.queue, QUEUE_NAME).enqueue({genre : {} for genre in GENRES})
+        print(f"Enqueued {added} genres")
+
+    if args.worker:
+        spawn_workers(queue_worker, (args.queue, args.threads), args.processes)
+
+    if not args.enqueue and not args.worker:
+
+        # prints the upstream calls made by the run when it is done
+        with metrics_scope("scrape_playlists"):
+
+            token = get_token()
 
-    get_playlists(token)
+            get_playlists(token)
 
     end_time = time.time()
     runtime = end_time - start_time
@@ -0,0 +1,13 @@
+"""
+    Shared setup of the tests of the commons modules.
+
+    Usage:
+        python -m pytest -q src/tests
+"""
+
+# Import libraries
+import sys
+from pathlib import Path
+
+# The commons modules are imported the way the application and the scrapers import them
+sys.path.insert(0, str(Path(__file__).parent.parent))
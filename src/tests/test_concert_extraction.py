@@ -0,0 +1,61 @@
+"""
+    Tests of the Ticketmaster search in application.concerts.concert_extraction
+"""
+
+# Import libraries
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from application.concerts import concert_extraction
+
+
+class Response:
+
+    status_code = 200
+
+    def __init__(self, body):
+
+        self.body = body
+
+    def json(self):
+
+        return self.body
+
+
+@pytest.fixture
+def responses(monkeypatch):
+
+    responses = []
+
+    # Each call answers the next response, or raises it
+    def get(url, params=None):
+
+        response = responses.pop(0)
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+    monkeypatch.setattr(concert_extraction, "get", get)
+    monkeypatch.setattr(concert_extraction.ticketmaster_limiter, "acquire", lambda *args, **kwargs: 0)
+
+    return responses
+
+
+def test_dropped_connection_returns_no_events(responses):
+
+    responses.append(requests.ConnectionError("dropped"))
+
+    assert concert_extraction.api_request("Vancouver", "2024-01-01", "2024-01-31", "rock") == ([], 0)
+
+
+def test_failed_page_keeps_the_number_of_events(responses):
+
+    responses.append(Response({"page" : {"totalPages" : 2, "totalElements" : 30}, "_embedded" : {"events" : [{}]}}))
+    responses.append(requests.Timeout("slow"))
+
+    # Known to exist, so get_events searches again
+    assert concert_extraction.api_request("Vancouver", "2024-01-01", "2024-01-31", "rock") == ([], 30)
@@ -0,0 +1,79 @@
+"""
+    Tests of the concurrent page fetch in commons.pagination
+"""
+
+# Import libraries
+import time
+import pytest
+
+pytest.importorskip("requests")
+
+from commons import pagination
+
+
+def fake_get_page(delays):
+
+    # Page of offset/10 items, slower or faster depending on its offset
+    def get_page(url, headers, offset, page_size, paging_key=None, params=None):
+
+        time.sleep(delays.get(offset, 0))
+
+        if offset in delays and delays[offset] is None:
+            return None
+
+        return {"items" : list(range(offset, min(offset + page_size, 40))), "total" : 40}
+
+    return get_page
+
+
+def test_pages_are_yielded_in_offset_order(monkeypatch):
+
+    # Page 2 finishes long before page 1
+    monkeypatch.setattr(pagination, "get_page", fake_get_page({10 : 0.3, 20 : 0}))
+
+    offsets = [offset for offset, page in pagination.iter_pages("token", "url", 10)]
+
+    assert offsets == [0, 10, 20, 30]
+
+
+def test_all_pages_keep_the_item_order(monkeypatch):
+
+    monkeypatch.setattr(pagination, "get_page", fake_get_page({10 : 0.3, 20 : 0}))
+
+    assert pagination.get_all_pages("token", "url", 10) == list(range(40))
+
+
+def test_embedded_first_page_is_not_requested_again(monkeypatch):
+
+    monkeypatch.setattr(pagination, "get_page", fake_get_page({0 : None}))
+
+    first_page = {"items" : list(range(5)), "total" : 40}
+
+    assert pagination.get_all_pages("token", "url", 10, first_page=first_page) == list(range(5)) + list(range(5, 40))
+
+
+def test_playlist_pages_are_processed_in_playlist_order(monkeypatch):
+
+    pytest.importorskip("pandas")
+    pytest.importorskip("dotenv")
+
+    from application.feature_engineering import get_song_features
+
+    def iter_playlist_track_ids(token, playlist_id):
+
+        yield 0, ["a", "b"]
+        yield 2, ["c", "d"]
+        yield 4, ["e"]
+
+    # The first page takes the longest to process
+    def page_function(token, playlist_id, track_ids, artist_genres):
+
+        time.sleep(0.3 if track_ids[0] == "a" else 0)
+
+        return track_ids
+
+    monkeypatch.setattr(get_song_features, "iter_playlist_track_ids", iter_playlist_track_ids)
+
+    pages = list(get_song_features.iter_playlist_pages("token", "playlist", page_function))
+
+    assert pages == [["a", "b"], ["c", "d"], ["e"]]
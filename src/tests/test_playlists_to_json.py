@@ -0,0 +1,95 @@
+"""
+    Tests of the cross-playlist track deduplication in scraping.playlists_to_json
+"""
+
+# Import libraries
+import json
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from commons.seen_set import SeenSet
+from commons.track_records import TrackRecord
+from scraping import playlists_to_json
+
+
+@pytest.fixture
+def scrape(monkeypatch, tmp_path):
+
+    playlists = {}
+    unavailable = set()
+    given_up = set()
+    fetched = []
+
+    # Records of the requested tracks, except the unavailable ones
+    def fetch_track_records(token, playlist_id, track_ids, artist_genres):
+
+        fetched.append((playlist_id, list(track_ids)))
+
+        # Another playlist scraped at the same time gives some of its tracks up
+        if len(fetched) == 1:
+            seen.release("track", list(given_up), "rock/other")
+
+        return [TrackRecord(id=track_id) for track_id in track_ids if track_id not in unavailable]
+
+    monkeypatch.setattr(playlists_to_json, "get_songs_by_playlists", lambda token, playlist_id: {'tracks' : playlists[playlist_id]})
+    monkeypatch.setattr(playlists_to_json, "fetch_track_records", fetch_track_records)
+
+    seen = SeenSet(str(tmp_path / "seen.sqlite3"))
+
+    (tmp_path / "rock").mkdir()
+
+    def run(playlist_id, track_ids):
+
+        playlists[playlist_id] = track_ids
+
+        file_path, digest, tracks = playlists_to_json.playlist_to_json("token", "rock", playlist_id, {}, str(tmp_path), seen)
+
+        with open(file_path, encoding="utf-8") as f:
+            return [track["id"] for track in json.load(f)["tracks"]]
+
+    return run, seen, unavailable, given_up, fetched
+
+
+def test_tracks_are_written_by_the_first_playlist(scrape):
+
+    run, seen, unavailable, given_up, fetched = scrape
+
+    assert run("1", ["a", "b"]) == ["a", "b"]
+    assert run("2", ["b", "c"]) == ["c"]
+
+
+def test_unwritten_claims_are_released(scrape):
+
+    run, seen, unavailable, given_up, fetched = scrape
+    unavailable.add("b")
+
+    assert run("1", ["a", "b"]) == ["a"]
+
+    # Retried once before the claim is given up
+    assert fetched == [("1", ["a", "b"]), ("1", ["b"])]
+    assert seen.claim("track", ["a", "b"], "rock/3") == ["b"]
+
+
+def test_tracks_given_up_meanwhile_are_written_by_the_skipping_playlist(scrape):
+
+    run, seen, unavailable, given_up, fetched = scrape
+
+    # Another playlist owns 'b' and gives it up while playlist 1 is being scraped
+    seen.claim("track", ["b"], "rock/other")
+    given_up.add("b")
+
+    assert run("1", ["a", "b"]) == ["a", "b"]
+    assert fetched == [("1", ["a"]), ("1", ["b"])]
+    assert seen.claim("track", ["b"], "rock/3") == []
+
+
+def test_tracks_kept_by_their_owner_are_not_fetched_again(scrape):
+
+    run, seen, unavailable, given_up, fetched = scrape
+
+    seen.claim("track", ["b"], "rock/other")
+
+    assert run("1", ["b", "a"]) == ["a"]
+    assert fetched == [("1", ["a"])]
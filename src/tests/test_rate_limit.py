@@ -0,0 +1,103 @@
+"""
+    Tests of the token bucket in commons.rate_limit
+"""
+
+# Import libraries
+import pytest
+from commons import rate_limit
+from commons.priority import INTERACTIVE, BACKGROUND
+from commons.rate_limit import TokenBucket
+from commons.resilience import Deadline, DeadlineExceeded, deadline_scope
+
+
+class Clock:
+    """
+        Clock the bucket reads instead of the system time
+    """
+
+    def __init__(self):
+
+        self.now = 1000.0
+
+    def time(self):
+
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "time", clock.time)
+
+    return clock
+
+
+def test_bucket_refills_at_its_rate(tmp_path, clock):
+
+    bucket = TokenBucket("test", rate=2, capacity=2, state_dir=str(tmp_path), reserve=0)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+
+    # Empty, the next token comes after 1 / rate seconds
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 0.5
+
+    assert bucket.try_acquire() == 0
+
+
+def test_bucket_never_holds_more_than_its_capacity(tmp_path, clock):
+
+    bucket = TokenBucket("test", rate=2, capacity=2, state_dir=str(tmp_path), reserve=0)
+
+    bucket.try_acquire()
+    clock.now += 60
+
+    assert [bucket.try_acquire() == 0 for _ in range(3)] == [True, True, False]
+
+
+def test_background_calls_leave_the_reserve_to_interactive_calls(tmp_path, clock):
+
+    bucket = TokenBucket("test", rate=1, capacity=4, state_dir=str(tmp_path), reserve=0.5)
+
+    # An interactive call was made recently, background calls stop at the reserve floor
+    assert bucket.try_acquire(priority=INTERACTIVE) == 0
+    assert bucket.try_acquire(priority=BACKGROUND) == 0
+    assert bucket.try_acquire(priority=BACKGROUND) > 0
+
+    # Interactive calls may use the reserve
+    assert bucket.try_acquire(priority=INTERACTIVE) == 0
+    assert bucket.try_acquire(priority=INTERACTIVE) == 0
+
+
+def test_background_calls_use_the_reserve_once_interactive_calls_stop(tmp_path, clock):
+
+    bucket = TokenBucket("test", rate=1, capacity=4, state_dir=str(tmp_path), reserve=0.5)
+
+    bucket.try_acquire(priority=INTERACTIVE)
+    clock.now += 60
+
+    assert [bucket.try_acquire(priority=BACKGROUND) == 0 for _ in range(4)] == [True] * 4
+
+
+def test_blocked_bucket_waits_for_retry_after(tmp_path, clock):
+
+    bucket = TokenBucket("test", rate=10, capacity=10, state_dir=str(tmp_path), reserve=0)
+
+    bucket.block_for(30)
+
+    assert bucket.try_acquire() == pytest.approx(30)
+
+
+def test_acquire_does_not_wait_past_the_deadline(tmp_path):
+
+    bucket = TokenBucket("test", rate=10, capacity=10, state_dir=str(tmp_path), reserve=0)
+
+    bucket.block_for(30)
+
+    with deadline_scope(Deadline(1)):
+
+        with pytest.raises(DeadlineExceeded):
+            bucket.acquire()
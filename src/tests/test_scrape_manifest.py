@@ -0,0 +1,70 @@
+"""
+    Tests of the scrape manifest in commons.scrape_manifest
+"""
+
+# Import libraries
+from commons.scrape_manifest import ScrapeManifest, atomic_write
+
+
+def test_done_entries_survive_a_reload(tmp_path):
+
+    output = tmp_path / "rock_1.json"
+    digest = atomic_write(str(output), b"{}")
+
+    manifest = ScrapeManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.record_done("rock/1", str(output), digest, 3)
+    manifest.record_failure("rock/2", "boom")
+
+    reloaded = ScrapeManifest(str(tmp_path / "manifest.jsonl"))
+
+    assert reloaded.is_done("rock/1")
+    assert not reloaded.is_done("rock/2")
+    assert list(reloaded.failures()) == ["rock/2"]
+
+
+def test_modified_output_is_not_done(tmp_path):
+
+    output = tmp_path / "rock_1.json"
+    digest = atomic_write(str(output), b"{}")
+
+    manifest = ScrapeManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.record_done("rock/1", str(output), digest, 3)
+
+    output.write_bytes(b"{\"tampered\" : true}")
+
+    assert not manifest.is_done("rock/1")
+    assert manifest.is_done("rock/1", verify=False)
+
+
+def test_torn_line_does_not_swallow_the_next_entry(tmp_path):
+
+    path = tmp_path / "manifest.jsonl"
+
+    manifest = ScrapeManifest(str(path))
+    manifest.record_failure("rock/1", "boom")
+
+    # A worker interrupted half way through writing its entry
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key" : "rock/2", "sta')
+
+    manifest.record_failure("rock/3", "boom")
+
+    reloaded = ScrapeManifest(str(path), compact=False)
+
+    assert sorted(reloaded.entries) == ["rock/1", "rock/3"]
+
+
+def test_compaction_keeps_the_last_entry_of_each_key(tmp_path):
+
+    path = tmp_path / "manifest.jsonl"
+
+    manifest = ScrapeManifest(str(path))
+    manifest.record_failure("rock/1", "boom")
+    manifest.record_failure("rock/1", "boom again")
+
+    ScrapeManifest(str(path))
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+
+    assert len(lines) == 1
+    assert ScrapeManifest(str(path)).entries["rock/1"]["attempts"] == 2
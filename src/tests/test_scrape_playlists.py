@@ -0,0 +1,74 @@
+"""
+    Tests of the playlist search in scraping.scrape_playlists
+"""
+
+# Import libraries
+import json
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from scraping import scrape_playlists
+
+
+class Response:
+
+    def __init__(self, body):
+
+        self.content = json.dumps(body).encode("utf-8")
+
+
+def playlist(number, owner="user"):
+
+    return {"owner" : {"id" : owner}, "external_urls" : {"spotify" : f"https://open.spotify.com/playlist/{number}"}}
+
+
+@pytest.fixture
+def search(monkeypatch, tmp_path):
+
+    pages = {}
+    offsets = []
+
+    def api_request(url, headers, params):
+
+        offsets.append(params["offset"])
+
+        return Response(pages[params["offset"]])
+
+    monkeypatch.setattr(scrape_playlists, "api_request", api_request)
+    monkeypatch.chdir(tmp_path)
+
+    (tmp_path / "data" / "playlists").mkdir(parents=True)
+
+    def read(genre):
+
+        return (tmp_path / "data" / "playlists" / f"{genre}_playlists.txt").read_text().splitlines()
+
+    return pages, offsets, read
+
+
+def test_offset_advances_by_the_items_of_each_page(search):
+
+    pages, offsets, read = search
+
+    pages[0] = {"playlists" : {"items" : [playlist(i) for i in range(50)], "next" : "url"}}
+    pages[50] = {"playlists" : {"items" : [playlist(i, "spotify") for i in range(40)] + [playlist(i) for i in range(50, 60)], "next" : "url"}}
+
+    scrape_playlists.scrape_genre("token", "rock")
+
+    assert offsets == [0, 50]
+    assert len(read("rock")) == 60
+
+
+def test_search_stops_when_there_are_no_more_results(search):
+
+    pages, offsets, read = search
+
+    pages[0] = {"playlists" : {"items" : [playlist(1), None, playlist(2, "spotify")], "next" : "url"}}
+    pages[3] = {"playlists" : {"items" : [playlist(3)], "next" : None}}
+
+    scrape_playlists.scrape_genre("token", "rock")
+
+    assert offsets == [0, 3]
+    assert read("rock") == ["https://open.spotify.com/playlist/1", "https://open.spotify.com/playlist/3"]
@@ -0,0 +1,48 @@
+"""
+    Tests of the SQLite seen-set in commons.seen_set
+"""
+
+# Import libraries
+from commons.seen_set import SeenSet
+
+
+def test_first_owner_claims_each_id(tmp_path):
+
+    seen = SeenSet(str(tmp_path / "seen.sqlite3"))
+
+    assert seen.claim("track", ["a", "b", "a"], "rock/1") == ["a", "b"]
+    assert seen.claim("track", ["b", "c"], "pop/2") == ["c"]
+    assert len(seen) == 3
+
+
+def test_retried_owner_gets_its_claims_back(tmp_path):
+
+    path = str(tmp_path / "seen.sqlite3")
+
+    SeenSet(path).claim("track", ["a", "b"], "rock/1")
+    SeenSet(path).claim("track", ["b", "c"], "pop/2")
+
+    # A rerun after an interruption, with a fresh connection
+    assert SeenSet(path).claim("track", ["c", "b", "a"], "rock/1") == ["b", "a"]
+
+
+def test_released_ids_can_be_claimed_by_others(tmp_path):
+
+    seen = SeenSet(str(tmp_path / "seen.sqlite3"))
+
+    seen.claim("track", ["a", "b"], "rock/1")
+
+    # Only the owner's claims are released
+    seen.release("track", ["b"], "pop/2")
+    assert seen.claim("track", ["b"], "pop/2") == []
+
+    seen.release("track", ["b"], "rock/1")
+    assert seen.claim("track", ["a", "b"], "pop/2") == ["b"]
+
+
+def test_kinds_are_claimed_separately(tmp_path):
+
+    seen = SeenSet(str(tmp_path / "seen.sqlite3"))
+
+    assert seen.claim("track", ["a"], "rock/1") == ["a"]
+    assert seen.claim("artist", ["a"], "pop/2") == ["a"]
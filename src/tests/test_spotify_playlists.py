@@ -0,0 +1,86 @@
+"""
+    Tests of the playlist fetch in commons.spotify_playlists
+"""
+
+# Import libraries
+import json
+import pytest
+
+pytest.importorskip("requests")
+
+from commons import spotify_playlists
+
+
+class Response:
+
+    def __init__(self, body):
+
+        self.content = json.dumps(body).encode("utf-8")
+
+
+class Cache:
+    """
+        In-memory stand-in of the entity cache
+    """
+
+    def __init__(self):
+
+        self.entries = {}
+
+    def get_many(self, kind, ids):
+
+        return {entity_id : self.entries[entity_id] for entity_id in ids if entity_id in self.entries}
+
+    def put_many(self, kind, entries):
+
+        self.entries.update(entries)
+
+
+def items(track_ids):
+
+    return [{"track" : {"id" : track_id}} for track_id in track_ids]
+
+
+@pytest.fixture
+def playlist(monkeypatch):
+
+    cache = Cache()
+    pages = {100 : {"items" : items(["c"]), "total" : 201}, 200 : {"items" : items(["d"]), "total" : 201}}
+
+    header = {"snapshot_id" : "snapshot-1", "tracks" : {"items" : items(["a"] * 100), "total" : 201}}
+
+    monkeypatch.setattr(spotify_playlists, "entity_cache", cache)
+    monkeypatch.setattr(spotify_playlists, "api_request", lambda url, headers, params: Response(header))
+    monkeypatch.setattr(spotify_playlists, "iter_pages",
+                        lambda token, url, page_size, params, first_page: [(0, first_page), *pages.items()])
+
+    return cache, pages
+
+
+def test_complete_playlist_is_cached(playlist):
+
+    cache, pages = playlist
+
+    track_ids = spotify_playlists.get_playlist_track_ids("token", "playlist")
+
+    assert track_ids == ["a"] * 100 + ["c", "d"]
+    assert cache.entries["playlist"] == {"snapshot_id" : "snapshot-1", "tracks" : track_ids}
+
+
+def test_failed_page_raises_and_is_not_cached(playlist):
+
+    cache, pages = playlist
+    pages[100] = None
+
+    with pytest.raises(RuntimeError):
+        spotify_playlists.get_playlist_track_ids("token", "playlist")
+
+    assert cache.entries == {}
+
+
+def test_failed_header_raises(playlist, monkeypatch):
+
+    monkeypatch.setattr(spotify_playlists, "api_request", lambda url, headers, params: None)
+
+    with pytest.raises(RuntimeError):
+        spotify_playlists.get_playlist_track_ids("token", "playlist")
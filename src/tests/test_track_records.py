@@ -0,0 +1,77 @@
+"""
+    Tests of the track and audio features join in commons.track_records
+"""
+
+# Import libraries
+import pytest
+from commons.track_records import TrackRecord, join_track_features
+
+
+def track(track_id):
+
+    return TrackRecord(id=track_id, name=track_id.upper(), duration_ms=1)
+
+
+def features(track_id, danceability):
+
+    return TrackRecord(id=track_id, duration_ms=2, danceability=danceability)
+
+
+def test_features_are_joined_by_track_id():
+
+    merged, without_features, without_info = join_track_features(
+        [track("a"), track("b"), track("c")],
+        [features("c", 0.3), features("a", 0.1), features("b", 0.2)])
+
+    assert [(record.id, record.danceability) for record in merged] == [("a", 0.1), ("b", 0.2), ("c", 0.3)]
+    assert without_features == []
+    assert without_info == []
+
+
+def test_missing_entries_only_lose_their_own_track():
+
+    merged, without_features, without_info = join_track_features(
+        [track("a"), None, track("b"), track("c")],
+        [features("c", 0.3), None, features("a", 0.1), features("d", 0.4)])
+
+    assert [record.id for record in merged] == ["a", "c"]
+    assert without_features == ["b"]
+    assert without_info == ["d"]
+
+
+def test_duration_of_the_audio_features_wins():
+
+    merged, _, _ = join_track_features([track("a")], [features("a", 0.1)])
+
+    assert merged[0].duration_ms == 2
+    assert merged[0].name == "A"
+
+
+def test_relinked_track_is_joined_by_the_requested_id():
+
+    album = {"album_type" : "album", "id" : "album", "name" : "Album", "release_date" : "2020"}
+
+    # Requested as 'a', relinked by the market to 'a-us'
+    relinked = {"id" : "a-us", "linked_from" : {"id" : "a"}, "name" : "a", "artists" : [], "album" : album,
+                "duration_ms" : 1, "popularity" : 50}
+
+    merged, without_features, without_info = join_track_features([TrackRecord.from_track(relinked)], [features("a", 0.1)])
+
+    assert [(record.id, record.danceability) for record in merged] == [("a", 0.1)]
+    assert without_features == []
+    assert without_info == []
+
+
+def test_cached_track_keeps_the_requested_id(monkeypatch):
+
+    pytest.importorskip("requests")
+
+    from commons import spotify_client
+
+    monkeypatch.setattr(spotify_client.entity_cache, "put_many", lambda kind, entries: None)
+
+    track = {"id" : "a-us", "linked_from" : {"id" : "a", "href" : "url"}, "name" : "a", "available_markets" : []}
+
+    cached = spotify_client.cache_batch("track", ["a"], [track])
+
+    assert cached == {"a" : {"id" : "a-us", "linked_from" : {"id" : "a"}, "name" : "a"}}
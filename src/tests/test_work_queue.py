@@ -0,0 +1,126 @@
+"""
+    Tests of the SQLite work queue in commons.work_queue
+"""
+
+# Import libraries
+import time
+import threading
+from commons.work_queue import SQLiteWorkQueue, keep_leased, work
+
+
+def make_queue(tmp_path, visibility_timeout=60, max_attempts=3):
+
+    return SQLiteWorkQueue(str(tmp_path / "queue.sqlite3"), "test", visibility_timeout, max_attempts)
+
+
+def test_enqueue_is_idempotent(tmp_path):
+
+    queue = make_queue(tmp_path)
+
+    assert queue.enqueue({"a" : {"n" : 1}, "b" : {"n" : 2}}) == 2
+    assert queue.enqueue({"a" : {"n" : 1}, "c" : {"n" : 3}}) == 1
+    assert queue.counts()["ready"] == 3
+
+
+def test_ack_marks_the_item_done(tmp_path):
+
+    queue = make_queue(tmp_path)
+    queue.enqueue({"a" : {"n" : 1}})
+
+    item_id, payload = queue.lease("worker-1")
+
+    assert (item_id, payload) == ("a", {"n" : 1})
+    assert queue.lease("worker-2") is None
+    assert queue.ack("a", "worker-1")
+    assert queue.counts() == {"ready" : 0, "leased" : 0, "done" : 1, "failed" : 0}
+
+
+def test_expired_lease_is_delivered_again(tmp_path):
+
+    queue = make_queue(tmp_path, visibility_timeout=0.1)
+    queue.enqueue({"a" : {}})
+
+    assert queue.lease("worker-1")[0] == "a"
+
+    time.sleep(0.2)
+
+    # The item of a worker that stopped answering goes to another worker
+    assert queue.lease("worker-2")[0] == "a"
+
+    # The first worker lost its lease, only the second one can ack
+    assert not queue.ack("a", "worker-1")
+    assert queue.ack("a", "worker-2")
+
+
+def test_extended_lease_is_not_delivered_again(tmp_path):
+
+    queue = make_queue(tmp_path, visibility_timeout=0.2)
+    queue.enqueue({"a" : {}})
+
+    queue.lease("worker-1")
+
+    for _ in range(3):
+
+        time.sleep(0.1)
+
+        assert queue.extend("a", "worker-1")
+
+    assert queue.lease("worker-2") is None
+    assert not queue.extend("a", "worker-2")
+
+
+def test_stuck_item_goes_back_on_the_queue(tmp_path):
+
+    queue = make_queue(tmp_path, visibility_timeout=0.1)
+    queue.enqueue({"a" : {}})
+
+    queue.lease("worker-1")
+
+    # The lease of an item processed for longer than max_duration is left to expire
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=keep_leased, args=(queue, "a", "worker-1", stop, 0.2))
+    heartbeat.start()
+
+    time.sleep(0.15)
+    assert queue.lease("worker-2") is None
+
+    heartbeat.join(1)
+    time.sleep(0.15)
+
+    assert not heartbeat.is_alive()
+    assert queue.lease("worker-2")[0] == "a"
+
+    stop.set()
+
+
+def test_item_is_set_aside_after_its_attempts(tmp_path):
+
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue({"a" : {}})
+
+    for attempt in range(2):
+
+        assert queue.lease("worker-1")[0] == "a"
+
+        queue.nack("a", "worker-1", "boom")
+
+    assert queue.lease("worker-1") is None
+    assert queue.counts()["failed"] == 1
+
+
+def test_work_processes_each_item_once(tmp_path):
+
+    queue = make_queue(tmp_path, visibility_timeout=0.1)
+    queue.enqueue({str(i) : {"n" : i} for i in range(5)})
+
+    seen = []
+
+    # Slower than the visibility timeout, the lease must be kept alive meanwhile
+    def handler(item_id, payload):
+
+        time.sleep(0.25)
+        seen.append(item_id)
+
+    assert work(queue, handler) == 5
+    assert sorted(seen) == ["0", "1", "2", "3", "4"]
+    assert queue.counts()["done"] == 5